@@ -0,0 +1,165 @@
+"""
+Offline end-to-end benchmark of `main()`, against local stand-ins of GitHub and conda (see `offline.py`).
+
+Each scenario commits to the local project repository, dispatches the corresponding event, and measures the
+latency of `main()` and of its phases:
+ * push-ci: push of a commit with a [CI] tag, which rerenders and releases the feedstock,
+ * push-rerender: push of a commit with a [rerender] tag, which only rerenders the feedstock,
+ * nightly-recent: nightly event after a commit of the last hours, which rerenders and releases the feedstock,
+ * nightly-stale: nightly event after a commit of several days ago, which only rerenders the feedstock.
+
+Usage: python benchmarks/bench_dispatch.py [--scenarios push-ci nightly-stale] [--repeat 5] [--rerender-delay 1]
+                                           [--warm] [--json results.json] [--verbose]
+"""
+import os
+import sys
+import json
+import time
+import logging
+import shutil
+import argparse
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from offline import FakeGitHub, commit_files, install_stub_conda, make_repositories
+from instrument import percentile
+import instrument
+import main
+
+REPO_NAME = "tudat-team/tudatpy"
+BRANCH = "develop"
+
+# Commit message and age of the commit, and event type, of each scenario
+SCENARIOS = {
+    "push-ci": ("push", "Fix the propagation setup [CI]", 0),
+    "push-rerender": ("push", "Update the build requirements [rerender]", 0),
+    "nightly-recent": ("nightly", "Fix the propagation setup", 3600),
+    "nightly-stale": ("nightly", "Fix the propagation setup", 3 * 24 * 3600),
+}
+
+@contextlib.contextmanager
+def quiet(enabled):
+    """
+    Silence the logs, and the output of the subprocesses, which write to the file descriptors directly.
+    """
+    if not enabled:
+        yield
+        return
+    logging.disable(logging.CRITICAL)
+    saved = [os.dup(1), os.dup(2)]
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(devnull, 1)
+    os.dup2(devnull, 2)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(saved[0], 1)
+        os.dup2(saved[1], 2)
+        for fd in saved + [devnull]:
+            os.close(fd)
+        logging.disable(logging.NOTSET)
+
+def run_scenario(name, root, github_root, repeat, warm, verbose):
+    """
+    Run a scenario several times, with new repositories in the directory of the fake GitHub.
+    Returns
+    -------
+    list[dict]
+        The total duration, the duration of each phase, the number of GitHub API calls, and the error of each run.
+    """
+    event_type, message, age = SCENARIOS[name]
+    scenario_dir = os.path.join(root, name)
+    shutil.rmtree(github_root, ignore_errors=True)
+    project, _ = make_repositories(github_root, REPO_NAME, BRANCH)
+    runs = []
+    for i in range(repeat):
+        # A new cache for each run, unless the runs are warm
+        os.environ["CACHE_DIR"] = os.path.join(scenario_dir, "cache" if warm else "cache-%d" % i)
+        os.environ["GITHUB_WORKSPACE"] = os.path.join(scenario_dir, "workspace-%d" % i)
+        os.makedirs(os.environ["GITHUB_WORKSPACE"])
+
+        sha = commit_files(project, BRANCH, {"src/project/change.py": "# change %d\n" % i}, message,
+                           timestamp=time.time() - age)
+        event_path = os.path.join(scenario_dir, "event-%d.json" % i)
+        with open(event_path, "w") as fp:
+            json.dump(dict(client_payload=dict(event=event_type, repository=REPO_NAME, ref_name=BRANCH,
+                                               ref="refs/heads/" + BRANCH, ref_type="branch", sha=sha)), fp)
+        os.environ["GITHUB_EVENT_PATH"] = event_path
+
+        error = None
+        start_time = time.perf_counter()
+        with quiet(not verbose):
+            try:
+                main.main()
+            except (Exception, SystemExit) as e:
+                error = repr(e)
+        duration = time.perf_counter() - start_time
+
+        report = instrument.get_report()
+        phases = {}
+        for record in report["spans"]:
+            phases[record["name"]] = phases.get(record["name"], 0) + record.get("wall_time", 0)
+        runs.append(dict(duration=duration, phases=phases, api_calls=report["totals"].get("github_api_calls", 0),
+                         error=error))
+    return runs
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--rerender-delay", type=float, default=1.0,
+                        help="duration of the stub `conda smithy rerender`, in seconds")
+    parser.add_argument("--warm", action="store_true", help="keep the cache of the action between the runs")
+    parser.add_argument("--json", help="write the measurements of all runs to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the logs of the action")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root, FakeGitHub(os.path.join(root, "github")) as github:
+        install_stub_conda(os.path.join(root, "bin"))
+        os.environ.update(
+            PATH=os.path.join(root, "bin") + os.pathsep + os.environ["PATH"],
+            STUB_RERENDER_DELAY=str(args.rerender_delay),
+            PINNING_VERSION="2024.01.01",
+            GH_TOKEN="offline",
+            GITHUB_EVENT_NAME="repository_dispatch",
+            GITHUB_API_URL=github.url,
+            GITHUB_GRAPHQL_URL=github.url + "/graphql",
+            GITHUB_SERVER_URL="file://" + os.path.join(root, "github"),
+            # The clones and pushes of the fake repositories must not use the configuration of the user
+            GIT_CONFIG_GLOBAL=os.devnull,
+            GIT_CONFIG_NOSYSTEM="1",
+        )
+        for name in ["TEST_DICT", "RUN_REPORT", "GITHUB_STEP_SUMMARY", "PROFILE_DIR"]:
+            os.environ.pop(name, None)
+
+        runs_dir, github_root = os.path.join(root, "runs"), os.path.join(root, "github")
+        results = {}
+        print("%-16s %5s %8s %8s %8s %8s %6s  %s" % (
+            "scenario", "runs", "p50 [s]", "p95 [s]", "max [s]", "api", "errors", "phases p50 [s]"))
+        for name in args.scenarios:
+            runs = run_scenario(name, runs_dir, github_root, args.repeat, args.warm, args.verbose)
+            results[name] = runs
+            durations = [run["duration"] for run in runs]
+            phase_names = sorted({phase for run in runs for phase in run["phases"]})
+            phases = ", ".join("%s %.2f" % (phase, percentile([run["phases"].get(phase, 0) for run in runs], 0.5))
+                               for phase in phase_names)
+            print("%-16s %5d %8.2f %8.2f %8.2f %8.1f %6d  %s" % (
+                name, len(runs), percentile(durations, 0.5), percentile(durations, 0.95), max(durations),
+                sum(run["api_calls"] for run in runs) / len(runs), sum(run["error"] is not None for run in runs),
+                phases))
+            for run in runs:
+                if run["error"] is not None:
+                    print("  error: %s" % run["error"])
+
+    if args.json:
+        with open(args.json, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -0,0 +1,75 @@
+"""
+Benchmark of the `recipe` module against the `get_var_values` and `substitute_vars_in_file` functions of `util`.
+
+Usage: python benchmarks/bench_recipe.py [--variables 3 10 100] [--files 1 4] [--repeat 20]
+"""
+import os
+import re
+import sys
+import shutil
+import timeit
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from util import get_var_values, substitute_vars_in_file
+from recipe import Recipe
+
+
+def make_feedstock(root, n_variables, n_files):
+    files = []
+    for i in range(n_files):
+        file = "recipe/file%d.yaml" % i
+        lines = ['{%% set var%d = "%d" %%}' % (j, j) for j in range(n_variables)]
+        # Pad the recipe with content that is not a variable, as in a real meta.yaml
+        lines += ["package:", "  name: project", "requirements:"] + ["    - dependency%d" % j for j in range(100)]
+        os.makedirs(os.path.join(root, "recipe"), exist_ok=True)
+        with open(os.path.join(root, file), "w") as fp:
+            fp.write("\n".join(lines) + "\n")
+        files.append(file)
+    return files
+
+def edit_with_util(root, files, names):
+    var_retrieve = [(name, file, re.compile(r'{%\s*set\s*' + name + r'\s*=\s*"([^"]*)"\s*%}'))
+                    for file in files for name in names]
+    values = get_var_values(var_retrieve, root)
+    substitute_vars_in_file([
+        (file, re.compile(r'{%\s*set\s*' + name + r'\s*=\s*"([^"]*)"\s*%}'), '{% set ' + name + ' = "{}" %}',
+         int(values[name]) + 1)
+        for file in files for name in names
+    ], root)
+
+def edit_with_recipe(root, files, names):
+    recipe = Recipe(root, files=files)
+    values = recipe.get_all(names)
+    for name in names:
+        recipe.set(name, int(values[name]) + 1)
+    recipe.write()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--variables", type=int, nargs="+", default=[3, 10, 100])
+    parser.add_argument("--files", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print("%10s %6s %14s %14s %8s" % ("variables", "files", "util [ms]", "recipe [ms]", "speedup"))
+    for n_files in args.files:
+        for n_variables in args.variables:
+            names = ["var%d" % j for j in range(n_variables)]
+            timings, outputs = {}, {}
+            for name, edit in [("util", edit_with_util), ("recipe", edit_with_recipe)]:
+                root = tempfile.mkdtemp()
+                try:
+                    files = make_feedstock(root, n_variables, n_files)
+                    timings[name] = min(timeit.repeat(lambda: edit(root, files, names), number=1, repeat=args.repeat))
+                    outputs[name] = [open(os.path.join(root, file)).read() for file in files]
+                finally:
+                    shutil.rmtree(root)
+            # Both implementations must produce the same files
+            assert outputs["util"] == outputs["recipe"], "outputs differ"
+            print("%10d %6d %14.3f %14.3f %7.1fx" % (n_variables, n_files, timings["util"] * 1e3,
+                                                     timings["recipe"] * 1e3, timings["util"] / timings["recipe"]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Check the startup latency of the events that `main()` ignores, against a time budget.
+
+Each path runs `main()` in a new interpreter, measuring the time from before `import main` until `main()` returns,
+and the heavy modules that were loaded:
+ * not-dispatch: an event that is not a repository dispatch,
+ * not-branch: a repository dispatch for a tag,
+ * no-tag: a push of a commit without tags, whose message is read from the fake GitHub server of `offline.py`,
+ * payload-no-tag: a push of commits without tags, whose messages are in the payload.
+The script exits with an error if the median time of a path exceeds its budget, or if a module that the path
+does not need was imported. The same checks are run by `tests/test_import_time.py`.
+
+Usage: python benchmarks/check_import_time.py [--repeat 5] [--budget 100] [--network-budget 400]
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import contextlib
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from offline import FakeGitHub, commit_files, make_repositories
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["github", "pygit2", "requests", "urllib3", "bumpversion"]
+
+# Run in a new interpreter, so that nothing is imported yet
+CHILD_CODE = """
+import sys, time, json
+start = time.perf_counter()
+import main
+main.main()
+duration = time.perf_counter() - start
+print(json.dumps(dict(duration=duration, modules=[m for m in %r if m in sys.modules])))
+""" % HEAVY_MODULES
+
+def run_path(event_name, payload, env, repeat):
+    """
+    Run `main()` for an event several times, each in a new interpreter.
+    Returns
+    -------
+    list[dict]
+        The duration, in seconds, and the heavy modules imported, of each run.
+    """
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as fp:
+        json.dump(dict(client_payload=payload), fp)
+    env = dict(env, GITHUB_EVENT_NAME=event_name, GITHUB_EVENT_PATH=fp.name)
+    results = []
+    try:
+        for _ in range(repeat):
+            output = subprocess.run([sys.executable, "-c", CHILD_CODE], cwd=ROOT, env=env, check=True,
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+            results.append(json.loads(output.decode("utf-8").strip().splitlines()[-1]))
+    finally:
+        os.unlink(fp.name)
+    return results
+
+@contextlib.contextmanager
+def offline_environment():
+    """
+    Start the fake GitHub server with the repositories of `offline.py`, and push a commit without tags to the project.
+    Yields
+    ------
+    env : dict[str, str]
+        The environment of the runs, with the GitHub API pointing to the fake server.
+    payload : dict
+        The client payload of the push of the commit.
+    """
+    with tempfile.TemporaryDirectory() as root, FakeGitHub(os.path.join(root, "github")) as github:
+        project, _ = make_repositories(os.path.join(root, "github"))
+        sha = commit_files(project, "develop", {"README.md": "# Changed\n"}, "Update the readme")
+        env = dict(os.environ, GH_TOKEN="offline", GITHUB_WORKSPACE=root, CACHE_DIR=os.path.join(root, "cache"),
+                   GITHUB_API_URL=github.url, GITHUB_GRAPHQL_URL=github.url + "/graphql", PYTHONPATH=ROOT)
+        for name in ["TEST_DICT", "RUN_REPORT", "GITHUB_STEP_SUMMARY", "PROFILE_DIR"]:
+            env.pop(name, None)
+        payload = dict(event="push", repository="tudat-team/tudatpy", ref_name="develop",
+                       ref="refs/heads/develop", ref_type="branch", sha=sha)
+        yield env, payload
+
+def get_paths(payload, budget=100, network_budget=400):
+    """
+    Get the paths to check, from the client payload of a push without tags.
+    Returns
+    -------
+    list[tuple]
+        The name, event name, client payload, budget in milliseconds and forbidden modules of each path.
+    """
+    return [
+        ("not-dispatch", "push", payload, budget, HEAVY_MODULES),
+        ("not-branch", "repository_dispatch", dict(payload, ref_type="tag"), budget, HEAVY_MODULES),
+        ("no-tag", "repository_dispatch", payload, network_budget, ["github", "pygit2", "bumpversion"]),
+        ("payload-no-tag", "repository_dispatch", dict(payload, commits=[dict(message="Update the readme")]),
+         budget, HEAVY_MODULES),
+    ]
+
+def check_path(event_name, payload, env, budget, forbidden, repeat):
+    """
+    Run a path several times, and check its median duration and the modules it imported.
+    Returns
+    -------
+    dict
+        The median and maximum durations, in milliseconds, the heavy modules imported, and the status of the path:
+        "ok", "over budget" or the forbidden modules imported.
+    """
+    results = run_path(event_name, payload, env, repeat)
+    durations = sorted(result["duration"] * 1000 for result in results)
+    median = durations[len(durations) // 2]
+    modules = sorted({module for result in results for module in result["modules"]})
+    unexpected = [module for module in modules if module in forbidden]
+    status = "ok"
+    if median > budget:
+        status = "over budget"
+    if unexpected:
+        status = "imports %s" % ", ".join(unexpected)
+    return dict(median=median, max=durations[-1], modules=modules, status=status)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=100,
+                        help="budget of the paths that exit before any request, in milliseconds")
+    parser.add_argument("--network-budget", type=float, default=400,
+                        help="budget of the paths that request the GitHub API, in milliseconds")
+    args = parser.parse_args()
+
+    with offline_environment() as (env, payload):
+        failed = False
+        print("%-14s %10s %10s %8s  %s" % ("path", "p50 [ms]", "max [ms]", "budget", "heavy modules"))
+        for name, event_name, event_payload, budget, forbidden in get_paths(payload, args.budget,
+                                                                            args.network_budget):
+            result = check_path(event_name, event_payload, env, budget, forbidden, args.repeat)
+            failed |= result["status"] != "ok"
+            print("%-14s %10.1f %10.1f %8.0f  %s (%s)" % (
+                name, result["median"], result["max"], budget, ", ".join(result["modules"]) or "-", result["status"]))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
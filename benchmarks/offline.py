@@ -0,0 +1,298 @@
+"""
+Local stand-ins for the services used by the action, to run it without network access:
+
+ * bare git repositories mimicking a project and its feedstock, cloned from and pushed to over file://,
+ * a fake GitHub server answering the REST (repositories, commits, branches, contents and compare) and GraphQL
+   requests of the action from these repositories,
+ * a stub `conda` executable, whose `conda smithy rerender` takes a configurable time.
+"""
+import os
+import re
+import sys
+import json
+import time
+import base64
+import hashlib
+import threading
+import http.server
+import urllib.parse
+import pygit2
+
+PROJECT_FILES = {
+    "version": "0.7.3.dev0\n",
+    ".bumpversion.cfg": """[bumpversion]
+current_version = 0.7.3.dev0
+commit = True
+tag = False
+parse = (?P<major>\\d+)\\.(?P<minor>\\d+)\\.(?P<patch>\\d+)(\\.(?P<release>[a-z]+)(?P<dev>\\d+))?
+serialize =
+\t{major}.{minor}.{patch}.{release}{dev}
+\t{major}.{minor}.{patch}
+
+[bumpversion:part:release]
+optional_value = gamma
+values =
+\tdev
+\tgamma
+
+[bumpversion:part:dev]
+
+[bumpversion:file:version]
+""",
+    "README.md": "# Project\n",
+    "src/project/__init__.py": "",
+}
+
+FEEDSTOCK_FILES = {
+    "recipe/meta.yaml": """{% set name = "tudatpy" %}
+{% set version = "0.7.3.dev0" %}
+{% set build = "0" %}
+{% set git_rev = "v0.7.3.dev0" %}
+
+package:
+  name: {{ name|lower }}
+  version: {{ version }}
+
+source:
+  git_url: https://github.com/tudat-team/tudatpy.git
+  git_rev: {{ git_rev }}
+
+build:
+  number: {{ build }}
+""",
+    "recipe/conda_build_config.yaml": "channel_targets:\n  - tudat-team dev\n",
+    "conda-forge.yml": "channels:\n  targets:\n    - [tudat-team, dev]\n",
+    "README.md": "# Feedstock\n",
+}
+
+STUB_CONDA = """#!%(python)s
+import os, sys, json, time, subprocess
+args = sys.argv[1:]
+if args[:1] == ["list"]:
+    print(json.dumps([{"name": "conda", "version": "24.1.2"}, {"name": "conda-smithy", "version": "3.30.0"}]))
+elif args[:2] == ["smithy", "rerender"]:
+    time.sleep(float(os.environ.get("STUB_RERENDER_DELAY", "1")))
+    os.makedirs(".ci_support", exist_ok=True)
+    with open(os.path.join(".ci_support", "linux_64_.yaml"), "w") as fp:
+        fp.write("rendered_at: %%f\\n" %% time.time())
+    subprocess.run(["git", "add", "--all"], check=True)
+    print("INFO:conda_smithy:Rerendering the feedstock")
+    print('You can commit the changes with:\\n\\n    git commit -m "MNT: Re-rendered with conda-build 24.1.2, '
+          'conda-smithy 3.30.0, and conda-forge-pinning 2024.01.01"\\n')
+else:
+    time.sleep(float(os.environ.get("STUB_SOLVER_DELAY", "5")))
+"""
+
+def commit_files(repo, branch, files, message, timestamp=None):
+    """
+    Commit files on a branch of a bare repository, on top of its current head.
+    Parameters
+    ----------
+    repo : pygit2.Repository
+        The bare repository.
+    branch : str
+        The branch name, created if it does not exist.
+    files : dict[str, str]
+        The content of each file to add or replace, by path.
+    message : str
+        The commit message.
+    timestamp : float, optional
+        The author and committer time (default: now).
+    Returns
+    -------
+    str
+        The commit id.
+    """
+    reference = repo.references.get("refs/heads/" + branch)
+    parents = [reference.target] if reference is not None else []
+    index = pygit2.Index()
+    if parents:
+        index.read_tree(repo[parents[0]].tree)
+    for path, content in files.items():
+        index.add(pygit2.IndexEntry(path, repo.create_blob(content.encode("utf-8")), pygit2.enums.FileMode.BLOB))
+    signature = pygit2.Signature("Developer", "developer@example.com", int(timestamp or time.time()), 0)
+    commit_id = repo.create_commit("refs/heads/" + branch, signature, signature, message, index.write_tree(repo),
+                                   parents)
+    return str(commit_id)
+
+def make_repositories(root, repo_name="tudat-team/tudatpy", branch="develop"):
+    """
+    Create the bare repositories of a project and its feedstock, in "<root>/<owner>/<name>.git".
+    Returns
+    -------
+    tuple[pygit2.Repository, pygit2.Repository]
+        The project and feedstock repositories.
+    """
+    repos = []
+    for name, files in [(repo_name, PROJECT_FILES), (repo_name + "-feedstock", FEEDSTOCK_FILES)]:
+        repo = pygit2.init_repository(os.path.join(root, name + ".git"), bare=True)
+        repo.set_head("refs/heads/" + branch)
+        commit_files(repo, branch, files, "Initial commit")
+        repos.append(repo)
+    return tuple(repos)
+
+def install_stub_conda(bin_dir):
+    """
+    Write the stub `conda` executable to a directory, to be put first in the PATH.
+    """
+    os.makedirs(bin_dir, exist_ok=True)
+    path = os.path.join(bin_dir, "conda")
+    with open(path, "w") as fp:
+        fp.write(STUB_CONDA % dict(python=sys.executable))
+    os.chmod(path, 0o755)
+    return path
+
+class FakeGitHub(http.server.ThreadingHTTPServer):
+    """
+    HTTP server answering the GitHub REST and GraphQL requests of the action from the bare repositories of a
+    directory. The repositories are reported with file:// urls, and responses have an ETag, so that conditional
+    requests get a 304.
+    Parameters
+    ----------
+    root : str
+        The directory containing the repositories, as "<owner>/<name>.git".
+    """
+    def __init__(self, root):
+        super().__init__(("127.0.0.1", 0), FakeGitHubHandler)
+        self.root = root
+        self.requests = 0
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d" % self.server_address[1]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+    def get_repo(self, repo_name):
+        path = os.path.join(self.root, repo_name + ".git")
+        return pygit2.Repository(path) if os.path.isdir(path) else None
+
+    def get_url(self, repo_name):
+        return "file://%s/%s" % (os.path.abspath(self.root), repo_name)
+
+def format_date(timestamp):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(timestamp))
+
+class FakeGitHubHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.requests += 1
+        request_url = urllib.parse.urlparse(self.path)
+        parts = request_url.path.strip("/").split("/")
+        if len(parts) < 3 or parts[0] != "repos":
+            return self.send_json(404, dict(message="Not Found"))
+        repo_name = "/".join(parts[1:3])
+        repo = self.server.get_repo(repo_name)
+        if repo is None:
+            return self.send_json(404, dict(message="Not Found"))
+        url = self.server.get_url(repo_name)
+        if len(parts) == 3:
+            return self.send_json(200, dict(full_name=repo_name, clone_url=url + ".git", html_url=url))
+        if parts[3] == "contents":
+            ref = urllib.parse.parse_qs(request_url.query).get("ref", ["HEAD"])[0]
+            return self.send_contents(repo, "/".join(parts[4:]), ref)
+        if parts[3] == "compare":
+            return self.send_compare(repo, "/".join(parts[4:]))
+        try:
+            if parts[3] == "commits":
+                commit = repo.revparse_single(parts[4]).peel(pygit2.Commit)
+            elif parts[3] == "branches":
+                commit = repo.lookup_reference("refs/heads/" + "/".join(parts[4:])).peel(pygit2.Commit)
+            else:
+                return self.send_json(404, dict(message="Not Found"))
+        except (KeyError, ValueError, IndexError):
+            return self.send_json(404, dict(message="Not Found"))
+        data = dict(sha=str(commit.id), commit=dict(
+            message=commit.message, author=dict(name=commit.author.name, date=format_date(commit.author.time))))
+        if parts[3] == "branches":
+            data = dict(name="/".join(parts[4:]), commit=data)
+        self.send_json(200, data)
+
+    def send_contents(self, repo, path, ref):
+        try:
+            reference = repo.references.get("refs/heads/" + ref)
+            tree = (reference.peel(pygit2.Commit) if reference is not None else repo.revparse_single(ref)).tree
+            entry = tree[path] if path else tree
+        except (KeyError, ValueError):
+            return self.send_json(404, dict(message="Not Found"))
+        if isinstance(entry, pygit2.Tree):
+            return self.send_json(200, [
+                dict(name=child.name, path=os.path.join(path, child.name), sha=str(child.id),
+                     type="dir" if child.type_str == "tree" else "file")
+                for child in entry])
+        content = base64.encodebytes(repo[entry.id].data).decode("ascii")
+        self.send_json(200, dict(name=entry.name, path=path, sha=str(entry.id), type="file", encoding="base64",
+                                 content=content))
+
+    def send_compare(self, repo, spec):
+        base, _, head = spec.partition("...")
+        try:
+            walker = repo.walk(repo.revparse_single(head).peel(pygit2.Commit).id,
+                               pygit2.enums.SortMode.TOPOLOGICAL | pygit2.enums.SortMode.REVERSE)
+            walker.hide(repo.revparse_single(base).peel(pygit2.Commit).id)
+        except (KeyError, ValueError):
+            return self.send_json(404, dict(message="Not Found"))
+        commits = [dict(sha=str(commit.id), commit=dict(message=commit.message)) for commit in walker]
+        self.send_json(200, dict(total_commits=len(commits), commits=commits))
+
+    def do_POST(self):
+        self.server.requests += 1
+        if urllib.parse.urlparse(self.path).path != "/graphql":
+            return self.send_json(404, dict(message="Not Found"))
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        variables = request.get("variables") or {}
+        data, errors = {}, []
+
+        def get_repository(owner, name, sha=None, branch=None):
+            repo = self.server.get_repo("%s/%s" % (owner, name))
+            if repo is None:
+                errors.append(dict(type="NOT_FOUND", message="Could not resolve to a Repository"))
+                return None
+            result = dict(url=self.server.get_url("%s/%s" % (owner, name)))
+            if sha is not None:
+                result["commit"] = dict(message=repo.revparse_single(sha).peel(pygit2.Commit).message)
+            if branch is not None:
+                reference = repo.references.get(branch)
+                commit = None if reference is None else reference.peel(pygit2.Commit)
+                result["branch"] = None if commit is None else dict(
+                    target=dict(oid=str(commit.id), authoredDate=format_date(commit.author.time)))
+            return result
+
+        if variables:
+            # Query of a single dispatch event, with variables
+            data["project"] = get_repository(
+                variables["owner"], variables["name"], variables.get("sha"), variables.get("branch"))
+            data["feedstock"] = get_repository(variables["owner"], variables["feedstock"])
+        else:
+            # Query of several nightly targets, with literal arguments
+            for alias, arguments in re.findall(r'(\w+): repository\(([^)]*)\)', request["query"]):
+                args = dict(re.findall(r'(\w+): ("[^"]*")', arguments))
+                branch = re.search(r'%s: repository\([^)]*\) \{ url branch: ref\(qualifiedName: ("[^"]*")' % alias,
+                                   request["query"])
+                data[alias] = get_repository(json.loads(args["owner"]), json.loads(args["name"]),
+                                             branch=json.loads(branch.group(1)) if branch else None)
+        self.send_json(200, dict(data=data, errors=errors) if errors else dict(data=data))
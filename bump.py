@@ -0,0 +1,275 @@
+import os
+import re
+import logging
+import threading
+import configparser
+import git_backend
+from util import write_text_atomic
+
+
+# Create logger with logging level set to all
+LOGGER = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Files in which the bumpversion configuration is searched, in order
+CONFIG_FILES = [".bumpversion.cfg", "setup.cfg"]
+# Defaults of bumpversion, used for the options that the configuration does not set
+DEFAULT_PARSE = r"(?P<major>\d+)\.(?P<minor>\d+)\.(?P<patch>\d+)"
+DEFAULT_SERIALIZE = ["{major}.{minor}.{patch}"]
+DEFAULT_MESSAGE = "Bump version: {current_version} → {new_version}"
+DEFAULT_TAG_NAME = "v{new_version}"
+
+# Locks of the repositories being bumped, so that two threads never bump the same repository at once
+_LOCKS = {}
+_LOCKS_LOCK = threading.Lock()
+
+def _get_lock(directory):
+    with _LOCKS_LOCK:
+        return _LOCKS.setdefault(os.path.realpath(directory), threading.Lock())
+
+def _get_list(value):
+    return [line.strip() for line in value.strip().splitlines() if line.strip()]
+
+class VersionPart:
+    """
+    The configuration of a part of the version, which defines how it is bumped and reset, like the
+    `[bumpversion:part:<name>]` sections of bumpversion.
+    A part is numeric, unless it has a list of values.
+    Parameters
+    ----------
+    values : list[str], optional
+        The values of the part, in order.
+    first_value : str, optional
+        The value the part is reset to when a part on its left is bumped (default: the first value, or "0").
+    optional_value : str, optional
+        The value for which the part can be left out of the version (default: the first value).
+    """
+    def __init__(self, values=None, first_value=None, optional_value=None):
+        self.values = values
+        self.first_value = first_value if first_value is not None else (values[0] if values else "0")
+        self.optional_value = optional_value if optional_value is not None else self.first_value
+
+    def bump(self, value):
+        """
+        Get the next value of the part.
+        """
+        if self.values:
+            index = self.values.index(value)
+            if index + 1 >= len(self.values):
+                raise ValueError("the part is already at its maximum value '%s'" % value)
+            return self.values[index + 1]
+        # Like bumpversion, increment the first number in the value, keeping the rest of it
+        match = re.search(r"\d+", value)
+        if match is None:
+            raise ValueError("the part value '%s' does not contain a number" % value)
+        return value[:match.start()] + str(int(match.group()) + 1) + value[match.end():]
+
+def read_config(directory):
+    """
+    Read the bumpversion configuration of a repository, from `.bumpversion.cfg` or `setup.cfg`.
+    Parameters
+    ----------
+    directory : str
+        The repository directory.
+    Returns
+    -------
+    dict
+        The configuration: path of its file, current version, parse regex, serialize formats, parts, files
+        (with their search and replace patterns), and wether to commit and tag, with which messages.
+    """
+    for file in CONFIG_FILES:
+        path = os.path.join(directory, file)
+        if not os.path.isfile(path):
+            continue
+        parser = configparser.RawConfigParser()
+        parser.read(path)
+        if parser.has_section("bumpversion"):
+            break
+    else:
+        raise FileNotFoundError("no bumpversion configuration found in %s" % directory)
+
+    main = parser["bumpversion"]
+    config = dict(
+        path=path,
+        current_version=main["current_version"],
+        parse=re.compile(main.get("parse", DEFAULT_PARSE), re.VERBOSE),
+        serialize=_get_list(main["serialize"]) if "serialize" in main else DEFAULT_SERIALIZE,
+        commit=main.getboolean("commit", False),
+        tag=main.getboolean("tag", False),
+        message=main.get("message", DEFAULT_MESSAGE),
+        tag_name=main.get("tag_name", DEFAULT_TAG_NAME),
+        tag_message=main.get("tag_message", DEFAULT_MESSAGE),
+        parts={},
+        files=[],
+    )
+    for section in parser.sections():
+        if not section.startswith("bumpversion:"):
+            continue
+        kind, _, name = section[len("bumpversion:"):].partition(":")
+        options = parser[section]
+        if kind == "part":
+            config["parts"][name] = VersionPart(
+                _get_list(options["values"]) if "values" in options else None,
+                options.get("first_value"), options.get("optional_value"))
+        elif kind == "file":
+            config["files"].append(dict(
+                path=name, search=options.get("search", "{current_version}"),
+                replace=options.get("replace", "{new_version}")))
+    return config
+
+def get_version_paths(directory):
+    """
+    Get the paths of the files read or written by a version bump: the configuration file and the configured files.
+    Parameters
+    ----------
+    directory : str
+        The repository directory.
+    Returns
+    -------
+    list[str]
+        The paths, relative to the repository directory.
+    """
+    config = read_config(directory)
+    paths = [os.path.relpath(config["path"], directory)] + [file["path"] for file in config["files"]]
+    return list(dict.fromkeys(paths))
+
+def parse_version(version, config):
+    """
+    Split a version into its parts.
+    Parameters
+    ----------
+    version : str
+        The version.
+    config : dict
+        The configuration, as returned by `read_config`.
+    Returns
+    -------
+    dict[str, str]
+        The value of each part, in the order of the parse regex. Parts missing from the version get their
+        optional value.
+    """
+    match = config["parse"].search(version)
+    if match is None:
+        raise ValueError("version '%s' does not match '%s'" % (version, config["parse"].pattern))
+    values = {}
+    for name in config["parse"].groupindex:
+        part = config["parts"].get(name, VersionPart())
+        values[name] = match.group(name) or part.optional_value
+    return values
+
+def bump_values(values, part_name, config):
+    """
+    Bump a part of a version, and reset the parts on its right.
+    Parameters
+    ----------
+    values : dict[str, str]
+        The value of each part, as returned by `parse_version`.
+    part_name : str
+        The part to bump.
+    config : dict
+        The configuration, as returned by `read_config`.
+    Returns
+    -------
+    dict[str, str]
+        The new value of each part.
+    """
+    if part_name not in values:
+        raise ValueError("unknown version part '%s', expected one of %s" % (part_name, list(values)))
+    new_values, bumped = {}, False
+    for name, value in values.items():
+        part = config["parts"].get(name, VersionPart())
+        if name == part_name:
+            new_values[name], bumped = part.bump(value), True
+        elif bumped:
+            new_values[name] = part.first_value
+        else:
+            new_values[name] = value
+    return new_values
+
+def serialize_version(values, config):
+    """
+    Join the parts of a version, with the serialize format that bumpversion would choose: the last format that
+    contains all parts up to the last one that does not have its optional value, or else the first format.
+    Parameters
+    ----------
+    values : dict[str, str]
+        The value of each part.
+    config : dict
+        The configuration, as returned by `read_config`.
+    Returns
+    -------
+    str
+        The version.
+    """
+    names = list(values)
+    needed = []
+    for index, name in enumerate(names):
+        if values[name] != config["parts"].get(name, VersionPart()).optional_value:
+            needed = names[:index + 1]
+    chosen = None
+    for serialize_format in config["serialize"]:
+        if set(needed) <= set(re.findall(r"{(\w+)}", serialize_format)) or chosen is None:
+            chosen = serialize_format
+    return chosen.format(**values)
+
+def bump_version(directory, part_name, commit=None, tag=None, backend=None):
+    """
+    Bump the version of a repository, like `bumpversion <part>` run in its directory, without changing the working
+    directory of the process.
+    The files of the configuration are updated, and the change is committed and tagged if configured. Bumps of
+    different repositories can run concurrently from several threads.
+    Parameters
+    ----------
+    directory : str
+        The repository directory.
+    part_name : str
+        The part of the version to bump, e.g. "dev" or "patch".
+    commit : bool, optional
+        Wether to commit the changes (default: from the configuration).
+    tag : bool, optional
+        Wether to tag the commit (default: from the configuration).
+    backend : str, optional
+        The git backend used to commit and tag (default: from `git_backend.get_backend`).
+    Returns
+    -------
+    str
+        The new version.
+    """
+    with _get_lock(directory):
+        config = read_config(directory)
+        current_version = config["current_version"]
+        current_values = parse_version(current_version, config)
+        new_values = bump_values(current_values, part_name, config)
+        new_version = serialize_version(new_values, config)
+        LOGGER.info("bumping %s of %s from %s to %s", part_name, directory, current_version, new_version)
+
+        context = dict(current_version=current_version, new_version=new_version)
+        context.update({"current_" + name: value for name, value in current_values.items()})
+        context.update({"new_" + name: value for name, value in new_values.items()})
+
+        # Edit all files in memory first, so that no file is written if one of them does not contain the version
+        edits = {}
+        for file in config["files"]:
+            path = os.path.join(directory, file["path"])
+            text = edits.get(path)
+            if text is None:
+                with open(path, "r") as fp:
+                    text = fp.read()
+            search, replace = file["search"].format(**context), file["replace"].format(**context)
+            if search not in text:
+                raise ValueError("did not find '%s' in %s" % (search, path))
+            edits[path] = text.replace(search, replace)
+        with open(config["path"], "r") as fp:
+            text = edits.get(config["path"], fp.read())
+        edits[config["path"]] = re.sub(r"^(current_version\s*[=:]\s*).*$", lambda m: m.group(1) + new_version,
+                                       text, count=1, flags=re.MULTILINE)
+        for path, text in edits.items():
+            write_text_atomic(path, text)
+
+        if config["commit"] if commit is None else commit:
+            git_backend.stage(directory, [os.path.relpath(path, directory) for path in edits], backend=backend)
+            git_backend.commit(directory, config["message"].format(**context), backend=backend)
+        if config["tag"] if tag is None else tag:
+            git_backend.tag(directory, config["tag_name"].format(**context), config["tag_message"].format(**context),
+                            backend=backend)
+        return new_version
@@ -0,0 +1,99 @@
+import time
+import asyncio
+import logging
+
+
+# Create logger with logging level set to all
+LOGGER = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+def merge_plans(plans):
+    """
+    Merge the plans of several events of the same repository and branch into a single one.
+    The tags found in the commit messages are combined as if they were all found in one commit, the feedstock is
+    rerendered and/or released if any of the events requires it, and the latest event gives the sha. The shas of all
+    the events are kept in "coalesced_shas", so that they are all marked as processed by the run of the merged plan.
+    Parameters
+    ----------
+    plans : list[dict]
+        The plans, as returned by `main.plan_event`, in the order in which the events were received.
+    Returns
+    -------
+    dict
+        The merged plan.
+    """
+    merged = dict(plans[-1])
+    tags = {}
+    for plan in plans:
+        for tag, found in plan["tags"].items():
+            tags[tag] = tags.get(tag, False) or found
+    merged["tags"] = tags
+    merged["rerender"] = any(plan["rerender"] for plan in plans)
+    merged["release"] = any(plan["release"] for plan in plans)
+
+    # Use the commit message of the latest event that requires the merged actions
+    candidates = [plan for plan in plans if plan["release"]] if merged["release"] else plans
+    merged["commit_message"] = next(
+        (plan["commit_message"] for plan in reversed(candidates) if plan["commit_message"]), None)
+    merged["coalesced_shas"] = [plan["sha"] for plan in plans]
+    return merged
+
+class EventCoalescer:
+    """
+    Merge the plans of the events received for the same repository and branch within a time window.
+    Every new event for a repository and branch restarts the window, up to a maximum waiting time after the first
+    event, after which the merged plan is passed to the callback.
+    Parameters
+    ----------
+    callback : callable
+        Function called with the merged plan and the list of items given with each plan.
+    window : float
+        The time, in seconds, to wait for more events after an event.
+    max_wait : float, optional
+        The maximum time, in seconds, to wait after the first event (default: 5 times the window).
+    """
+    def __init__(self, callback, window, max_wait=None):
+        self.callback = callback
+        self.window = window
+        self.max_wait = 5 * window if max_wait is None else max_wait
+        self.pending = {}
+
+    def add(self, plan, item=None):
+        """
+        Add the plan of an event.
+        Must be called from the event loop.
+        Parameters
+        ----------
+        plan : dict
+            The plan, as returned by `main.plan_event`.
+        item : object, optional
+            An item passed to the callback along with the merged plan, e.g. the job of the event.
+        """
+        key = (plan["repository"], plan["branch"])
+        entry = self.pending.get(key)
+        if entry is None:
+            entry = self.pending[key] = dict(plans=[], items=[], first=time.monotonic(), handle=None)
+        else:
+            entry["handle"].cancel()
+            LOGGER.info("coalescing event for %s@%s with %d pending event(s)", key[0], key[1], len(entry["plans"]))
+        entry["plans"].append(plan)
+        entry["items"].append(item)
+
+        delay = max(0, min(self.window, entry["first"] + self.max_wait - time.monotonic()))
+        entry["handle"] = asyncio.get_running_loop().call_later(delay, self.flush, key)
+
+    def flush(self, key):
+        """
+        Pass the merged plan of the pending events of a repository and branch to the callback.
+        Parameters
+        ----------
+        key : tuple[str, str]
+            The repository and branch.
+        """
+        entry = self.pending.pop(key, None)
+        if entry is None:
+            return
+        entry["handle"].cancel()
+        if len(entry["plans"]) > 1:
+            LOGGER.info("merged %d events for %s@%s", len(entry["plans"]), key[0], key[1])
+        self.callback(merge_plans(entry["plans"]), entry["items"])
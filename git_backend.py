@@ -0,0 +1,216 @@
+import os
+import logging
+import subprocess
+import pygit2
+from pygit2.enums import FileStatus, ObjectType
+from util import git_auth_args
+
+
+# Create logger with logging level set to all
+LOGGER = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+def get_backend():
+    """
+    Get the git backend from the GIT_BACKEND environment variable: "pygit2" to run git operations in-process
+    (default), or "subprocess" to run them with the git command line.
+    Returns
+    -------
+    str
+        The backend.
+    """
+    backend = os.environ.get("GIT_BACKEND", "pygit2")
+    if backend not in ("pygit2", "subprocess"):
+        raise ValueError("unknown git backend '%s'" % backend)
+    return backend
+
+def set_identity(directory, name, email):
+    """
+    Set the identity used for the commits of a repository, in its local configuration only.
+    Parameters
+    ----------
+    directory : str
+        The repository directory.
+    name : str
+        The user name.
+    email : str
+        The user email.
+    """
+    config = pygit2.Repository(directory).config
+    config["user.name"] = name
+    config["user.email"] = email
+
+def get_head_id(directory):
+    """
+    Get the id of the HEAD commit of a repository.
+    """
+    return str(pygit2.Repository(directory).head.target)
+
+def stage_all(repo):
+    """
+    Stage all changes of the working tree, like `git add --all`.
+    Parameters
+    ----------
+    repo : pygit2.Repository
+        The repository.
+    """
+    index = repo.index
+    index.read()
+    index.add_all()
+    # add_all does not stage the removal of deleted files
+    for path, status in repo.status().items():
+        if status & FileStatus.WT_DELETED:
+            index.remove(path)
+    index.write()
+
+def stage(directory, paths, backend=None):
+    """
+    Stage some files of a repository, like `git add <paths>`.
+    Parameters
+    ----------
+    directory : str
+        The repository directory.
+    paths : list[str]
+        The paths of the files, relative to the repository directory.
+    backend : str, optional
+        The git backend (default: from `get_backend`).
+    """
+    if (backend or get_backend()) == "subprocess":
+        subprocess.run(["git", "add", "--", *paths], cwd=directory, check=True)
+        return
+    index = pygit2.Repository(directory).index
+    index.read()
+    for path in paths:
+        index.add(path)
+    index.write()
+
+def commit(directory, message, stage=False, backend=None):
+    """
+    Commit the staged changes of a repository, with the identity of its configuration.
+    Parameters
+    ----------
+    directory : str
+        The repository directory.
+    message : str
+        The commit message.
+    stage : bool
+        If True, stage all changes of the working tree first.
+    backend : str, optional
+        The git backend (default: from `get_backend`).
+    Returns
+    -------
+    str
+        The id of the new commit, None if there was nothing to commit.
+    """
+    if (backend or get_backend()) == "subprocess":
+        if stage:
+            subprocess.run(["git", "add", "."], cwd=directory)
+        if subprocess.run(["git", "commit", "-m", message], cwd=directory).returncode != 0:
+            return None
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=directory, stdout=subprocess.PIPE,
+                              check=True).stdout.decode("ascii").strip()
+
+    repo = pygit2.Repository(directory)
+    if stage:
+        stage_all(repo)
+    index = repo.index
+    index.read()
+    tree = index.write_tree()
+    parent = repo.head.peel(pygit2.Commit)
+    if tree == parent.tree_id:
+        LOGGER.info("nothing to commit in %s", directory)
+        return None
+    signature = repo.default_signature
+    commit_id = repo.create_commit("HEAD", signature, signature, message, tree, [parent.id])
+    LOGGER.info("committed %s in %s: %s", commit_id, directory, message)
+    return str(commit_id)
+
+def tag(directory, name, message, backend=None):
+    """
+    Create an annotated tag on the HEAD of a repository, with the identity of its configuration.
+    Parameters
+    ----------
+    directory : str
+        The repository directory.
+    name : str
+        The tag name.
+    message : str
+        The tag message.
+    backend : str, optional
+        The git backend (default: from `get_backend`).
+    """
+    if (backend or get_backend()) == "subprocess":
+        subprocess.run(["git", "tag", name, "--message", message], cwd=directory, check=True)
+        return
+    repo = pygit2.Repository(directory)
+    repo.create_tag(name, repo.head.target, ObjectType.COMMIT, repo.default_signature, message)
+    LOGGER.info("tagged %s as %s in %s", repo.head.target, name, directory)
+
+def get_branch_tags(repo, branch_name):
+    """
+    Get the tags of a repository that point to the head of a branch or to one of its ancestors.
+    Parameters
+    ----------
+    repo : pygit2.Repository
+        The repository.
+    branch_name : str
+        The branch name.
+    Returns
+    -------
+    list[str]
+        The tag reference names.
+    """
+    head = repo.lookup_reference("refs/heads/" + branch_name).target
+    tags = []
+    for name in repo.references:
+        if name.startswith("refs/tags/"):
+            target = repo.lookup_reference(name).peel(pygit2.Commit).id
+            if target == head or repo.descendant_of(head, target):
+                tags.append(name)
+    return tags
+
+class PushCallbacks(pygit2.RemoteCallbacks):
+    """
+    Callbacks of a push, which raise `pygit2.GitError` if the remote rejected a reference, e.g. a protected branch, a
+    hook or an existing tag, since libgit2 otherwise ignores it.
+    """
+    def push_update_reference(self, refname, message):
+        if message is not None:
+            raise pygit2.GitError("remote rejected %s (%s)" % (refname, message))
+
+def push(directory, remote_url, branch_name, auth_token, backend=None):
+    """
+    Force-push a branch of a repository, along with its tags.
+    With the pygit2 backend, the branch and the tags are pushed in a single network round trip, in which the tags
+    that are already on the remote are skipped.
+    Parameters
+    ----------
+    directory : str
+        The repository directory.
+    remote_url : str
+        The url to push to.
+    branch_name : str
+        The branch name.
+    auth_token : str
+        The GitHub access token.
+    backend : str, optional
+        The git backend (default: from `get_backend`).
+    Raises
+    ------
+    subprocess.CalledProcessError, pygit2.GitError
+        If the push failed, or the remote rejected the branch or a tag.
+    """
+    if (backend or get_backend()) == "subprocess":
+        for arguments in [["push", "--all", "-f", remote_url], ["push", remote_url, branch_name, "--tags"]]:
+            returncode = subprocess.run(["git", *git_auth_args(auth_token), *arguments], cwd=directory).returncode
+            if returncode != 0:
+                # Without the authentication options, so that the token does not end up in the logs and reports
+                raise subprocess.CalledProcessError(returncode, ["git", *arguments])
+        return
+
+    repo = pygit2.Repository(directory)
+    refspecs = ["+refs/heads/%s:refs/heads/%s" % (branch_name, branch_name)]
+    refspecs += ["%s:%s" % (tag, tag) for tag in get_branch_tags(repo, branch_name)]
+    LOGGER.info("pushing %s to %s", ", ".join(refspecs), remote_url)
+    callbacks = PushCallbacks(pygit2.UserPass("x-access-token", auth_token))
+    repo.remotes.create_anonymous(remote_url).push(refspecs, callbacks=callbacks)
@@ -0,0 +1,124 @@
+import os
+import json
+import base64
+import hashlib
+import logging
+import requests
+from rate_limit import RateLimitedHTTPAdapter
+from util import get_cache_dir, write_json_atomic
+
+
+# Create logger with logging level set to all
+LOGGER = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+class CachingHTTPAdapter(RateLimitedHTTPAdapter):
+    """
+    HTTP adapter that caches GET responses on disk, and revalidates them with conditional requests.
+    Cached responses are sent back with If-None-Match/If-Modified-Since headers, so that unchanged resources are
+    answered with a 304 status (which GitHub does not count against the rate limit) and served from the cache.
+    The least recently used responses are removed when the cache exceeds its maximum size. Requests, including the
+    conditional ones, follow the rate limits of the API, see `RateLimitedHTTPAdapter`.
+    Parameters
+    ----------
+    cache_dir : str, optional
+        The directory in which responses are stored (default: the "http" directory of the cache).
+    max_size : int, optional
+        Maximum size of the cache, in bytes (default: HTTP_CACHE_MAX_SIZE environment variable, or 50 MB).
+    **kwargs
+        Arguments passed to `RateLimitedHTTPAdapter`.
+    """
+    def __init__(self, cache_dir=None, max_size=None, **kwargs):
+        super().__init__(**kwargs)
+        self.cache_dir = cache_dir or get_cache_dir("http")
+        self.max_size = int(os.environ.get("HTTP_CACHE_MAX_SIZE", 50 * 1024**2)) if max_size is None else max_size
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get_cache_path(self, request):
+        # Responses depend on the credentials and on the requested media type
+        key = "\n".join([request.url, request.headers.get("Authorization", ""), request.headers.get("Accept", "")])
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json")
+
+    def send(self, request, **kwargs):
+        if request.method != "GET":
+            return super().send(request, **kwargs)
+
+        # Make the request conditional if the response is in the cache
+        cache_path = self.get_cache_path(request)
+        try:
+            with open(cache_path, "r") as fp:
+                entry = json.load(fp)
+        except (FileNotFoundError, ValueError):
+            entry = None
+        if entry is not None:
+            if "ETag" in entry["headers"]:
+                request.headers["If-None-Match"] = entry["headers"]["ETag"]
+            if "Last-Modified" in entry["headers"]:
+                request.headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+
+        response = super().send(request, **kwargs)
+
+        if response.status_code == 304 and entry is not None:
+            # Serve the cached response, with the up-to-date headers (e.g. rate limit) of the 304 response
+            LOGGER.debug("cache hit for %s", request.url)
+            headers = dict(entry["headers"])
+            headers.update(response.headers)
+            response.status_code = entry["status_code"]
+            response.reason = entry["reason"]
+            response.headers = requests.structures.CaseInsensitiveDict(headers)
+            response._content = base64.b64decode(entry["content"])
+            response.from_cache = True
+            try:
+                os.utime(cache_path)
+            except FileNotFoundError:
+                # Evicted by another thread or process
+                pass
+        elif response.status_code == 200 and ("ETag" in response.headers or "Last-Modified" in response.headers):
+            self.store(cache_path, response)
+        return response
+
+    def store(self, cache_path, response):
+        """
+        Store a response in the cache, and evict old responses if the cache is full.
+        Parameters
+        ----------
+        cache_path : str
+            The path of the cache entry.
+        response : requests.Response
+            The response.
+        """
+        entry = dict(
+            url=response.url,
+            status_code=response.status_code,
+            reason=response.reason,
+            headers=dict(response.headers),
+            content=base64.b64encode(response.content).decode("ascii"),
+        )
+        # The cache is only an optimization, a response that cannot be stored is a cache miss for the next request
+        try:
+            write_json_atomic(cache_path, entry)
+            self.evict()
+        except OSError as e:
+            LOGGER.warning("could not store the response of %s in the cache (%s)", response.url, e)
+
+    def evict(self):
+        """
+        Remove the least recently used responses until the cache is below its maximum size.
+        """
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".json"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
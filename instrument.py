@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import logging
+import cProfile
+import resource
+import threading
+import contextlib
+import contextvars
+
+
+# Create logger with logging level set to all
+LOGGER = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# The report being recorded, None when the instrumentation is disabled
+_REPORT = None
+_REPORT_LOCK = threading.Lock()
+# The innermost span of the current thread or task
+_CURRENT_SPAN = contextvars.ContextVar("current_span", default=None)
+
+def start_report():
+    """
+    Start recording the spans of a run, replacing the report of any previous run.
+    Until this is called, `span` and `count` do nothing, so that long-running processes do not accumulate spans.
+    """
+    global _REPORT
+    with _REPORT_LOCK:
+        _REPORT = dict(started_at=time.time(), start=time.perf_counter(), spans=[], totals={})
+
+def get_child_cpu_time():
+    """
+    Get the CPU time, user and system, of all terminated child processes of this process, in seconds.
+    """
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+@contextlib.contextmanager
+def span(name, profile=False, **attrs):
+    """
+    Record a phase of the run: its wall time, the CPU time of the subprocesses that terminated during it, and the
+    counters incremented with `count` inside of it.
+    Spans can be nested, also across the threads started with `run_concurrently`, and can be used as decorators.
+    The subprocess CPU time is measured for the whole process, so it includes the subprocesses of the spans running
+    at the same time in other threads.
+    Parameters
+    ----------
+    name : str
+        The name of the phase.
+    profile : bool
+        If True and the PROFILE_DIR environment variable is set, profile the Python code of the phase with cProfile,
+        and write the statistics to "<PROFILE_DIR>/<name>-<index>.prof".
+    **attrs
+        Attributes of the phase, written in the report.
+    """
+    report = _REPORT
+    if report is None:
+        yield None
+        return
+
+    parent = _CURRENT_SPAN.get()
+    record = dict(
+        name=name, parent=parent["id"] if parent is not None else None, thread=threading.current_thread().name,
+        attrs=attrs, counters={}, parent_span=parent)
+    with _REPORT_LOCK:
+        record["id"] = len(report["spans"])
+        report["spans"].append(record)
+    token = _CURRENT_SPAN.set(record)
+
+    profiler = None
+    if profile and os.environ.get("PROFILE_DIR"):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Only one profiler can be active at a time
+            LOGGER.warning("could not profile %s, another profiler is active", name)
+            profiler = None
+
+    start_cpu = get_child_cpu_time()
+    start = time.perf_counter()
+    record["start"] = start - report["start"]
+    record["status"] = "running"
+    try:
+        yield record
+        record["status"] = "done"
+    except BaseException as e:
+        record.update(status="failed", error=repr(e))
+        raise
+    finally:
+        record["wall_time"] = time.perf_counter() - start
+        record["child_cpu_time"] = get_child_cpu_time() - start_cpu
+        _CURRENT_SPAN.reset(token)
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(os.environ["PROFILE_DIR"], exist_ok=True)
+            profiler.dump_stats(os.path.join(os.environ["PROFILE_DIR"], "%s-%d.prof" % (name, record["id"])))
+        LOGGER.info("%s took %.2fs (subprocess cpu: %.2fs)", name, record["wall_time"], record["child_cpu_time"])
+
+def annotate(**attrs):
+    """
+    Add attributes to the current span, e.g. from a function decorated with `span`.
+    """
+    record = _CURRENT_SPAN.get()
+    if record is not None:
+        record["attrs"].update(attrs)
+
+def count(name, value=1):
+    """
+    Increment a counter of the current span and of all spans it is nested in, e.g. a number of API calls or of bytes
+    transferred.
+    Parameters
+    ----------
+    name : str
+        The counter name.
+    value : int
+        The increment.
+    """
+    report = _REPORT
+    if report is None:
+        return
+    record = _CURRENT_SPAN.get()
+    with _REPORT_LOCK:
+        report["totals"][name] = report["totals"].get(name, 0) + value
+        while record is not None:
+            record["counters"][name] = record["counters"].get(name, 0) + value
+            record = record["parent_span"]
+
+def percentile(values, fraction):
+    """
+    Get a percentile of a list of values, with the nearest-rank method.
+    Parameters
+    ----------
+    values : list[float]
+        The values.
+    fraction : float
+        The percentile, between 0 and 1.
+    Returns
+    -------
+    float
+        The percentile, None if there are no values.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+def get_report():
+    """
+    Get the report of the current run.
+    Returns
+    -------
+    dict
+        The start time and duration of the run, the totals of the counters, and the list of spans, with their
+        id, parent id, name, thread, attributes, status, start time relative to the start of the run, wall time,
+        subprocess CPU time and counters. None if no report was started.
+    """
+    report = _REPORT
+    if report is None:
+        return None
+    with _REPORT_LOCK:
+        return dict(
+            started_at=report["started_at"],
+            duration=time.perf_counter() - report["start"],
+            totals=dict(report["totals"]),
+            spans=[{key: value for key, value in record.items() if key != "parent_span"}
+                   for record in report["spans"]],
+        )
+
+def format_summary(report):
+    """
+    Format the spans of a report as a markdown table, children under their parent.
+    """
+    lines = ["| Phase | Attributes | Wall time | Subprocess CPU | Counters |", "|---|---|---|---|---|"]
+    children = {}
+    for record in report["spans"]:
+        children.setdefault(record["parent"], []).append(record)
+
+    def add_lines(parent, depth):
+        for record in children.get(parent, []):
+            name = "&nbsp;&nbsp;" * depth + record["name"]
+            if record["status"] == "failed":
+                name += " (failed)"
+            attrs = ", ".join("%s: %s" % item for item in record["attrs"].items()) or "-"
+            counters = ", ".join("%s: %s" % item for item in sorted(record["counters"].items())) or "-"
+            lines.append("| %s | %s | %.2fs | %.2fs | %s |" % (
+                name, attrs, record.get("wall_time", 0), record.get("child_cpu_time", 0), counters))
+            add_lines(record["id"], depth + 1)
+
+    add_lines(None, 0)
+    totals = ", ".join("%s: %s" % item for item in sorted(report["totals"].items())) or "-"
+    lines.append("| **Total** | | %.2fs | | %s |" % (report["duration"], totals))
+    return "\n".join(lines)
+
+def write_report(path=None):
+    """
+    Write the report of the current run to a JSON file, and add its summary to the page of the GitHub Actions run.
+    Parameters
+    ----------
+    path : str, optional
+        The path of the JSON file (default: RUN_REPORT environment variable, no file if it is not set).
+    """
+    report = get_report()
+    if report is None:
+        return
+    path = path or os.environ.get("RUN_REPORT")
+    if path:
+        with open(path, "w") as fp:
+            json.dump(report, fp, indent=2)
+        LOGGER.info("run report written to %s", path)
+    if "GITHUB_STEP_SUMMARY" in os.environ:
+        with open(os.environ["GITHUB_STEP_SUMMARY"], "a") as fp:
+            fp.write("## Run phases\n\n%s\n" % format_summary(report))
@@ -1,10 +1,12 @@
 import os
 import json
 import logging
-from github import Github
-import re
 from util import *
-import bumpversion.cli
+from provision import ensure_toolchain, get_recorded_versions
+from recipe import Recipe, RecipeFile
+import instrument
+from pipeline import Abort, run_graph
+from rerender_cache import RERENDER_INPUTS, check_rerender, get_input_ids, get_pinning_version, get_rerender_key, record_rerender
 from datetime import datetime, timedelta
 import subprocess
 import shutil
@@ -16,10 +18,6 @@ logging.basicConfig(level=logging.INFO)
 
 
 def main():
-    # Two events:
-    # 1. Push to tudat/tudatpy -> look for [CI]/[Rerender] tags in commit message and rerender and/or release if found
-    # 2. Nightly -> rerender and release if last changes were less than 24hrs ago
-
     # Load event data from test dictionary or from GitHub even path environment variable
     if "TEST_DICT" in os.environ:
         event_data = json.loads(os.environ["TEST_DICT"])
@@ -27,10 +25,80 @@ def main():
         with open(os.environ["GITHUB_EVENT_PATH"], "r") as fp:
             event_data = json.load(fp)
 
+    # Record the duration of every phase, and write the report even if the run fails
+    instrument.start_report()
+    error, status = None, "done"
+    try:
+        process_event(event_data, os.environ["GITHUB_EVENT_NAME"], os.environ["GITHUB_WORKSPACE"])
+    except Abort as e:
+        # The run stopped before pushing anything, which fails the job without a traceback
+        error, status = str(e), "aborted"
+        LOGGER.error("%s, nothing is pushed", e)
+        raise SystemExit(1)
+    except BaseException as e:
+        error, status = repr(e), "failed"
+        raise
+    finally:
+        instrument.write_report()
+        # Keep the history of the runs that had something to do, to follow the latency of their phases over time,
+        # without slowing down the events that are ignored
+        report = instrument.get_report()
+        decisions = next((record["attrs"] for record in report["spans"] if record["name"] == "plan"), {})
+        if os.environ.get("RUN_HISTORY", "1") != "0" and (decisions.get("rerender") or decisions.get("release")):
+            from run_history import record_run
+            try:
+                record_run(report, event_data.get("client_payload", {}), error, status)
+            except Exception as e:
+                LOGGER.warning("could not record the run in the history (%s)", e)
+
+def process_event(event_data, event_name, workspace, sess=None):
+    """
+    Rerender and/or release the feedstock of a project, as requested by a repository dispatch event.
+    Parameters
+    ----------
+    event_data : dict
+        The event data, containing the client payload of the dispatch.
+    event_name : str
+        The name of the GitHub event.
+    workspace : str
+        The directory in which the project and feedstock repositories are cloned.
+    sess : requests.Session, optional
+        The GitHub API session, as returned by `create_api_sessions` (default: a new session).
+    """
+    with instrument.span("plan", profile=True):
+        plan = plan_event(event_data, event_name, sess)
+        instrument.annotate(rerender=bool(plan and plan["rerender"]), release=bool(plan and plan["release"]))
+    if plan is not None:
+        run_plan(plan, workspace)
+
+def plan_event(event_data, event_name, sess=None, metadata=None):
+    """
+    Decide if the feedstock of a project must be rerendered and/or released, from a repository dispatch event.
+    Parameters
+    ----------
+    event_data : dict
+        The event data, containing the client payload of the dispatch.
+    event_name : str
+        The name of the GitHub event.
+    sess : requests.Session, optional
+        The GitHub API session, as returned by `create_api_sessions` (default: a new session).
+    metadata : dict, optional
+        The GitHub metadata of the event, as returned by `get_dispatch_metadata`, if it was already fetched.
+    Returns
+    -------
+    dict
+        The plan, None if nothing has to be done. It contains the event type, the repository and feedstock names
+        and clone urls, the branch and sha, the tags found in the commit message, the commit message to use for
+        the changes, and wether to rerender and to release.
+    """
+    # Two events:
+    # 1. Push to tudat/tudatpy -> look for [CI]/[Rerender] tags in commit message and rerender and/or release if found
+    # 2. Nightly -> rerender and release if last changes were less than 24hrs ago
+
     # Extract payload and event info from event data
     payload = event_data["client_payload"]
     event_type = payload["event"]
-    event_name = os.environ["GITHUB_EVENT_NAME"].lower()
+    event_name = event_name.lower()
     LOGGER.info("github event: %s", event_name)
     LOGGER.info("github event data:\n%s", pprint.pformat(event_data))
     
@@ -45,63 +113,278 @@ def main():
         )
         return
 
-    # Start GitHub client
-    gh = Github(os.environ['GH_TOKEN'])
-
     # Get repository
     branch_name = payload["ref_name"]
     s_repository = payload["repository"]
 
-    project_repo, feedstock_repo, s_repository_feedstock = get_project_and_feedstock_repos(gh, s_repository)
-    if project_repo is None:
+    # Quit if the event was already processed, e.g. if it was delivered again or re-run
+    if payload.get("sha") and is_event_done(s_repository, branch_name, payload["sha"], event_type):
+        return None
+
+    # If the event is a push, look for tags in the messages of its commits, if they are in the payload, so that pushes
+    # without tags are ignored without any request
+    messages = get_payload_commit_messages(payload) if event_type == "push" else None
+    tags_found = None
+    if messages is not None:
+        tags_found, commit_message = find_commit_tags(messages, supported_tags=["ci", "rerender"])
+        if not any(tags_found.values()):
+            return None
+    # Otherwise, get the messages of all the pushed commits from the commit before the push, if it is known
+    compare_base = get_payload_compare_base(payload) if event_type == "push" and messages is None else None
+
+    # Get the repositories, and the commit message or last commit date, in one request
+    if metadata is None:
+        # Start GitHub clients
+        if sess is None:
+            sess, _ = create_api_sessions(os.environ['GH_TOKEN'], with_github=False)
+        tasks = {"metadata": lambda: get_dispatch_metadata(
+            sess, s_repository,
+            commit_hash=payload["sha"] if event_type == "push" and messages is None else None,
+            branch_name=branch_name if event_type == "nightly" else None)}
+        if compare_base is not None:
+            def fetch_messages():
+                import requests
+                try:
+                    return fetch_commit_messages(sess, s_repository, compare_base, payload["sha"])
+                except (requests.RequestException, KeyError, TypeError, ValueError) as e:
+                    LOGGER.warning("could not compare %s with the commit before the push (%s), only looking for "
+                                   "tags in the pushed commit", payload["sha"], e)
+                    return None
+            tasks["messages"] = fetch_messages
+        results = run_concurrently(tasks)
+        metadata = results["metadata"]
+        if results.get("messages") is not None:
+            messages = results["messages"]
+    if metadata is None:
         return
+    s_repository_feedstock = metadata["feedstock_name"]
 
     # If the even is a push, analyze it to search for [CI] tag
     if event_type == "push":
-        # Get possible tags in commit message, as well as new commit message for push after rerender or release
-        tags_found, commit_message = get_commit_tags(project_repo, payload["sha"], supported_tags=["ci", "rerender"])
+        # Get possible tags in commit messages, as well as new commit message for push after rerender or release
+        if tags_found is None:
+            tags_found, commit_message = find_commit_tags(
+                messages if messages is not None else [metadata["commit_message"]], supported_tags=["ci", "rerender"])
         rerender = tags_found["rerender"] or tags_found["ci"]
         release = tags_found["ci"]
         # Quit if no tags were found
         if not rerender and not release:
-            return
+            return None
 
     # If the even is a nightly, rerender, check if there was changes in the last 24hrs and if so, release
     elif event_type == "nightly":
         # Trigger rerender
         rerender = True
         # If last commit was less than 22hrs ago, trigger release
-        release = was_branch_last_commit_recent(project_repo, branch_name, time_treshold=timedelta(hours=22))
+        release = is_date_recent(metadata["branch_commit_date"], time_treshold=timedelta(hours=22))
         commit_message = "BOT: Changes detected in project, nightly release 🌃"
+        tags_found = {}
+        # Without a sha in the payload, the run of the nightly is keyed by the last commit of the branch, so that a
+        # re-run of the same day at the same commit does not bump the version again
+        if not payload.get("sha") and metadata.get("branch_commit_sha"):
+            payload = dict(payload, sha=metadata["branch_commit_sha"])
+            if is_event_done(s_repository, branch_name, payload["sha"], event_type):
+                return None
 
     # Quit if the event is not a push nor a nightly
     else:
-        return
+        return None
+
+    plan = dict(
+        event=event_type,
+        repository=s_repository,
+        feedstock=s_repository_feedstock,
+        project_clone_url=metadata["project_clone_url"],
+        feedstock_clone_url=metadata["feedstock_clone_url"],
+        branch=branch_name,
+        sha=payload.get("sha"),
+        tags=tags_found,
+        rerender=rerender,
+        release=release,
+        commit_message=commit_message,
+    )
+
+    # Check the plan against the contents of the repositories, before anything is cloned
+    if os.environ.get("PREFLIGHT", "1") != "0":
+        if sess is None:
+            sess, _ = create_api_sessions(os.environ['GH_TOKEN'], with_github=False)
+        plan = check_plan(plan, sess)
+    return plan
+
+def is_event_done(repository, branch, sha, event_type):
+    """
+    Check if an event was already processed, e.g. if it was delivered again or re-run, see `result_store.is_done`.
+    """
+    import result_store
+
+    if result_store.is_enabled() and result_store.is_done(repository, branch, sha, event_type):
+        LOGGER.info("repository_dispatch event: %s of %s@%s already processed", event_type, repository, sha)
+        return True
+    return False
+
+def check_plan(plan, sess):
+    """
+    Check a plan against the project version file and the feedstock recipe, read through the GitHub API without
+    cloning the repositories, and remove the steps that would not change anything:
+     * the release is impossible if the branch is not supported, or if the versions of the project and the feedstock
+       differ. Nothing would then be pushed, so the plan is dropped.
+     * the rerender is skipped if the feedstock and the toolchain are the same as for the last successful rerender.
+    If the repositories cannot be read, the plan is kept as it is, and is checked again after cloning. The release of
+    an interrupted run that already pushed the project is not checked, as the versions then differ.
+    Parameters
+    ----------
+    plan : dict
+        The plan, as returned by `plan_event`.
+    sess : requests.Session
+        The GitHub API session, as returned by `create_api_sessions`.
+    Returns
+    -------
+    dict
+        The checked plan, with the project version and the version part to bump if the feedstock is released, and
+        the conda-forge-pinning version if the rerender was checked. None if nothing has to be done.
+    """
+    import requests
+    import result_store
+
+    branch_name = plan["branch"]
+    use_rerender_cache = os.environ.get("RERENDER_CACHE", "1") != "0"
+    run_key = result_store.get_run_key(plan)
+    released = result_store.get_phases(run_key).get("push_project") if run_key is not None else None
+
+    # Read what is needed from the repositories, concurrently
+    tasks = {}
+    if plan["release"] and released is None:
+        tasks["version"] = lambda: fetch_file_text(sess, plan["repository"], "version", branch_name)
+        tasks["recipe"] = lambda: fetch_file_text(sess, plan["feedstock"], "recipe/meta.yaml", branch_name)
+    if plan["rerender"] and use_rerender_cache and not plan["tags"].get("rerender"):
+        tasks["feedstock_ids"] = lambda: fetch_directory_ids(sess, plan["feedstock"], "", branch_name)
+        tasks["pinning_version"] = get_pinning_version
+    try:
+        with instrument.span("preflight"):
+            results = run_concurrently(tasks)
+    except (requests.RequestException, KeyError, TypeError, ValueError) as e:
+        LOGGER.warning("could not read the repositories through the GitHub API (%s), checking the plan after cloning", e)
+        return plan
+
+    plan = dict(plan)
+    if plan["release"] and released is not None:
+        plan["version"], plan["bump_part"] = released["old_var_vals"]["version"], released["bump_part"]
+    elif plan["release"]:
+        # Only the dev branch is released, and a release changes nothing in the other cases
+        if branch_name != "develop" and "TEST_DICT" not in os.environ:
+            LOGGER.info("repository_dispatch event: only dev branch is supported for release, nothing to do")
+            return None
+        version = parse_project_version(results["version"])
+        recipe_version = RecipeFile("recipe/meta.yaml", text=results["recipe"]).variables.get("version")
+        if version is None or version != recipe_version:
+            LOGGER.error("version mismatch: project version is %s, feedstock version is %s, nothing to do",
+                         version, recipe_version)
+            return None
+        plan["version"] = version
+        plan["bump_part"] = "dev" if remap(branch_name) == "dev" or "TEST_DICT" in os.environ else "patch"
+
+    if "feedstock_ids" in results:
+        # The pinning version is kept for the rerender, so that it is only fetched once
+        plan["pinning_version"] = results["pinning_version"]
+        input_ids = {path: results["feedstock_ids"].get(path) for path in RERENDER_INPUTS}
+        _, up_to_date = check_rerender(plan["feedstock"], branch_name, input_ids,
+                                       get_recorded_versions().get("conda-smithy"), plan["pinning_version"])
+        if up_to_date:
+            plan["rerender"] = False
+
+    if not plan["rerender"] and not plan["release"]:
+        LOGGER.info("nothing to do for %s@%s", plan["repository"], branch_name)
+        return None
+    LOGGER.info("plan for %s@%s: rerender: %s, release: %s%s", plan["repository"], branch_name, plan["rerender"],
+                plan["release"], " (%s, bump %s)" % (plan["version"], plan["bump_part"]) if plan["release"] else "")
+    return plan
+
+def run_plan(plan, workspace):
+    """
+    Rerender and/or release the feedstock of a project, and push the changes to GitHub.
+    Parameters
+    ----------
+    plan : dict
+        The plan, as returned by `plan_event`.
+    workspace : str
+        The directory in which the project and feedstock repositories are cloned.
+    Raises
+    ------
+    pipeline.Abort
+        If a step stopped the run before anything was pushed, e.g. a failed rerender or a version mismatch.
+    """
+    # Only the runs that change the repositories need pygit2
+    import git_backend
+    import result_store
+    from bump import CONFIG_FILES, bump_version, get_version_paths
+
+    s_repository, s_repository_feedstock, branch_name = plan["repository"], plan["feedstock"], plan["branch"]
+    rerender, release, commit_message = plan["rerender"], plan["release"], plan["commit_message"]
 
     # Create path for feedstock and project repos locally
-    FEEDSTOCK_DIR, PROJECT_DIR = [os.path.join(os.environ["GITHUB_WORKSPACE"], repo_full_name.split("/")[-1]) for repo_full_name in [s_repository_feedstock, s_repository]]
+    FEEDSTOCK_DIR, PROJECT_DIR = [os.path.join(workspace, repo_full_name.split("/")[-1]) for repo_full_name in [s_repository_feedstock, s_repository]]
+    # Only fetch what is needed from the repositories (by default, the last commit of the branch)
+    clone_options = get_clone_options()
+
+    # Set credentials, in the configuration of the cloned repositories only
+    user = "Delfi-C3"
+    email = "Delfi-C3@users.noreply.github.com"
+    # Specify in username if the commit results from a test
+    if "TEST_DICT" in os.environ:
+        user = "Delfi-C3-TEST"
+        email = "Delfi-C3-TEST@users.noreply.github.com"
+
+    # Resume the run of the same event if it was interrupted, skipping the phases whose changes were pushed
+    run_key = result_store.get_run_key(plan)
+    completed = result_store.get_phases(run_key) if run_key is not None else {}
+    if "done" in completed:
+        LOGGER.info("%s of %s@%s already processed", plan["event"], s_repository, plan["sha"])
+        return
+    released = completed.get("push_project")
+    if release and released is not None:
+        LOGGER.info("resuming the release of %s@%s, the project was already pushed at version %s", s_repository,
+                    plan["sha"], released["version"])
+
+    # Keys under which the phases are recorded: the one of the run, and the one of the commit pushed to the project
+    # once it is the new head of the branch, by which a re-run of a nightly is keyed
+    run_keys = [run_key] if run_key is not None else []
+
+    def record(phase, outputs=None):
+        for key in run_keys:
+            result_store.record_phase(key, phase, outputs)
+
+    # The steps are tasks of a graph, each one started as soon as the ones it depends on are done, so that the
+    # rerender runs at the same time as the clone of the project and the version bump
+    tasks = {}
+
+    # Only check out the files of the project that the release reads or writes, which are committed and pushed with the
+    # git CLI, as libgit2 would see the other files as deleted
+    sparse_project = os.environ.get("SPARSE_CHECKOUT", "1") != "0"
+    project_backend = "subprocess" if sparse_project else None
+
+    def clone(clone_url, repo_dir, sparse_paths=None):
+        def task(results):
+            repo = clone_repo(clone_url, repo_dir, branch_name, os.environ['GH_TOKEN'], sparse_paths=sparse_paths,
+                              **clone_options)
+            git_backend.set_identity(repo_dir, user, email)
+            if sparse_paths:
+                # Add the files rewritten by the version bump, listed in the configuration that is now checked out
+                set_sparse_checkout(repo_dir, get_version_paths(repo_dir), add=True)
+            return repo
+        return task
+
+    # Clone the feedstock and project repos at their correct branch
+    tasks["clone_feedstock"] = (clone(plan["feedstock_clone_url"], FEEDSTOCK_DIR), [])
+    if release and released is None:
+        tasks["clone_project"] = (clone(plan["project_clone_url"], PROJECT_DIR,
+                                        ["version"] + CONFIG_FILES if sparse_project else None), [])
 
     # Rerender the feedstock
     if rerender:
-        LOGGER.info("starting rerender")
-
-        # Clone the feedstock repo at its correct branch
-        LOGGER.info("cloning feedstock repository")
-        clone_repo(feedstock_repo.clone_url, FEEDSTOCK_DIR, branch_name, os.environ['GH_TOKEN'])
-        
-        # Make sure conda exists
-        os.system("conda --version > /dev/null")
-        if os.system("conda --version > /dev/null") != 0:
-            LOGGER.error("conda not found")
-            return
-
-        # Make sure conda is up to date
-        LOGGER.info("updating conda")
-        os.system("conda update -n base -c defaults conda -y")
-
-        # Make sure conda-smithy is installed and up-to-date
-        LOGGER.info("updating conda-smithy")
-        os.system("conda install -n base -c conda-forge conda-smithy -y")
+        def provision(results):
+            # Make sure conda and conda-smithy are installed, only updating them if they are outdated
+            if not ensure_toolchain():
+                raise Abort("conda or conda-smithy could not be installed")
 
         # # Make sure that dev branch is used in conda configs
         # TARGETS_REGEX = re.compile(r"-\s+\[(?P<channel>[\w,-].+)\, \s+(?P<subchannel>[\w,-]+)]")
@@ -111,121 +394,174 @@ def main():
         # VAR_SUBSTITUTE.append(("conda-forge.yml", TARGETS_REGEX, r'- [tudat-team, {}]', remap(branch_name)))
         # substitute_vars_in_file(VAR_SUBSTITUTE, FEEDSTOCK_DIR)
 
-        # Run conda-smithy rerender
-        LOGGER.info("running conda smithy rerender")
-        r = subprocess.Popen(["conda", "smithy", "rerender"], cwd=FEEDSTOCK_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-        # Get the new commit message
-        rerender_output = r.communicate()[-1].decode("utf-8")
-        rerender_commit_message = None
-        for line in rerender_output.split("\n"):
-            if line.strip().startswith('git commit -m "'):
-                rerender_commit_message = line.strip().split('"')[1]
-                break
-        if rerender_commit_message is None:
-            LOGGER.error("could not find commit message in rerender output. Feedstock most likely already up-to-date.")
-            LOGGER.info("conda smithy rerender output was:\n%s", rerender_output)
-        else:
-            LOGGER.info("conda-smithy rerender commit message: '%s'", rerender_commit_message)
-            # Commit changes
-            subprocess.run(["git", "commit", "-m", rerender_commit_message], cwd=FEEDSTOCK_DIR)
+        def rerender_feedstock(results):
+            """
+            Rerender the feedstock and commit the changes, returning the commit message, None if nothing changed, and
+            the key of the rerendered feedstock, which is only recorded once the feedstock is pushed.
+            """
+            LOGGER.info("starting rerender")
+            feedstock_repo = results["clone_feedstock"][0]
+
+            # Skip the rerender if its inputs and conda-smithy/pinning versions are the same as for the last successful one,
+            # unless it was explicitly requested with a [rerender] tag. The check is made again on the cloned feedstock,
+            # with the conda-smithy version after provisioning, as another run may have rerendered it since the plan
+            use_rerender_cache = os.environ.get("RERENDER_CACHE", "1") != "0"
+            if use_rerender_cache:
+                smithy_version = get_recorded_versions().get("conda-smithy")
+                pinning_version = plan["pinning_version"] if "pinning_version" in plan else get_pinning_version()
+                if not plan["tags"].get("rerender") and check_rerender(
+                        s_repository_feedstock, branch_name, get_input_ids(feedstock_repo), smithy_version,
+                        pinning_version)[1]:
+                    return None, None
+
+            # Run conda-smithy rerender, capturing the new commit message as soon as it is printed
+            LOGGER.info("running conda smithy rerender")
+            rerender_commit_message = None
+
+            def find_commit_message(line):
+                nonlocal rerender_commit_message
+                if rerender_commit_message is None and line.strip().startswith('git commit -m "'):
+                    rerender_commit_message = line.strip().split('"')[1]
+
+            instrument.annotate(feedstock=s_repository_feedstock)
+            try:
+                returncode, rerender_output = run_streaming(
+                    ["conda", "smithy", "rerender"], cwd=FEEDSTOCK_DIR, on_line=find_commit_message,
+                    timeout=float(os.environ.get("RERENDER_TIMEOUT", 3600)) or None, name="conda smithy")
+            except subprocess.TimeoutExpired as e:
+                LOGGER.error("conda smithy rerender last output was:\n%s", e.output)
+                raise Abort("conda smithy rerender timed out after %ds" % e.timeout)
+            if returncode != 0:
+                LOGGER.error("conda smithy rerender last output was:\n%s", "\n".join(rerender_output))
+                raise Abort("conda smithy rerender failed (exit code %d)" % returncode)
+            if rerender_commit_message is None:
+                LOGGER.error("could not find commit message in rerender output. Feedstock most likely already up-to-date.")
+                LOGGER.info("conda smithy rerender output was:\n%s", "\n".join(rerender_output))
+            else:
+                LOGGER.info("conda-smithy rerender commit message: '%s'", rerender_commit_message)
+                # Commit changes
+                git_backend.commit(FEEDSTOCK_DIR, rerender_commit_message)
+
+            # Key of the rerendered feedstock
+            rerender_key = None
+            if use_rerender_cache:
+                rerender_key = get_rerender_key(get_input_ids(feedstock_repo), smithy_version, pinning_version)
+            return rerender_commit_message, rerender_key
+
+        tasks["provision"] = (provision, [])
+        tasks["rerender"] = (rerender_feedstock, ["clone_feedstock", "provision"])
 
     # Release a conda package
+    version_types = ["version", "build", "git_rev"]
     if release:
-        LOGGER.info("starting release")
-
-        # Clone the feedstock and project repos at their correct branch
-        if not rerender:
-            # If rerender was triggered, the feedstock repo is already cloned
-            LOGGER.info("cloning feedstock repository")
-            clone_repo(feedstock_repo.clone_url, FEEDSTOCK_DIR, branch_name, os.environ['GH_TOKEN'])
-        LOGGER.info('cloning project repository')
-        clone_repo(project_repo.clone_url, PROJECT_DIR, branch_name, os.environ['GH_TOKEN'])
-
-        # Get project version number
-        version = get_project_version(PROJECT_DIR)
-        if version is None:
-            return
-        
-        # Retrieve version, build, and rev values from previous feedstock metadata
-        version_types = ["version", "build", "git_rev"]
-        VAR_RETRIEVE = [(v_type, "recipe/meta.yaml", re.compile('{%\s*set\s*' + v_type + '\s*=\s*"([^"]*)"\s*%}')) for v_type in version_types]
-        old_var_vals = get_var_values(VAR_RETRIEVE, FEEDSTOCK_DIR)
-        LOGGER.info("old_var_vals: %s", pprint.pformat(old_var_vals))
-        LOGGER.info("version: %s", version)
-        # Make sure the version is the same as the one in the feedstock
-        assert old_var_vals["version"] == version, "version mismatch"
-
-        # Trigger release if branch is develop, or if the environment is test
-        if branch_name == "develop" or "TEST_DICT" in os.environ:
-
-            if remap(branch_name) == "dev" or "TEST_DICT" in os.environ:
-                # If the version is in dev, bump the dev version number
-                LOGGER.info(
-                    "repository_dispatch event: bumping dev version")
-                bump_command = ["dev", "--tag"]
+        def check_version(results):
+            """
+            Check that the project and feedstock versions match, returning the feedstock values and the part to bump.
+            """
+            LOGGER.info("starting release")
+
+            # Get project version number
+            version = get_project_version(PROJECT_DIR)
+            if version is None:
+                raise Abort("could not read the project version")
+
+            # Retrieve version, build, and rev values from previous feedstock metadata
+            old_var_vals = Recipe(FEEDSTOCK_DIR, files=["recipe/meta.yaml"]).get_all(version_types)
+            LOGGER.info("old_var_vals: %s", pprint.pformat(old_var_vals))
+            LOGGER.info("version: %s", version)
+            # Make sure the version is the same as the one in the feedstock
+            if old_var_vals["version"] != version:
+                raise Abort("version mismatch: project version is %s, feedstock version is %s" % (
+                    version, old_var_vals["version"]))
+
+            # Trigger release if branch is develop, or if the environment is test
+            if branch_name == "develop" or "TEST_DICT" in os.environ:
+
+                if remap(branch_name) == "dev" or "TEST_DICT" in os.environ:
+                    # If the version is in dev, bump the dev version number
+                    LOGGER.info(
+                        "repository_dispatch event: bumping dev version")
+                    bump_part = "dev"
+                else:
+                    # Otherwise, bump the patch version number
+                    LOGGER.info(
+                        "repository_dispatch event: bumping patch version")
+                    bump_part = "patch"
             else:
-                # Otherwise, bump the patch version number
-                LOGGER.info(
-                    "repository_dispatch event: bumping patch version")
-                bump_command = ["patch", "--tag"]
+                raise Abort("repository_dispatch event: only dev branch is supported for release")
+            return old_var_vals, bump_part
+
+        def bump(results):
+            # Bump project version, in the project directory only, and tag the new version
+            bump_part = results["check_version"][1]
+            LOGGER.info("bumping %s version", bump_part)
+            instrument.annotate(part=bump_part)
+            return bump_version(PROJECT_DIR, bump_part, tag=True, backend=project_backend)
+
+        def edit_recipe(results):
+            # Update version number in feedstock metadata, read again as the rerender may have changed the recipe
+            recipe = Recipe(FEEDSTOCK_DIR, files=["recipe/meta.yaml"])
+            new_version = results["bump"]
+            # Do not increment the build number of a recipe that was already released at the new version
+            if recipe.get_all(["version", "git_rev"]) == dict(version=new_version, git_rev="v%s" % new_version):
+                LOGGER.info("feedstock recipe already at version %s", new_version)
+                return
+            new_var_vals = update_var_values(results["check_version"][0], new_version)
+            for v_type in version_types:
+                recipe.set(v_type, "v%s" % new_var_vals[v_type] if v_type == "git_rev" else new_var_vals[v_type])
+
+            # Write all vars at once
+            recipe.write()
+
+        if released is None:
+            tasks["check_version"] = (check_version, ["clone_feedstock", "clone_project"])
+            tasks["bump"] = (bump, ["clone_project", "check_version"])
         else:
-            LOGGER.info(
-                "repository_dispatch event: only dev branch is supported for release"
-            )
-            return
-
-        # Set credentials
-        user = "Delfi-C3"
-        email = "Delfi-C3@users.noreply.github.com"
-        # Specify in username if the commit results from a test
+            # The project was bumped and pushed by the interrupted run
+            tasks["check_version"] = (lambda results: (released["old_var_vals"], released["bump_part"]), [])
+            tasks["bump"] = (lambda results: released["version"], [])
+        # After the rerender, which stages all the changes of the feedstock
+        tasks["edit_recipe"] = (edit_recipe, ["clone_feedstock", "check_version", "bump"] +
+                                (["rerender"] if rerender else []))
+
+    def push(results):
+        # If in testing env, ask confirmation before pushing
         if "TEST_DICT" in os.environ:
-            user = "Delfi-C3-TEST"
-            email = "Delfi-C3-TEST@users.noreply.github.com"
-        subprocess.run(["git", "config", "--global", "user.name", user])
-        subprocess.run(["git", "config", "--global", "user.email", email])
-
-        # Get current working directory
-        cwd = os.getcwd()
-        # Bump project version
-        os.chdir(PROJECT_DIR)
-        bumpversion.cli.main(bump_command)
-        os.chdir(cwd)
-        LOGGER.info("bumping version with command: %s", bump_command)
-
-        # Get new version from version file in project repo open file
-        new_version = get_project_version(PROJECT_DIR)
-        if new_version is None:
-            return
-
-        # Update version number in feedstock metadata
-        new_var_vals = update_var_values(old_var_vals, new_version)
-        VAR_SUBSTITUTE = [(
-            "recipe/meta.yaml",
-            re.compile('{%\s*set\s*' + v_type + '\s*=\s*"([^"]*)"\s*%}'),
-            '{% set ' + v_type + ' = "v{}" %}' if v_type == "git_rev" else '{% set ' + v_type + ' = "{}" %}',
-            new_var_vals[v_type]
-        ) for v_type in version_types]
-
-        # Substitute all vars accordingly
-        substitute_vars_in_file(VAR_SUBSTITUTE, FEEDSTOCK_DIR)
-
-    # If in testing env, ask confirmation before pushing
-    if "TEST_DICT" in os.environ:
-        print("Last thing to do is to push to GitHub...")
-        go_ahead = input("Do you want to still do so (even from this test environment)? (y/[n]): ")
-        if go_ahead.lower() != "y":
-            print("Exiting...")
-            return
-
-    # Push changes to GitHub
-    to_push = []
-    if release:
-        to_push.append((s_repository, PROJECT_DIR))
-    if (rerender and rerender_commit_message is not None) or release:
-        to_push.append((s_repository_feedstock, FEEDSTOCK_DIR))
-    for repo, dir in to_push:
-        push_all_to_github(repo, branch_name, dir, commit_message)
+            print("Last thing to do is to push to GitHub...")
+            go_ahead = input("Do you want to still do so (even from this test environment)? (y/[n]): ")
+            if go_ahead.lower() != "y":
+                print("Exiting...")
+                return
+
+        # Push changes to GitHub, the project first as the feedstock refers to its new tag, recording each push once
+        # the remote accepted it, so that a new run of the event does not bump the project again. A rejected push
+        # raises, so that nothing after it is pushed or recorded
+        if release and released is None:
+            commit_id = push_all_to_github(s_repository, branch_name, PROJECT_DIR, commit_message,
+                                           backend=project_backend)
+            old_var_vals, bump_part = results["check_version"]
+            if run_key is not None and commit_id != plan["sha"]:
+                run_keys.append((*run_key[:2], commit_id, *run_key[3:]))
+            record("push_project", dict(version=results["bump"], bump_part=bump_part, old_var_vals=old_var_vals,
+                                        commit=commit_id))
+        rerender_commit_message, rerender_key = results["rerender"] if rerender else (None, None)
+        if rerender_commit_message is not None or release:
+            commit_id = push_all_to_github(s_repository_feedstock, branch_name, FEEDSTOCK_DIR, commit_message)
+            record("push_feedstock", dict(commit=commit_id))
+        # Record the rerender only once it is pushed, so that it is not skipped by the next runs if the push failed
+        record_rerender(s_repository_feedstock, branch_name, rerender_key)
+        # Mark the events merged into this run as processed too, before this one, so that their redeliveries are
+        # ignored instead of releasing the project again
+        if run_key is not None:
+            for sha in plan.get("coalesced_shas", []):
+                if sha and sha != plan["sha"]:
+                    result_store.record_phase((*run_key[:2], sha, *run_key[3:]), "done")
+        record("done")
+
+    # Push only once all the other tasks succeeded
+    tasks["push"] = (push, list(tasks))
+
+    run_graph(tasks, profile=["bump", "edit_recipe"])
 
 def remap(key):
     map = {
@@ -245,7 +581,7 @@ def simulate_repository_dispatch():
     if "GH_TOKEN" not in os.environ:
         raise ValueError("GH_TOKEN not set")
 
-    gh = Github(os.environ["GH_TOKEN"])
+    _, gh = create_api_sessions(os.environ["GH_TOKEN"])
     target_repo = "tudat-team/tudatpy"
     target_branch = "test_automation"
     
@@ -306,8 +642,5 @@ if __name__ == "__main__":
             simulate_repository_dispatch()
         except ValueError as e:
             print("Warning:", e)
-            print("This directory will be removed, and the script run again.")
-            shutil.rmtree(os.environ["GITHUB_WORKSPACE"])
-            simulate_repository_dispatch()
     else:
         main()
\ No newline at end of file
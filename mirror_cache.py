@@ -0,0 +1,163 @@
+import os
+import time
+import fcntl
+import shutil
+import logging
+import subprocess
+from contextlib import contextmanager
+from util import git_auth_args, get_cache_dir
+
+
+# Create logger with logging level set to all
+LOGGER = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+def get_mirror_name(clone_url):
+    """
+    Get the name of the cache entry of a repository.
+    Parameters
+    ----------
+    clone_url : str
+        The url the repository is cloned from.
+    Returns
+    -------
+    str
+        The cache entry name, of the form "<owner>__<repository>.git".
+    """
+    path = clone_url.rstrip("/")
+    if path.endswith(".git"):
+        path = path[:-len(".git")]
+    owner, name = path.replace(":", "/").split("/")[-2:]
+    return "%s__%s.git" % (owner, name)
+
+@contextmanager
+def lock_file(path, exclusive=True, blocking=True):
+    """
+    Hold an advisory lock on a file, creating the file if needed.
+    Parameters
+    ----------
+    path : str
+        The path of the lock file.
+    exclusive : bool
+        If True, take an exclusive lock, otherwise a shared one.
+    blocking : bool
+        If False, raise BlockingIOError instead of waiting when the lock is held by another process.
+    """
+    with open(path, "a") as fp:
+        flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        fcntl.flock(fp, flags)
+        try:
+            yield fp
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+@contextmanager
+def update_mirror(clone_url, branch, auth_token, cache_dir=None):
+    """
+    Create or incrementally update the bare mirror of a repository branch, and hold it locked.
+    Only the objects that are missing from the mirror are transferred. The mirror is locked for the duration
+    of the context, so that parallel runs do not fetch into, or evict, a mirror that is being cloned from.
+    Parameters
+    ----------
+    clone_url : str
+        The url the repository is cloned from.
+    branch : str
+        The branch to fetch.
+    auth_token : str
+        The GitHub access token.
+    cache_dir : str, optional
+        The directory containing the mirrors (default: the "mirrors" directory of the cache).
+    Yields
+    ------
+    str
+        The path to the bare mirror.
+    """
+    cache_dir = cache_dir or get_cache_dir("mirrors")
+    os.makedirs(cache_dir, exist_ok=True)
+    mirror_path = os.path.join(cache_dir, get_mirror_name(clone_url))
+
+    with lock_file(mirror_path + ".lock"):
+        if not os.path.isdir(mirror_path):
+            LOGGER.info("creating mirror of %s in %s", clone_url, mirror_path)
+            subprocess.run(["git", "init", "--quiet", "--bare", mirror_path], check=True)
+        else:
+            LOGGER.info("updating mirror of %s in %s", clone_url, mirror_path)
+
+        # Only fetch the branch that is needed, along with its tags
+        subprocess.run(
+            ["git", *git_auth_args(auth_token), "fetch", "--prune", "--tags", clone_url,
+             "+refs/heads/%s:refs/heads/%s" % (branch, branch)],
+            cwd=mirror_path, check=True)
+
+        # Mark the mirror as recently used, for the eviction
+        os.utime(mirror_path + ".lock")
+        yield mirror_path
+
+    evict_mirrors(cache_dir, keep=[mirror_path])
+
+def get_directory_size(path):
+    """
+    Get the total size of the files in a directory.
+    Parameters
+    ----------
+    path : str
+        The directory.
+    Returns
+    -------
+    int
+        The size in bytes.
+    """
+    size = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                size += os.lstat(os.path.join(root, file)).st_size
+            except FileNotFoundError:
+                pass
+    return size
+
+def evict_mirrors(cache_dir, keep=(), max_size=None, min_age=None):
+    """
+    Remove the least recently used mirrors until the cache is below its maximum size.
+    Mirrors that are locked by another process, or that were used less than `min_age` seconds ago, are never removed,
+    since working checkouts made from them may still be using their objects.
+    Parameters
+    ----------
+    cache_dir : str
+        The directory containing the mirrors.
+    keep : list[str]
+        Paths of mirrors that must not be removed.
+    max_size : int, optional
+        Maximum size of the cache, in bytes (default: MIRROR_CACHE_MAX_SIZE environment variable, or 5 GB).
+    min_age : float, optional
+        Minimum time since last use, in seconds, before a mirror can be removed
+        (default: MIRROR_CACHE_MIN_AGE environment variable, or 1 hour).
+    """
+    max_size = int(os.environ.get("MIRROR_CACHE_MAX_SIZE", 5 * 1024**3)) if max_size is None else max_size
+    min_age = float(os.environ.get("MIRROR_CACHE_MIN_AGE", 3600)) if min_age is None else min_age
+
+    # List the mirrors, from least to most recently used
+    mirrors = []
+    for entry in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, entry)
+        if entry.endswith(".git") and os.path.isdir(path):
+            lock_path = path + ".lock"
+            last_used = os.path.getmtime(lock_path) if os.path.exists(lock_path) else 0
+            mirrors.append((last_used, path, get_directory_size(path)))
+    mirrors.sort()
+
+    total_size = sum(size for _, _, size in mirrors)
+    for last_used, path, size in mirrors:
+        if total_size <= max_size:
+            break
+        if path in keep or time.time() - last_used < min_age:
+            continue
+        try:
+            with lock_file(path + ".lock", blocking=False):
+                LOGGER.info("evicting mirror %s (%.1f MB)", path, size / 1024**2)
+                shutil.rmtree(path)
+        except BlockingIOError:
+            continue
+        total_size -= size
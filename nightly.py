@@ -0,0 +1,152 @@
+import os
+import sys
+import time
+import json
+import logging
+import argparse
+import contextvars
+import concurrent.futures
+from main import plan_event, run_plan
+from pipeline import Abort
+from util import create_api_sessions, get_branches_metadata
+import instrument
+
+
+# Create logger with logging level set to all
+LOGGER = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+def parse_target(target):
+    """
+    Parse a nightly target of the form "<owner>/<repository>@<branch>".
+    Parameters
+    ----------
+    target : str
+        The target.
+    Returns
+    -------
+    tuple[str, str]
+        The repository name and branch name.
+    """
+    repo_name, sep, branch_name = target.strip().partition("@")
+    if not sep or repo_name.count("/") != 1 or not branch_name:
+        raise ValueError("invalid nightly target '%s', expected <owner>/<repository>@<branch>" % target)
+    return repo_name, branch_name
+
+def get_workspace_name(repo_name, branch_name):
+    return "%s@%s" % (repo_name.replace("/", "__"), branch_name.replace("/", "__"))
+
+def run_target(plan, workspace):
+    """
+    Run the plan of a nightly target, catching its errors so that they do not affect the other targets.
+    Returns
+    -------
+    dict
+        The status ("done", "aborted" if a step stopped the run before anything was pushed, or "failed"), duration
+        and error of the run.
+    """
+    start_time = time.time()
+    try:
+        with instrument.span("target", repository=plan["repository"], branch=plan["branch"]):
+            run_plan(plan, workspace)
+        return dict(status="done", duration=time.time() - start_time)
+    except Abort as e:
+        LOGGER.error("nightly run of %s@%s aborted: %s, nothing is pushed", plan["repository"], plan["branch"], e)
+        return dict(status="aborted", duration=time.time() - start_time, error=str(e))
+    except Exception as e:
+        LOGGER.exception("nightly run of %s@%s failed", plan["repository"], plan["branch"])
+        return dict(status="failed", duration=time.time() - start_time, error=repr(e))
+
+def run_nightly(targets, workspace, max_workers=4, sess=None):
+    """
+    Run the nightly rerender and release of several repositories and branches.
+    The last commit dates of all targets are fetched in one pass, then the pipelines of the targets run concurrently,
+    each in its own workspace.
+    Parameters
+    ----------
+    targets : list[tuple[str, str]]
+        The project repo names and branch names.
+    workspace : str
+        The directory in which a sub-directory is created for each target.
+    max_workers : int
+        The maximum number of targets processed at the same time.
+    sess : requests.Session, optional
+        The GitHub API session, as returned by `create_api_sessions` (default: a new session).
+    Returns
+    -------
+    list[dict]
+        The summary of each target: repository, branch, wether it was rerendered and released, status
+        ("done", "aborted", "failed" or "skipped"), duration and error.
+    """
+    if sess is None:
+        sess, _ = create_api_sessions(os.environ["GH_TOKEN"], with_github=False)
+
+    # Decide what to do for all targets, with a single metadata lookup
+    summary, runs = [], {}
+    for (repo_name, branch_name), metadata in zip(targets, get_branches_metadata(sess, targets)):
+        entry = dict(repository=repo_name, branch=branch_name, rerender=False, release=False, status="skipped")
+        summary.append(entry)
+        if metadata is None:
+            entry.update(status="failed", error="repository, feedstock or branch not found")
+            continue
+        event_data = dict(client_payload=dict(
+            event="nightly", repository=repo_name, ref_name=branch_name, ref_type="branch"))
+        plan = plan_event(event_data, "repository_dispatch", sess, metadata=metadata)
+        if plan is not None:
+            entry.update(rerender=plan["rerender"], release=plan["release"])
+            runs[len(summary) - 1] = plan
+
+    # Run the pipelines concurrently, in isolated workspaces
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(contextvars.copy_context().run, run_target, plan, os.path.join(
+                workspace, get_workspace_name(plan["repository"], plan["branch"]))): index
+            for index, plan in runs.items()
+        }
+        for future in concurrent.futures.as_completed(futures):
+            summary[futures[future]].update(future.result())
+    return summary
+
+def format_summary(summary):
+    """
+    Format the summary of a nightly run as a markdown table.
+    """
+    lines = ["| Target | Rerender | Release | Status | Duration |", "|---|---|---|---|---|"]
+    for entry in summary:
+        duration = "%.0fs" % entry["duration"] if "duration" in entry else "-"
+        status = entry["status"] + (" (%s)" % entry["error"] if "error" in entry else "")
+        lines.append("| %s@%s | %s | %s | %s | %s |" % (
+            entry["repository"], entry["branch"], entry["rerender"], entry["release"], status, duration))
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the nightly rerender and release of several projects.")
+    parser.add_argument("targets", nargs="*", help="targets, as <owner>/<repository>@<branch> "
+                        "(default: NIGHTLY_TARGETS environment variable, separated by spaces or commas)")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("NIGHTLY_WORKERS", 4)),
+                        help="maximum number of targets processed at the same time")
+    args = parser.parse_args()
+
+    targets = args.targets or os.environ.get("NIGHTLY_TARGETS", "").replace(",", " ").split()
+    if not targets:
+        parser.error("no targets given")
+    targets = [parse_target(target) for target in targets]
+
+    start_time = time.time()
+    instrument.start_report()
+    try:
+        summary = run_nightly(targets, os.environ["GITHUB_WORKSPACE"], max_workers=args.workers)
+    finally:
+        instrument.write_report()
+    LOGGER.info("nightly finished in %.0fs:\n%s", time.time() - start_time, format_summary(summary))
+    print(json.dumps(summary, indent=2))
+
+    # Add the summary to the page of the GitHub Actions run
+    if "GITHUB_STEP_SUMMARY" in os.environ:
+        with open(os.environ["GITHUB_STEP_SUMMARY"], "a") as fp:
+            fp.write("## Nightly summary\n\n%s\n" % format_summary(summary))
+
+    return 1 if any(entry["status"] in ("failed", "aborted") for entry in summary) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+import time
+import logging
+import contextvars
+import concurrent.futures
+import instrument
+
+
+# Create logger with logging level set to all
+LOGGER = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+class Abort(Exception):
+    """
+    Raised by a task to stop the pipeline without pushing anything, with the reason as message.
+    """
+
+def run_graph(tasks, max_workers=None, profile=()):
+    """
+    Run a graph of tasks, starting each task as soon as all of its dependencies are done.
+    If a task fails, no new task is started, the running ones are waited for, and the exception of the failed task is
+    raised. The critical path of the graph, the chain of dependencies that determined its duration, is logged and
+    added to the current span.
+    Parameters
+    ----------
+    tasks : dict[str, tuple[callable, list[str]]]
+        The function and the names of the dependencies of each task, by name. Each function is called with the
+        dictionary of the results of the tasks that are done, which contains the results of its dependencies.
+    max_workers : int, optional
+        Maximum number of tasks running at the same time (default: no limit).
+    profile : list[str]
+        Names of the tasks to profile, see `instrument.span`.
+    Returns
+    -------
+    dict[str, object]
+        The value returned by each task, by name.
+    """
+    for name, (_, dependencies) in tasks.items():
+        unknown = [dependency for dependency in dependencies if dependency not in tasks]
+        if unknown:
+            raise ValueError("task '%s' depends on unknown tasks %s" % (name, unknown))
+
+    results, timings = {}, {}
+    pending, running = dict(tasks), {}
+    start_time = time.perf_counter()
+
+    def run_task(name, function):
+        task_start_time = time.perf_counter()
+        try:
+            with instrument.span(name, profile=name in profile):
+                return function(results)
+        finally:
+            timings[name] = (task_start_time - start_time, time.perf_counter() - start_time)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or len(tasks) or 1) as executor:
+        while pending or running:
+            for name in [name for name, (_, dependencies) in pending.items()
+                         if all(dependency in results for dependency in dependencies)]:
+                function, _ = pending.pop(name)
+                # Run the task in a copy of the current context, so that its span is nested in the current span
+                future = executor.submit(contextvars.copy_context().run, run_task, name, function)
+                running[future] = name
+            if not running:
+                raise ValueError("dependency cycle between tasks %s" % list(pending))
+
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                if future.exception() is not None:
+                    if running:
+                        LOGGER.info("task '%s' failed, waiting for %s", name, ", ".join(running.values()))
+                        concurrent.futures.wait(running)
+                    raise future.exception()
+                results[name] = future.result()
+
+    path = get_critical_path(tasks, timings)
+    LOGGER.info("pipeline took %.1fs (%.1fs of tasks), critical path: %s", time.perf_counter() - start_time,
+                sum(end - start for start, end in timings.values()),
+                " -> ".join("%s (%.1fs)" % (name, timings[name][1] - timings[name][0]) for name in path))
+    instrument.annotate(critical_path=" -> ".join(path))
+    return results
+
+def get_critical_path(tasks, timings):
+    """
+    Get the critical path of a graph of tasks that ran: starting from the task that finished last, the chain of the
+    dependencies that finished last.
+    Parameters
+    ----------
+    tasks : dict[str, tuple[callable, list[str]]]
+        The tasks, as given to `run_graph`.
+    timings : dict[str, tuple[float, float]]
+        The start and end time of each task.
+    Returns
+    -------
+    list[str]
+        The names of the tasks of the critical path, in order.
+    """
+    if not timings:
+        return []
+    path = [max(timings, key=lambda name: timings[name][1])]
+    while True:
+        dependencies = [dependency for dependency in tasks[path[-1]][1] if dependency in timings]
+        if not dependencies:
+            return path[::-1]
+        path.append(max(dependencies, key=lambda name: timings[name][1]))
@@ -0,0 +1,225 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+import subprocess
+from util import get_cache_dir, write_json_atomic
+import instrument
+
+
+# Create logger with logging level set to all
+LOGGER = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Held by the thread that checks or updates the toolchain, along with a file lock for the other processes
+_LOCK = threading.Lock()
+
+# Solver commands used to update each package of the toolchain, in the base conda environment
+UPDATE_COMMANDS = {
+    "conda": ["conda", "update", "-n", "base", "-c", "defaults", "{spec}", "-y"],
+    "conda-smithy": ["conda", "install", "-n", "base", "-c", "conda-forge", "{spec}", "-y"],
+}
+
+def get_toolchain_specs():
+    """
+    Get the version requirements of the toolchain from the environment.
+    The requirements are read from the CONDA_VERSION_SPEC and CONDA_SMITHY_VERSION_SPEC environment variables,
+    as a minimum version (">=X.Y" or "X.Y") or a pinned version ("==X.Y.Z"). An empty requirement accepts any
+    installed version.
+    Returns
+    -------
+    dict[str, str]
+        The version requirement of each package of the toolchain.
+    """
+    return {
+        "conda": os.environ.get("CONDA_VERSION_SPEC", ""),
+        "conda-smithy": os.environ.get("CONDA_SMITHY_VERSION_SPEC", ""),
+    }
+
+def parse_version(version):
+    """
+    Convert a version string to a tuple that can be compared, ignoring non-numeric parts.
+    Parameters
+    ----------
+    version : str
+        The version, e.g. "23.11.0".
+    Returns
+    -------
+    tuple[int]
+        The numeric components of the version.
+    """
+    return tuple(int(part) for part in re.findall(r"\d+", version))
+
+def version_satisfies(version, spec):
+    """
+    Check if a version satisfies a requirement.
+    Parameters
+    ----------
+    version : str
+        The installed version, None if the package is not installed.
+    spec : str
+        The requirement: empty, a minimum version (">=X.Y" or "X.Y"), or a pinned version ("==X.Y.Z").
+    Returns
+    -------
+    bool
+        True if the version satisfies the requirement.
+    """
+    if version is None:
+        return False
+    spec = spec.strip()
+    if not spec:
+        return True
+    if spec.startswith("=="):
+        return parse_version(version) == parse_version(spec[2:])
+    return parse_version(version) >= parse_version(spec.lstrip(">="))
+
+def get_match_spec(package, spec):
+    """
+    Get the conda match specification of a package requirement, e.g. "conda-smithy>=3.30".
+    Parameters
+    ----------
+    package : str
+        The package name.
+    spec : str
+        The requirement, as accepted by `version_satisfies`.
+    Returns
+    -------
+    str
+        The match specification.
+    """
+    spec = spec.strip()
+    if spec and spec[0].isdigit():
+        spec = ">=" + spec
+    return package + spec
+
+def get_installed_versions(packages):
+    """
+    Get the installed versions of packages in the base conda environment, with a single conda call.
+    Parameters
+    ----------
+    packages : list[str]
+        The package names.
+    Returns
+    -------
+    dict[str, str]
+        The version of each package, None if it is not installed. None if conda could not be run.
+    """
+    try:
+        output = subprocess.run(["conda", "list", "-n", "base", "--json"],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    installed = {package["name"]: package["version"] for package in json.loads(output)}
+    return {package: installed.get(package) for package in packages}
+
+def load_state(state_path):
+    try:
+        with open(state_path, "r") as fp:
+            return json.load(fp)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_state(state_path, state):
+    write_json_atomic(state_path, state, indent=2)
+
+def get_recorded_versions(state_path=None):
+    """
+    Get the toolchain versions recorded by the last call to `ensure_toolchain`.
+    Parameters
+    ----------
+    state_path : str, optional
+        The path of the state file (default: "toolchain.json" in the cache).
+    Returns
+    -------
+    dict[str, str]
+        The version of each package of the toolchain.
+    """
+    return load_state(state_path or get_cache_dir("toolchain.json")).get("versions", {})
+
+def ensure_toolchain(specs=None, state_path=None):
+    """
+    Make sure conda and conda-smithy are installed and satisfy their version requirements.
+    The installed versions are recorded in a state file. The conda solver is only invoked for the packages that are
+    missing or that do not satisfy their requirement, and the time this saves is logged. Concurrent calls, from threads
+    or processes, are serialized, so that the base environment is checked and updated by one of them at a time.
+    The following environment variables are used:
+     * TOOLCHAIN_CHECK_INTERVAL: time in seconds during which the recorded versions are trusted without calling
+       conda (default: 3600).
+     * TOOLCHAIN_MAX_AGE: time in seconds after which the toolchain is updated even if it satisfies the requirements,
+       0 to never update it (default: 0).
+    Parameters
+    ----------
+    specs : dict[str, str], optional
+        The version requirement of each package (default: from `get_toolchain_specs`).
+    state_path : str, optional
+        The path of the state file (default: "toolchain.json" in the cache).
+    Returns
+    -------
+    bool
+        True if the toolchain is ready, False if conda was not found.
+    """
+    from mirror_cache import lock_file
+
+    specs = get_toolchain_specs() if specs is None else specs
+    state_path = state_path or get_cache_dir("toolchain.json")
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    # Parallel runs share the base environment: only one of them checks and updates it, and the others then use the
+    # versions it recorded
+    with _LOCK, lock_file(state_path + ".lock"):
+        return _ensure_toolchain(specs, state_path)
+
+def _ensure_toolchain(specs, state_path):
+    check_interval = float(os.environ.get("TOOLCHAIN_CHECK_INTERVAL", 3600))
+    max_age = float(os.environ.get("TOOLCHAIN_MAX_AGE", 0))
+    state = load_state(state_path)
+    now = time.time()
+
+    # Use the recorded versions if they were checked recently enough, against the same requirements
+    versions = state.get("versions")
+    if versions is None or state.get("specs") != specs or now - state.get("checked_at", 0) > check_interval:
+        versions = get_installed_versions(list(specs))
+        if versions is None:
+            LOGGER.error("conda not found")
+            return False
+        state.update(versions=versions, specs=specs, checked_at=now)
+    LOGGER.info("installed toolchain: %s", ", ".join("%s %s" % (p, v) for p, v in versions.items()))
+
+    # Find the packages that need to go through the solver
+    if max_age and now - state.get("updated_at", 0) > max_age:
+        LOGGER.info("toolchain was last updated more than %ds ago", max_age)
+        stale = list(specs)
+    else:
+        stale = [package for package, spec in specs.items() if not version_satisfies(versions[package], spec)]
+
+    if not stale:
+        solver_duration = state.get("solver_duration")
+        if solver_duration is None:
+            LOGGER.info("toolchain satisfies %s, skipping conda update/install", specs)
+        else:
+            LOGGER.info("toolchain satisfies %s, skipping conda update/install (saved ~%.0fs)", specs, solver_duration)
+        save_state(state_path, state)
+        return True
+
+    # Update the stale packages
+    start_time = time.time()
+    success = True
+    for package in stale:
+        LOGGER.info("updating %s (installed: %s, required: '%s')", package, versions[package], specs[package] or "any")
+        command = [arg.replace("{spec}", get_match_spec(package, specs[package])) for arg in UPDATE_COMMANDS[package]]
+        with instrument.span("conda_update", package=package):
+            success &= subprocess.run(command).returncode == 0
+    solver_duration = time.time() - start_time
+    LOGGER.info("toolchain updated in %.0fs", solver_duration)
+    if success:
+        # Only successful updates are representative of the time saved by skipping them
+        state.update(updated_at=time.time(), solver_duration=solver_duration)
+
+    versions = get_installed_versions(list(specs))
+    if versions is None:
+        LOGGER.error("conda not found")
+        return False
+    state.update(versions=versions, specs=specs, checked_at=time.time())
+    save_state(state_path, state)
+    return True
@@ -0,0 +1,186 @@
+import os
+import time
+import logging
+import threading
+import email.utils
+import requests
+import requests.adapters
+import urllib3.util.retry
+import instrument
+
+
+# Create logger with logging level set to all
+LOGGER = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Last known quota of each resource of the API ("core", "graphql", "search", ...), shared by all sessions since it
+# belongs to the token, with the reset time converted to the local clock
+_QUOTAS = {}
+# Time, on the local clock, until which no request is sent, after a secondary rate limit
+_BLOCKED_UNTIL = 0
+_LOCK = threading.Lock()
+
+class RateLimitError(requests.exceptions.RequestException):
+    """
+    Raised when a request would exceed the API budget of the session, or wait too long for the rate limit.
+    """
+
+def get_quotas():
+    """
+    Get the last known quota of each resource of the GitHub API.
+    Returns
+    -------
+    dict[str, dict]
+        The limit, the number of requests used and remaining, and the reset time (UNIX timestamp) of each resource.
+    """
+    with _LOCK:
+        return {resource: dict(quota) for resource, quota in _QUOTAS.items()}
+
+def get_resource(url):
+    """
+    Get the resource of the GitHub API whose quota is used by a request, before its response tells.
+    """
+    path = requests.utils.urlparse(url).path
+    if path.endswith("/graphql"):
+        return "graphql"
+    if "/search/" in path:
+        return "search"
+    return "core"
+
+def get_server_offset(headers):
+    """
+    Get the offset of the server clock relative to the local clock, in seconds, from the Date header of a response.
+    """
+    try:
+        return email.utils.parsedate_to_datetime(headers["Date"]).timestamp() - time.time()
+    except (KeyError, TypeError, ValueError):
+        return 0
+
+class RateLimitedHTTPAdapter(requests.adapters.HTTPAdapter):
+    """
+    HTTP adapter that follows the rate limits of the GitHub API.
+    The quota headers of the responses (X-RateLimit-Remaining/Reset) are tracked, so that once a quota is exhausted
+    the next requests wait until it is reset, instead of failing. Rate-limited responses (403 or 429) are retried after
+    their Retry-After delay, after the reset of the quota, or, for secondary rate limits without delay, after one
+    minute doubled at each attempt, as recommended by GitHub. Connection errors are retried by urllib3.
+    Parameters
+    ----------
+    budget : int, optional
+        Maximum number of requests sent with the session, 0 for no limit (default: API_BUDGET environment variable,
+        or 0).
+    max_wait : float, optional
+        Maximum time to wait for a rate limit, in seconds, above which `RateLimitError` is raised (default:
+        RATE_LIMIT_MAX_WAIT environment variable, or 900).
+    max_attempts : int
+        Maximum number of attempts of a rate-limited request.
+    **kwargs
+        Arguments passed to `requests.adapters.HTTPAdapter`.
+    """
+    def __init__(self, budget=None, max_wait=None, max_attempts=5, **kwargs):
+        # Only connection errors are retried by urllib3, rate-limited responses are retried by `send`
+        kwargs.setdefault("max_retries", urllib3.util.retry.Retry(total=3, backoff_factor=0.5))
+        super().__init__(**kwargs)
+        self.budget = int(os.environ.get("API_BUDGET", 0)) if budget is None else budget
+        self.max_wait = float(os.environ.get("RATE_LIMIT_MAX_WAIT", 900)) if max_wait is None else max_wait
+        self.max_attempts = max_attempts
+        self.requests_sent = 0
+        self.budget_lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        global _BLOCKED_UNTIL
+        resource = get_resource(request.url)
+        for attempt in range(self.max_attempts):
+            self.wait(resource)
+            with self.budget_lock:
+                if self.budget and self.requests_sent >= self.budget:
+                    raise RateLimitError("API budget of %d requests exhausted" % self.budget, request=request)
+                self.requests_sent += 1
+
+            response = super().send(request, **kwargs)
+            resource = self.update_quota(resource, response)
+            delay = self.get_retry_delay(resource, response, attempt)
+            if delay is None or attempt == self.max_attempts - 1:
+                return response
+            LOGGER.warning("rate limited by %s (status %d), retrying in %.0fs", request.url, response.status_code,
+                           delay)
+            instrument.count("github_rate_limited")
+            response.close()
+            if delay > 0:
+                with _LOCK:
+                    _BLOCKED_UNTIL = max(_BLOCKED_UNTIL, time.time() + delay)
+        return response
+
+    def wait(self, resource):
+        """
+        Wait until a request to a resource can be sent: after the reset of its exhausted quota, and after the delay of
+        the last secondary rate limit.
+        """
+        with _LOCK:
+            now = time.time()
+            delay = _BLOCKED_UNTIL - now
+            quota = _QUOTAS.get(resource)
+            if quota is not None and quota["remaining"] <= 0:
+                delay = max(delay, quota["reset"] - now)
+        if delay <= 0:
+            return
+        if delay > self.max_wait:
+            raise RateLimitError("GitHub API %s rate limit would take %.0fs to reset, more than %.0fs" % (
+                resource, delay, self.max_wait))
+        LOGGER.warning("GitHub API %s rate limit reached, waiting %.0fs", resource, delay)
+        instrument.count("github_rate_limit_wait_ms", int(delay * 1000))
+        time.sleep(delay)
+
+    def update_quota(self, resource, response):
+        """
+        Record the quota given in the headers of a response.
+        Returns
+        -------
+        str
+            The resource of the quota, as given by the response.
+        """
+        headers = response.headers
+        if "X-RateLimit-Remaining" not in headers:
+            return resource
+        resource = headers.get("X-RateLimit-Resource", resource)
+        try:
+            remaining = int(headers["X-RateLimit-Remaining"])
+            quota = dict(limit=int(headers.get("X-RateLimit-Limit", 0)), used=int(headers.get("X-RateLimit-Used", 0)),
+                         remaining=remaining,
+                         reset=int(headers.get("X-RateLimit-Reset", 0)) - get_server_offset(headers))
+        except ValueError:
+            return resource
+        with _LOCK:
+            _QUOTAS[resource] = quota
+        instrument.annotate(**{"github_%s_remaining" % resource: remaining})
+        if quota["limit"] and remaining == quota["limit"] // 10:
+            LOGGER.warning("only %d GitHub API %s requests remaining until %s", remaining, resource,
+                           time.strftime("%H:%M:%S", time.localtime(quota["reset"])))
+        return resource
+
+    def get_retry_delay(self, resource, response, attempt):
+        """
+        Get the time to wait before retrying a request, in seconds.
+        Returns
+        -------
+        float
+            The delay, 0 if the request has to wait for the reset of the quota only, None if the response is not rate
+            limited.
+        """
+        if response.status_code not in (403, 429):
+            # GraphQL requests that exceed the quota are answered with a 200 status and an error
+            if not (resource == "graphql" and response.status_code == 200 and
+                    response.headers.get("X-RateLimit-Remaining") == "0" and b'"RATE_LIMITED"' in response.content):
+                return None
+        if "Retry-After" in response.headers:
+            try:
+                return float(response.headers["Retry-After"])
+            except ValueError:
+                date = email.utils.parsedate_to_datetime(response.headers["Retry-After"])
+                return max(date.timestamp() - time.time() - get_server_offset(response.headers), 0)
+        if response.headers.get("X-RateLimit-Remaining") == "0":
+            # The next attempt waits for the reset of the quota
+            return 0
+        if b"secondary rate limit" in response.content.lower():
+            return 60 * 2 ** attempt
+        # Other errors, e.g. missing permissions
+        return None
@@ -0,0 +1,164 @@
+import os
+import re
+import logging
+from util import write_text_atomic
+
+
+# Create logger with logging level set to all
+LOGGER = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Jinja variable definition in a recipe, e.g. {% set version = "1.2.3" %}
+SET_VARIABLE_REGEX = re.compile(r'{%\s*set\s+(?P<name>\w+)\s*=\s*"(?P<value>[^"]*)"\s*%}')
+
+class RecipeFile:
+    """
+    A feedstock file containing `{% set ... %}` variables, read once and edited in memory.
+    Parameters
+    ----------
+    path : str
+        The path of the file.
+    text : str, optional
+        The content of the file, if it was already read (default: read from the path).
+    """
+    def __init__(self, path, text=None):
+        self.path = path
+        if text is None:
+            with open(path, "r") as fp:
+                text = fp.read()
+        self.text = text
+        self.edits = {}
+        # Extract all variables in one pass, keeping the first definition of each like `get_var_values` does
+        self.variables = {}
+        for match in SET_VARIABLE_REGEX.finditer(text):
+            self.variables.setdefault(match.group("name"), match.group("value"))
+
+    def set(self, name, value):
+        """
+        Set the value of a variable. The file is only changed when `write` is called.
+        Parameters
+        ----------
+        name : str
+            The variable name.
+        value : object
+            The new value, converted to a string.
+        """
+        if name not in self.variables:
+            raise KeyError("variable '%s' not defined in %s" % (name, self.path))
+        self.edits[name] = str(value)
+
+    def render(self):
+        """
+        Get the content of the file with all edits applied.
+        Returns
+        -------
+        str
+            The edited content.
+        """
+        if not self.edits:
+            return self.text
+
+        def substitute(match):
+            name = match.group("name")
+            if name not in self.edits:
+                return match.group(0)
+            return '{%% set %s = "%s" %%}' % (name, self.edits[name])
+
+        return SET_VARIABLE_REGEX.sub(substitute, self.text)
+
+    def write(self):
+        """
+        Write the edits to the file, atomically, by writing a temporary file and renaming it.
+        Returns
+        -------
+        bool
+            True if the file was written, False if there was nothing to write.
+        """
+        if not self.edits:
+            return False
+        text = self.render()
+        write_text_atomic(self.path, text)
+        self.text = text
+        self.variables.update(self.edits)
+        self.edits = {}
+        return True
+
+class Recipe:
+    """
+    The `{% set ... %}` variables of the files of a feedstock.
+    Every file is parsed once when the recipe is created, all edits are made in memory, and each edited file is
+    written once by `write`.
+    Parameters
+    ----------
+    root : str
+        The feedstock directory.
+    files : list[str]
+        The paths of the files, relative to the feedstock directory.
+    """
+    def __init__(self, root, files=("recipe/meta.yaml",)):
+        self.root = root
+        self.files = {file: RecipeFile(os.path.join(root, file)) for file in files}
+
+    def get(self, name, file=None):
+        """
+        Get the value of a variable.
+        Parameters
+        ----------
+        name : str
+            The variable name.
+        file : str, optional
+            The file to read the variable from (default: the first file that defines it).
+        Returns
+        -------
+        str
+            The value.
+        """
+        files = [self.files[file]] if file is not None else self.files.values()
+        for recipe_file in files:
+            if name in recipe_file.variables:
+                return recipe_file.edits.get(name, recipe_file.variables[name])
+        raise KeyError("variable '%s' not defined in %s" % (name, file or list(self.files)))
+
+    def get_all(self, names):
+        """
+        Get the values of several variables.
+        Parameters
+        ----------
+        names : list[str]
+            The variable names.
+        Returns
+        -------
+        dict[str, str]
+            The value of each variable.
+        """
+        return {name: self.get(name) for name in names}
+
+    def set(self, name, value, file=None):
+        """
+        Set the value of a variable, in all files that define it.
+        Parameters
+        ----------
+        name : str
+            The variable name.
+        value : object
+            The new value, converted to a string.
+        file : str, optional
+            If given, only set the variable in this file.
+        """
+        files = [self.files[file]] if file is not None else [f for f in self.files.values() if name in f.variables]
+        if not files:
+            raise KeyError("variable '%s' not defined in %s" % (name, list(self.files)))
+        for recipe_file in files:
+            recipe_file.set(name, value)
+
+    def write(self):
+        """
+        Write all edited files.
+        Returns
+        -------
+        list[str]
+            The paths of the files that were written.
+        """
+        written = [recipe_file.path for recipe_file in self.files.values() if recipe_file.write()]
+        LOGGER.info("updated %s", ", ".join(written) or "no files")
+        return written
@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from util import get_cache_dir, write_json_atomic
+
+
+# Create logger with logging level set to all
+LOGGER = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Paths of the feedstock that determine the output of a rerender
+RERENDER_INPUTS = ["recipe", "conda-forge.yml", "conda_build_config.yaml"]
+
+def get_input_ids(repo):
+    """
+    Get the git object ids of the rerender inputs at the HEAD of a feedstock repository.
+    The id of a directory is the id of its tree, which changes whenever any file inside of it changes.
+    Parameters
+    ----------
+    repo : pygit2.Repository
+        The feedstock repository.
+    Returns
+    -------
+    dict[str, str]
+        The object id of each input, None if it does not exist.
+    """
+    import pygit2
+
+    tree = repo.head.peel(pygit2.Commit).tree
+    return {path: str(tree[path].id) if path in tree else None for path in RERENDER_INPUTS}
+
+def get_pinning_version():
+    """
+    Get the version of conda-forge-pinning that a rerender would use.
+    The version is read from the PINNING_VERSION environment variable, or else it is the latest version published
+    on anaconda.org, which is what conda-smithy uses.
+    Returns
+    -------
+    str
+        The version, None if it could not be found.
+    """
+    if os.environ.get("PINNING_VERSION"):
+        return os.environ["PINNING_VERSION"]
+    import requests
+
+    try:
+        # The GitHub session is not used, so that the GitHub token is not sent to anaconda.org
+        response = requests.get("https://api.anaconda.org/package/conda-forge/conda-forge-pinning", timeout=30)
+        response.raise_for_status()
+        return response.json()["latest_version"]
+    except (requests.RequestException, KeyError, ValueError) as e:
+        LOGGER.warning("could not get the latest conda-forge-pinning version (%s)", e)
+        return None
+
+def get_rerender_key(input_ids, smithy_version, pinning_version):
+    """
+    Get the key of a rerender, which is the same for all rerenders that would produce the same output.
+    Parameters
+    ----------
+    input_ids : dict[str, str]
+        The object ids of the rerender inputs, as returned by `get_input_ids`.
+    smithy_version : str
+        The version of conda-smithy.
+    pinning_version : str
+        The version of conda-forge-pinning.
+    Returns
+    -------
+    str
+        The key, None if a version is unknown.
+    """
+    if smithy_version is None or pinning_version is None:
+        return None
+    data = dict(inputs=input_ids, conda_smithy=smithy_version, conda_forge_pinning=pinning_version)
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+
+def get_cache_path(feedstock_name, branch_name):
+    return get_cache_dir("rerender", "%s@%s.json" % (feedstock_name.replace("/", "__"), branch_name.replace("/", "__")))
+
+def is_up_to_date(feedstock_name, branch_name, key):
+    """
+    Check if the last successful rerender of a feedstock branch had the given key.
+    Parameters
+    ----------
+    feedstock_name : str
+        The full name of the feedstock repository.
+    branch_name : str
+        The branch name.
+    key : str
+        The key of the rerender, as returned by `get_rerender_key`.
+    Returns
+    -------
+    bool
+        True if the rerender can be skipped.
+    """
+    if key is None:
+        return False
+    try:
+        with open(get_cache_path(feedstock_name, branch_name), "r") as fp:
+            return json.load(fp)["key"] == key
+    except (FileNotFoundError, ValueError, KeyError):
+        return False
+
+def check_rerender(feedstock_name, branch_name, input_ids, smithy_version, pinning_version):
+    """
+    Get the key of the rerender of a feedstock branch, and check if the last successful rerender had the same key.
+    Parameters
+    ----------
+    feedstock_name : str
+        The full name of the feedstock repository.
+    branch_name : str
+        The branch name.
+    input_ids : dict[str, str]
+        The object ids of the rerender inputs, as returned by `get_input_ids`.
+    smithy_version : str
+        The version of conda-smithy.
+    pinning_version : str
+        The version of conda-forge-pinning.
+    Returns
+    -------
+    key : str
+        The key of the rerender, None if a version is unknown.
+    up_to_date : bool
+        True if the rerender can be skipped.
+    """
+    key = get_rerender_key(input_ids, smithy_version, pinning_version)
+    up_to_date = is_up_to_date(feedstock_name, branch_name, key)
+    if up_to_date:
+        LOGGER.info("feedstock inputs, conda-smithy %s and conda-forge-pinning %s unchanged since the last rerender of "
+                    "%s@%s, skipping the rerender", smithy_version, pinning_version, feedstock_name, branch_name)
+    return key, up_to_date
+
+def record_rerender(feedstock_name, branch_name, key):
+    """
+    Record the key of a successful rerender of a feedstock branch.
+    Parameters
+    ----------
+    feedstock_name : str
+        The full name of the feedstock repository.
+    branch_name : str
+        The branch name.
+    key : str
+        The key of the rerender, computed from the feedstock after the rerender.
+    """
+    if key is None:
+        return
+    write_json_atomic(get_cache_path(feedstock_name, branch_name), dict(key=key, recorded_at=time.time()))
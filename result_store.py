@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import contextlib
+from datetime import datetime, timezone
+from util import get_cache_dir
+
+
+# Create logger with logging level set to all
+LOGGER = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS phases (
+    repository TEXT NOT NULL,
+    branch TEXT NOT NULL,
+    sha TEXT NOT NULL,
+    event TEXT NOT NULL,
+    tags TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    outputs TEXT,
+    completed_at REAL NOT NULL,
+    PRIMARY KEY (repository, branch, sha, event, tags, phase)
+)
+"""
+
+def is_enabled():
+    return os.environ.get("RESULT_STORE", "1") != "0"
+
+@contextlib.contextmanager
+def connect(path=None):
+    """
+    Open the result store, committing the changes when leaving the context.
+    Parameters
+    ----------
+    path : str, optional
+        The path of the SQLite database (default: "results.sqlite" in the cache).
+    """
+    path = path or get_cache_dir("results.sqlite")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Concurrent runs (nightly targets, service workers) wait for each other's writes
+    connection = sqlite3.connect(path, timeout=30)
+    try:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(SCHEMA)
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+def get_event_id(event_type, now=None):
+    """
+    Get the event part of the key of a run. A nightly is a new event every day, even if the branch did not change.
+    """
+    if event_type == "nightly":
+        return "nightly-%s" % (now or datetime.now(timezone.utc)).strftime("%Y-%m-%d")
+    return event_type
+
+def get_run_key(plan):
+    """
+    Get the key of the run of a plan: its repository, branch, sha, event and tags.
+    Parameters
+    ----------
+    plan : dict
+        The plan, as returned by `plan_event`.
+    Returns
+    -------
+    tuple[str, str, str, str, str]
+        The key, None if the plan has no sha, or if the store is disabled.
+    """
+    if not is_enabled() or not plan.get("sha"):
+        return None
+    tags = ",".join(sorted(tag for tag, found in plan["tags"].items() if found))
+    return plan["repository"], plan["branch"], plan["sha"], get_event_id(plan["event"]), tags
+
+def get_phases(key, path=None):
+    """
+    Get the completed phases of a run.
+    Parameters
+    ----------
+    key : tuple
+        The key of the run, as returned by `get_run_key`.
+    path : str, optional
+        The path of the store.
+    Returns
+    -------
+    dict[str, object]
+        The outputs of each completed phase, by name.
+    """
+    with connect(path) as connection:
+        rows = connection.execute(
+            "SELECT phase, outputs FROM phases WHERE repository = ? AND branch = ? AND sha = ? AND event = ? "
+            "AND tags = ?", key).fetchall()
+    return {phase: json.loads(outputs) if outputs is not None else None for phase, outputs in rows}
+
+def is_done(repository, branch, sha, event_type, path=None):
+    """
+    Check if an event was already processed, whatever its tags, which only depend on the commit.
+    Parameters
+    ----------
+    repository : str
+        The full name of the project repository.
+    branch : str
+        The branch name.
+    sha : str
+        The commit hash.
+    event_type : str
+        The event type, "push" or "nightly".
+    path : str, optional
+        The path of the store.
+    Returns
+    -------
+    bool
+        True if a run of the event completed.
+    """
+    with connect(path) as connection:
+        row = connection.execute(
+            "SELECT 1 FROM phases WHERE repository = ? AND branch = ? AND sha = ? AND event = ? AND phase = 'done'",
+            (repository, branch, sha, get_event_id(event_type))).fetchone()
+    return row is not None
+
+def record_phase(key, phase, outputs=None, path=None):
+    """
+    Record a completed phase of a run, replacing any previous record of the same phase.
+    Parameters
+    ----------
+    key : tuple
+        The key of the run, as returned by `get_run_key`.
+    phase : str
+        The phase name, "done" once the whole run completed.
+    outputs : object, optional
+        The outputs of the phase, which must be serializable to JSON.
+    path : str, optional
+        The path of the store.
+    """
+    with connect(path) as connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO phases (repository, branch, sha, event, tags, phase, outputs, completed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (*key, phase, json.dumps(outputs) if outputs is not None else None, time.time()))
+    LOGGER.info("recorded phase %s of %s", phase, "@".join(key[:3]))
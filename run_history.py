@@ -0,0 +1,208 @@
+import os
+import sys
+import time
+import sqlite3
+import logging
+import argparse
+import contextlib
+from util import get_cache_dir
+from instrument import percentile
+
+
+# Create logger with logging level set to all
+LOGGER = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started_at REAL NOT NULL,
+    duration REAL NOT NULL,
+    event TEXT,
+    repository TEXT,
+    branch TEXT,
+    rerender INTEGER,
+    release INTEGER,
+    status TEXT NOT NULL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS phases (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    name TEXT NOT NULL,
+    wall_time REAL NOT NULL,
+    child_cpu_time REAL NOT NULL,
+    PRIMARY KEY (run_id, name)
+);
+CREATE INDEX IF NOT EXISTS runs_started_at ON runs (started_at);
+"""
+
+@contextlib.contextmanager
+def connect(path=None):
+    """
+    Open the run history, committing the changes when leaving the context.
+    Parameters
+    ----------
+    path : str, optional
+        The path of the SQLite database (default: "history.sqlite" in the cache).
+    """
+    path = path or get_cache_dir("history.sqlite")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30)
+    try:
+        connection.executescript(SCHEMA)
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+def record_run(report, payload, error=None, status=None, path=None):
+    """
+    Append a run to the history: its event, repository and branch, the decisions of its plan, and the total wall
+    time and subprocess CPU time of each of its phases.
+    Parameters
+    ----------
+    report : dict
+        The report of the run, as returned by `instrument.get_report`.
+    payload : dict
+        The client payload of the dispatch event.
+    error : str, optional
+        The error that stopped the run.
+    status : str, optional
+        The status of the run: "done", "aborted" if a step stopped it before anything was pushed, or "failed"
+        (default: "failed" if there is an error, "done" otherwise).
+    path : str, optional
+        The path of the history.
+    """
+    phases, decisions = {}, {}
+    for record in report["spans"]:
+        wall_time, child_cpu_time = phases.get(record["name"], (0, 0))
+        phases[record["name"]] = (wall_time + record.get("wall_time", 0),
+                                  child_cpu_time + record.get("child_cpu_time", 0))
+        if record["name"] == "plan":
+            decisions = record["attrs"]
+    with connect(path) as connection:
+        run_id = connection.execute(
+            "INSERT INTO runs (started_at, duration, event, repository, branch, rerender, release, status, error) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (report["started_at"], report["duration"], payload.get("event"), payload.get("repository"),
+             payload.get("ref_name"), decisions.get("rerender"), decisions.get("release"),
+             status or ("failed" if error is not None else "done"), error)).lastrowid
+        connection.executemany(
+            "INSERT INTO phases (run_id, name, wall_time, child_cpu_time) VALUES (?, ?, ?, ?)",
+            [(run_id, name, wall_time, child_cpu_time) for name, (wall_time, child_cpu_time) in phases.items()])
+
+def get_phase_times(connection, start, end, repository=None, event=None):
+    """
+    Get the wall times of each phase, and of the whole runs as the "total" phase, for the runs started in a period.
+    Returns
+    -------
+    dict[str, list[float]]
+        The wall times, in seconds, of each phase.
+    """
+    conditions, parameters = ["runs.started_at >= ?", "runs.started_at < ?"], [start, end]
+    if repository is not None:
+        conditions.append("runs.repository = ?")
+        parameters.append(repository)
+    if event is not None:
+        conditions.append("runs.event = ?")
+        parameters.append(event)
+    where = " AND ".join(conditions)
+    times = {}
+    for name, wall_time in connection.execute(
+            "SELECT 'total', duration FROM runs WHERE %s UNION ALL "
+            "SELECT phases.name, phases.wall_time FROM phases JOIN runs ON runs.id = phases.run_id WHERE %s"
+            % (where, where), parameters * 2):
+        times.setdefault(name, []).append(wall_time)
+    return times
+
+def get_trends(connection, days=7, baseline_days=28, threshold=1.25, min_runs=5, repository=None, event=None,
+               now=None):
+    """
+    Compare the latency of each phase in the last days with the trailing baseline before them.
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The run history.
+    days : float
+        The length of the window, in days.
+    baseline_days : float
+        The length of the baseline, in days, which ends where the window starts.
+    threshold : float
+        The ratio of the p50 of the window to the p50 of the baseline above which a phase regressed.
+    min_runs : int
+        The minimum number of runs of a phase, in the window and in the baseline, to flag it.
+    repository : str, optional
+        Only use the runs of this repository.
+    event : str, optional
+        Only use the runs of this event type.
+    now : float, optional
+        The end of the window, as a UNIX timestamp (default: now).
+    Returns
+    -------
+    list[dict]
+        For each phase: its name, number of runs, p50 and p95 in the window, p50 of the baseline, ratio of the p50s,
+        and wether it regressed.
+    """
+    now = time.time() if now is None else now
+    window_start = now - days * 86400
+    window = get_phase_times(connection, window_start, now, repository, event)
+    baseline = get_phase_times(connection, window_start - baseline_days * 86400, window_start, repository, event)
+    trends = []
+    for name in sorted(window, key=lambda name: (name != "total", name)):
+        p50 = percentile(window[name], 0.5)
+        baseline_p50 = percentile(baseline.get(name, []), 0.5)
+        ratio = p50 / baseline_p50 if baseline_p50 else None
+        trends.append(dict(
+            name=name, runs=len(window[name]), p50=p50, p95=percentile(window[name], 0.95), baseline_p50=baseline_p50,
+            baseline_runs=len(baseline.get(name, [])), ratio=ratio,
+            regressed=ratio is not None and ratio > threshold and
+                      len(window[name]) >= min_runs and len(baseline[name]) >= min_runs))
+    return trends
+
+def format_trends(trends):
+    """
+    Format the trends of the phases as a markdown table.
+    """
+    lines = ["| Phase | Runs | p50 | p95 | Baseline p50 | Ratio | |", "|---|---|---|---|---|---|---|"]
+    for trend in trends:
+        lines.append("| %s | %d | %.2fs | %.2fs | %s | %s | %s |" % (
+            trend["name"], trend["runs"], trend["p50"], trend["p95"],
+            "%.2fs (%d runs)" % (trend["baseline_p50"], trend["baseline_runs"])
+            if trend["baseline_p50"] is not None else "-",
+            "%.2f" % trend["ratio"] if trend["ratio"] is not None else "-",
+            "**regressed**" if trend["regressed"] else ""))
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Report the latency of the phases of the recorded runs, and flag the phases that became slower.")
+    parser.add_argument("--days", type=float, default=7, help="length of the reported window, in days")
+    parser.add_argument("--baseline-days", type=float, default=28,
+                        help="length of the baseline before the window, in days")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="ratio of the p50 of a phase to its baseline above which it is flagged")
+    parser.add_argument("--min-runs", type=int, default=5,
+                        help="minimum number of runs of a phase, in the window and the baseline, to flag it")
+    parser.add_argument("--repository", help="only report the runs of this repository")
+    parser.add_argument("--event", help="only report the runs of this event type")
+    parser.add_argument("--db", help="path of the run history (default: history.sqlite in the cache)")
+    args = parser.parse_args()
+
+    with connect(args.db) as connection:
+        trends = get_trends(connection, args.days, args.baseline_days, args.threshold, args.min_runs,
+                            args.repository, args.event)
+    if not trends:
+        print("no runs in the last %g days" % args.days)
+        return 0
+    print(format_trends(trends))
+    regressed = [trend["name"] for trend in trends if trend["regressed"]]
+    if regressed:
+        LOGGER.warning("phases slower than %.2f times their baseline: %s", args.threshold, ", ".join(regressed))
+    # Add the report to the page of the GitHub Actions run
+    if "GITHUB_STEP_SUMMARY" in os.environ:
+        with open(os.environ["GITHUB_STEP_SUMMARY"], "a") as fp:
+            fp.write("## Phase latency over the last %g days\n\n%s\n" % (args.days, format_trends(trends)))
+    return 1 if regressed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,304 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import collections
+import concurrent.futures
+from main import plan_event, run_plan
+from pipeline import Abort
+from coalesce import EventCoalescer
+from util import create_api_sessions
+from rate_limit import get_quotas
+from instrument import percentile
+
+
+# Create logger with logging level set to all
+LOGGER = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Maximum size of a request body, in bytes
+MAX_BODY_SIZE = 1024**2
+# Number of finished jobs that are remembered for the status and latency metrics
+JOB_HISTORY_SIZE = 1000
+
+HTTP_REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+                413: "Payload Too Large", 503: "Service Unavailable"}
+
+class DispatchService:
+    """
+    Long-running service that receives dispatch events over HTTP, queues them, and processes them with a bounded
+    pool of workers.
+    The GitHub API session, the toolchain state and the repository mirrors are kept between events, so that
+    an event does not pay for a cold start. The events received for the same repository and branch within
+    a time window are merged, so that the rerender and release run once for all of them, and the runs of
+    a same repository and branch never overlap.
+    Parameters
+    ----------
+    workspace : str
+        The directory in which each worker clones the repositories, in its own sub-directory.
+    workers : int
+        The number of events processed at the same time.
+    max_queue : int
+        The maximum number of queued events, above which new events are rejected.
+    token : str, optional
+        If set, the token that clients must send as "Authorization: Bearer <token>".
+    coalesce_window : float
+        The time, in seconds, to wait for more events of the same repository and branch before running them.
+    """
+    def __init__(self, workspace, workers=2, max_queue=100, token=None, coalesce_window=30):
+        self.workspace = workspace
+        self.workers = workers
+        self.token = token
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.jobs = collections.OrderedDict()
+        self.counts = collections.Counter()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.coalescer = EventCoalescer(self.enqueue, coalesce_window)
+        self.branch_locks = collections.defaultdict(asyncio.Lock)
+        self.planning_tasks = set()
+        # Keep the GitHub session, with its connection pool and cache, warm between events. It is shared by all the
+        # runs, so the API budget of a run does not apply to it
+        self.sess, _ = create_api_sessions(os.environ["GH_TOKEN"], with_github=False, budget=0)
+
+    def submit(self, event_data):
+        """
+        Accept a dispatch event, and start planning it.
+        Parameters
+        ----------
+        event_data : dict
+            The event data, containing the client payload of the dispatch.
+        Returns
+        -------
+        dict
+            The job created for the event.
+        Raises
+        ------
+        asyncio.QueueFull
+            If the queue is full.
+        """
+        if self.queue.full():
+            raise asyncio.QueueFull()
+        payload = event_data["client_payload"]
+        job = dict(
+            id=uuid.uuid4().hex,
+            repository=payload.get("repository"),
+            branch=payload.get("ref_name"),
+            event=payload.get("event"),
+            sha=payload.get("sha"),
+            status="planning",
+            submitted_at=time.time(),
+        )
+        self.jobs[job["id"]] = job
+        while len(self.jobs) > JOB_HISTORY_SIZE:
+            self.jobs.popitem(last=False)
+        self.counts["submitted"] += 1
+        task = asyncio.create_task(self.plan(job, event_data))
+        self.planning_tasks.add(task)
+        task.add_done_callback(self.planning_tasks.discard)
+        return job
+
+    async def plan(self, job, event_data):
+        """
+        Decide what has to be done for an event, and pass its plan to the coalescer.
+        Parameters
+        ----------
+        job : dict
+            The job of the event.
+        event_data : dict
+            The event data, containing the client payload of the dispatch.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            plan = await loop.run_in_executor(None, plan_event, event_data, "repository_dispatch", self.sess)
+        except Exception as e:
+            LOGGER.exception("planning job %s failed", job["id"])
+            self.finish([job], "failed", repr(e))
+            return
+        if plan is None:
+            self.finish([job], "skipped")
+            return
+        job["status"] = "pending"
+        self.coalescer.add(plan, job)
+
+    def enqueue(self, plan, jobs):
+        """
+        Queue the merged plan of one or several jobs.
+        Parameters
+        ----------
+        plan : dict
+            The merged plan.
+        jobs : list[dict]
+            The jobs of the events merged in the plan.
+        """
+        try:
+            self.queue.put_nowait((jobs, plan))
+        except asyncio.QueueFull:
+            self.counts["rejected"] += len(jobs)
+            self.finish(jobs, "rejected", "queue is full")
+            return
+        for job in jobs:
+            job.update(status="queued", run_id=jobs[-1]["id"])
+        LOGGER.info("queued %s@%s (rerender: %s, release: %s) for %d event(s), queue depth: %d", plan["repository"],
+                    plan["branch"], plan["rerender"], plan["release"], len(jobs), self.queue.qsize())
+
+    def finish(self, jobs, status, error=None):
+        for job in jobs:
+            job.update(status=status, finished_at=time.time())
+            job.setdefault("started_at", job["finished_at"])
+            if error is not None:
+                job["error"] = error
+            self.counts[status] += 1
+
+    async def worker(self, index):
+        """
+        Run queued plans, one at a time.
+        Parameters
+        ----------
+        index : int
+            The index of the worker, used for its workspace.
+        """
+        loop = asyncio.get_running_loop()
+        workspace = os.path.join(self.workspace, "worker-%d" % index)
+        while True:
+            jobs, plan = await self.queue.get()
+            # Never push to the same repository and branch from two workers at once
+            async with self.branch_locks[(plan["repository"], plan["branch"])]:
+                for job in jobs:
+                    job.update(status="running", started_at=time.time())
+                try:
+                    await loop.run_in_executor(self.executor, run_plan, plan, workspace)
+                    self.finish(jobs, "done")
+                except Abort as e:
+                    LOGGER.error("run of %s@%s aborted: %s, nothing is pushed", plan["repository"], plan["branch"], e)
+                    self.finish(jobs, "aborted", str(e))
+                except Exception as e:
+                    LOGGER.exception("run of %s@%s failed", plan["repository"], plan["branch"])
+                    self.finish(jobs, "failed", repr(e))
+                finally:
+                    self.queue.task_done()
+            job = jobs[-1]
+            LOGGER.info("run %s %s in %.1fs (%.1fs after the first event)", job["id"], job["status"],
+                        job["finished_at"] - job["started_at"], job["finished_at"] - jobs[0]["submitted_at"])
+
+    def metrics(self):
+        """
+        Get the metrics of the service.
+        Returns
+        -------
+        dict
+            The queue depth, the number of jobs by status, and percentiles of the job latencies, in seconds.
+        """
+        finished = [job for job in self.jobs.values() if "finished_at" in job]
+        run_times = [job["finished_at"] - job["started_at"] for job in finished]
+        total_times = [job["finished_at"] - job["submitted_at"] for job in finished]
+        return dict(
+            queue_depth=self.queue.qsize(),
+            pending_branches=len(self.coalescer.pending),
+            running=sum(job["status"] == "running" for job in self.jobs.values()),
+            workers=self.workers,
+            counts=dict(self.counts),
+            github_quotas=get_quotas(),
+            run_latency=dict(p50=percentile(run_times, 0.5), p95=percentile(run_times, 0.95),
+                             max=max(run_times, default=None)),
+            total_latency=dict(p50=percentile(total_times, 0.5), p95=percentile(total_times, 0.95),
+                               max=max(total_times, default=None)),
+        )
+
+    def route(self, method, path, headers, body):
+        """
+        Handle an HTTP request.
+        Returns
+        -------
+        status : int
+            The HTTP status code.
+        response : dict
+            The JSON response.
+        """
+        if self.token is not None and headers.get("authorization") != "Bearer %s" % self.token:
+            return 401, dict(error="unauthorized")
+        if method == "GET" and path == "/metrics":
+            return 200, self.metrics()
+        if method == "GET" and path.startswith("/jobs/"):
+            job = self.jobs.get(path[len("/jobs/"):])
+            return (200, job) if job is not None else (404, dict(error="unknown job"))
+        if method == "POST" and path == "/dispatch":
+            try:
+                event_data = json.loads(body)
+                event_data["client_payload"]["event"]
+            except (ValueError, KeyError, TypeError):
+                return 400, dict(error="expected a JSON body with a client_payload")
+            try:
+                return 202, self.submit(event_data)
+            except asyncio.QueueFull:
+                self.counts["rejected"] += 1
+                return 503, dict(error="queue is full")
+        return 404, dict(error="not found")
+
+    async def handle_connection(self, reader, writer):
+        """
+        Read an HTTP request from a connection, and write its response.
+        """
+        try:
+            method, path, _ = (await reader.readline()).decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, value = line.decode("latin-1").split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+            content_length = int(headers.get("content-length", 0))
+            if content_length > MAX_BODY_SIZE:
+                status, response = 413, dict(error="body too large")
+            else:
+                body = await reader.readexactly(content_length)
+                status, response = self.route(method, path, headers, body)
+        except (ValueError, asyncio.IncompleteReadError):
+            status, response = 400, dict(error="bad request")
+
+        data = json.dumps(response).encode("utf-8")
+        writer.write(b"HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n"
+                     b"Connection: close\r\n\r\n" % (status, HTTP_REASONS[status].encode("ascii"), len(data)))
+        writer.write(data)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        """
+        Start the workers, and serve HTTP requests until cancelled.
+        Parameters
+        ----------
+        host : str
+            The address to listen on.
+        port : int
+            The port to listen on.
+        """
+        workers = [asyncio.create_task(self.worker(index)) for index in range(self.workers)]
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        LOGGER.info("dispatch service listening on %s:%d with %d workers", host, port, self.workers)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+def main():
+    # Reuse the repository clones between events
+    os.environ.setdefault("MIRROR_CACHE", "1")
+    service = DispatchService(
+        os.environ.get("GITHUB_WORKSPACE", os.path.join(os.getcwd(), "workspace")),
+        workers=int(os.environ.get("SERVICE_WORKERS", 2)),
+        max_queue=int(os.environ.get("SERVICE_QUEUE_SIZE", 100)),
+        token=os.environ.get("SERVICE_TOKEN") or None,
+        coalesce_window=float(os.environ.get("COALESCE_WINDOW", 30)),
+    )
+    asyncio.run(service.serve(os.environ.get("SERVICE_HOST", "127.0.0.1"), int(os.environ.get("SERVICE_PORT", 8080))))
+
+if __name__ == "__main__":
+    main()
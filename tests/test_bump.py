@@ -0,0 +1,126 @@
+"""
+Tests of bump.py against bumpversion, on the configuration of tudatpy.
+
+Each test bumps two copies of the same repository, one with `bumpversion <part> --tag`, which the action used to run,
+and one with `bump.bump_version`, and compares their files, commits and tags.
+
+Usage: python -m pytest tests
+"""
+import os
+import sys
+import subprocess
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bump
+import git_backend
+
+# Configuration of tudatpy: the dev versions are released by dropping the "dev" release and its number. bumpversion
+# rewrites the whole file at each bump, with a space after the equal sign of the multi-line values
+TUDATPY_CONFIG = "\n".join([
+    "[bumpversion]",
+    "current_version = {version}",
+    "commit = True",
+    "tag = False",
+    r"parse = (?P<major>\d+)\.(?P<minor>\d+)\.(?P<patch>\d+)(\.(?P<release>[a-z]+)(?P<dev>\d+))?",
+    "serialize = ",
+    "\t{{major}}.{{minor}}.{{patch}}.{{release}}{{dev}}",
+    "\t{{major}}.{{minor}}.{{patch}}",
+    "",
+    "[bumpversion:part:release]",
+    "optional_value = gamma",
+    "values = ",
+    "\tdev",
+    "\tgamma",
+    "",
+    "[bumpversion:part:dev]",
+    "",
+    "[bumpversion:file:version]",
+    "",
+])
+
+def git(directory, *args):
+    return subprocess.run(["git", *args], cwd=directory, check=True, stdout=subprocess.PIPE, text=True).stdout
+
+def make_repository(directory, version):
+    """
+    Create a repository with the version file and the bumpversion configuration of tudatpy, at a version.
+    """
+    os.makedirs(directory)
+    files = {
+        "version": version + "\n",
+        ".bumpversion.cfg": TUDATPY_CONFIG.format(version=version),
+        # Contains the version, but is not in the configuration, so must not be changed
+        "README.md": "# tudatpy %s\n" % version,
+    }
+    for path, text in files.items():
+        with open(os.path.join(directory, path), "w") as fp:
+            fp.write(text)
+    git(directory, "init", "--quiet")
+    git_backend.set_identity(directory, "Test", "test@example.com")
+    git(directory, "add", "--all")
+    git(directory, "commit", "--quiet", "-m", "Initial commit")
+    return directory
+
+def get_state(directory):
+    """
+    Get what a bump changes in a repository: the files, the tree and message of each commit, and the tags.
+    """
+    files = {}
+    for path in ["version", ".bumpversion.cfg", "README.md"]:
+        with open(os.path.join(directory, path), "r") as fp:
+            files[path] = fp.read()
+    # The commits differ by their dates, so their trees are compared instead of their ids
+    tags = {}
+    for line in git(directory, "for-each-ref", "refs/tags", "--format=%(refname:short) %(objecttype)").splitlines():
+        name, object_type = line.split()
+        tags[name] = (object_type, git(directory, "rev-parse", name + "^{tree}").strip(),
+                      git(directory, "tag", "--list", "--format=%(contents:subject)", name).strip())
+    return dict(
+        files=files,
+        status=git(directory, "status", "--porcelain"),
+        commits=git(directory, "log", "--format=%T %s"),
+        head_tags=git(directory, "tag", "--points-at", "HEAD"),
+        tags=tags,
+    )
+
+def run_bumpversion(directory, part):
+    return subprocess.run([sys.executable, "-m", "bumpversion", part, "--tag"], cwd=directory,
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+
+@pytest.mark.parametrize("version", ["0.7.3.dev0", "0.7.3.dev12", "0.7.3", "1.10.0"])
+def test_parse_serialize(tmp_path, version):
+    config = bump.read_config(make_repository(str(tmp_path / "repo"), version))
+    values = bump.parse_version(version, config)
+    assert list(values) == ["major", "minor", "patch", "release", "dev"]
+    assert bump.serialize_version(values, config) == version
+
+@pytest.mark.parametrize("backend", ["pygit2", "subprocess"])
+@pytest.mark.parametrize("version, parts, new_version", [
+    ("0.7.3.dev0", ["dev"], "0.7.3.dev1"),
+    ("0.7.3.dev9", ["dev"], "0.7.3.dev10"),
+    ("0.7.3.dev0", ["patch"], "0.7.4.dev0"),
+    ("0.7.3", ["patch"], "0.7.4.dev0"),
+    # Rollover of a dev version to its release
+    ("0.7.3.dev4", ["release"], "0.7.3"),
+    ("0.7.3.dev0", ["dev", "dev", "release", "patch", "dev"], "0.7.4.dev1"),
+])
+def test_bump_matches_bumpversion(tmp_path, backend, version, parts, new_version):
+    expected = make_repository(str(tmp_path / "bumpversion"), version)
+    actual = make_repository(str(tmp_path / "bump"), version)
+    for part in parts:
+        result = run_bumpversion(expected, part)
+        assert result.returncode == 0, result.stdout
+        returned_version = bump.bump_version(actual, part, tag=True, backend=backend)
+    assert returned_version == new_version
+    assert get_state(actual) == get_state(expected)
+
+def test_bump_release_of_release(tmp_path):
+    # The release part of a release is already at its last value
+    expected = make_repository(str(tmp_path / "bumpversion"), "0.7.3")
+    actual = make_repository(str(tmp_path / "bump"), "0.7.3")
+    assert run_bumpversion(expected, "release").returncode != 0
+    with pytest.raises(ValueError):
+        bump.bump_version(actual, "release", tag=True)
+    # Nothing is changed when the bump fails
+    assert get_state(actual) == get_state(expected)
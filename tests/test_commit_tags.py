@@ -0,0 +1,91 @@
+"""
+Tests of the detection of the `[CI]` and `[rerender]` tags in the commit messages of a push, and of the reading of
+the pushed commits from the client payload of its dispatch.
+
+Usage: python -m pytest tests
+"""
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import util
+
+SUPPORTED_TAGS = ["ci", "rerender"]
+
+@pytest.mark.parametrize("message, expected_tags, expected_message", [
+    ("[CI] Fix the build", dict(ci=True, rerender=False), "CI: Fix the build"),
+    # The tags do not have to be at the start of the message
+    ("Fix the build [CI]", dict(ci=True, rerender=False), "CI: Fix the build"),
+    ("Fix [rerender] the build", dict(ci=False, rerender=True), "RERENDER: Fix the build"),
+    ("Fix the build\n\nLonger description [CI]", dict(ci=True, rerender=False), "CI: Fix the build Longer description"),
+    # Mixed case and padded tags
+    ("[ci] Fix the build", dict(ci=True, rerender=False), "CI: Fix the build"),
+    ("[ Rerender ] Fix the build", dict(ci=False, rerender=True), "RERENDER: Fix the build"),
+    ("[Ci][ReRender] Fix the build", dict(ci=True, rerender=True), "CI, RERENDER: Fix the build"),
+    # A tag given twice is only added once in front
+    ("[CI] Fix the build [ci]", dict(ci=True, rerender=False), "CI: Fix the build"),
+    # Unsupported brackets are left in the message
+    ("[CI] Fix [WIP] the build [skip ci]", dict(ci=True, rerender=False), "CI: Fix [WIP] the build [skip ci]"),
+    ("Fix a[i] [CI]", dict(ci=True, rerender=False), "CI: Fix a[i]"),
+])
+def test_find_commit_tags(message, expected_tags, expected_message):
+    tags, commit_message = util.find_commit_tags([message], supported_tags=SUPPORTED_TAGS)
+    assert tags == expected_tags
+    assert commit_message == expected_message
+
+@pytest.mark.parametrize("message", [
+    "Fix the build",
+    "Fix the build [WIP] [skip ci]",
+    # Not closed, or across lines
+    "[CI Fix the build",
+    "Fix the build [C\nI]",
+    "",
+])
+def test_find_commit_tags_none(message):
+    tags, commit_message = util.find_commit_tags([message], supported_tags=SUPPORTED_TAGS)
+    assert tags == dict(ci=False, rerender=False)
+    assert commit_message is None
+
+def test_find_commit_tags_of_push():
+    # The tag is not on the head commit: it is found, and the message of the commit that has it is used
+    messages = ["[CI] Bump the dependencies", "Fix a typo", "Update the README"]
+    tags, commit_message = util.find_commit_tags(messages, supported_tags=SUPPORTED_TAGS)
+    assert tags == dict(ci=True, rerender=False)
+    assert commit_message == "CI: Bump the dependencies"
+
+    # The tags of all commits are found, and the message of the newest commit with tags is used
+    messages = ["[rerender] Update the pinning", "[CI] Fix the build", "Fix a typo"]
+    tags, commit_message = util.find_commit_tags(messages, supported_tags=SUPPORTED_TAGS)
+    assert tags == dict(ci=True, rerender=True)
+    assert commit_message == "CI: Fix the build"
+
+    assert util.find_commit_tags([], supported_tags=SUPPORTED_TAGS) == (dict(ci=False, rerender=False), None)
+
+@pytest.mark.parametrize("payload, expected", [
+    # The "commits" of the push event are preferred to its "head_commit"
+    (dict(commits=[dict(message="First"), dict(message="[CI] Second")], head_commit=dict(message="[CI] Second")),
+     ["First", "[CI] Second"]),
+    (dict(head_commit=dict(message="[CI] Second")), ["[CI] Second"]),
+    # Falls back to the "head_commit" if the "commits" are empty or malformed
+    (dict(commits=[], head_commit=dict(message="Head")), ["Head"]),
+    (dict(commits=[dict(message="First"), dict(id="abc")], head_commit=dict(message="Head")), ["Head"]),
+    (dict(commits="[CI]", head_commit=dict(message="Head")), ["Head"]),
+    # No messages in the payload
+    (dict(), None),
+    (dict(commits=[dict(id="abc")]), None),
+    (dict(head_commit=None), None),
+    (dict(head_commit=dict(message=None)), None),
+])
+def test_get_payload_commit_messages(payload, expected):
+    assert util.get_payload_commit_messages(payload) == expected
+
+@pytest.mark.parametrize("payload, expected", [
+    (dict(before="6dcb09b5b57875f334f61aebed695e2e4193db5e"), "6dcb09b5b57875f334f61aebed695e2e4193db5e"),
+    # The push created the branch
+    (dict(before="0" * 40), None),
+    (dict(), None),
+    (dict(before=None), None),
+])
+def test_get_payload_compare_base(payload, expected):
+    assert util.get_payload_compare_base(payload) == expected
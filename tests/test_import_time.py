@@ -0,0 +1,29 @@
+"""
+Tests of the startup latency of the events that `main()` ignores: each path of benchmarks/check_import_time.py must
+stay within its time budget, and must not import the heavy modules that it does not need.
+
+Usage: python -m pytest tests
+"""
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+import check_import_time
+
+REPEAT = 3
+
+@pytest.fixture(scope="module")
+def environment():
+    with check_import_time.offline_environment() as environment:
+        yield environment
+
+@pytest.mark.parametrize("name", [path[0] for path in check_import_time.get_paths({})])
+def test_import_time(environment, name):
+    env, payload = environment
+    _, event_name, event_payload, budget, forbidden = next(
+        path for path in check_import_time.get_paths(payload) if path[0] == name)
+    result = check_import_time.check_path(event_name, event_payload, env, budget, forbidden, REPEAT)
+    assert not [module for module in result["modules"] if module in forbidden]
+    assert result["median"] <= budget, "%s took %.1f ms, more than its budget of %.0f ms" % (
+        name, result["median"], budget)
@@ -0,0 +1,146 @@
+"""
+Tests of the task graph of pipeline.py: the order of the tasks, the propagation of failures, the detection of
+dependency cycles, and the critical path.
+
+Usage: python -m pytest tests
+"""
+import os
+import sys
+import time
+import threading
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pipeline
+
+def record(events, name, result=None, delay=0):
+    """
+    Get a task function that records when it starts and ends, and returns a result.
+    """
+    def function(results):
+        events.append(("start", name, dict(results)))
+        time.sleep(delay)
+        events.append(("end", name, None))
+        return result
+    return function
+
+def test_run_graph_order():
+    events = []
+    tasks = {
+        "clone": (record(events, "clone", "repository"), []),
+        "provision": (record(events, "provision", "conda"), []),
+        "rerender": (record(events, "rerender", "rerendered"), ["clone", "provision"]),
+        "push": (record(events, "push", "pushed"), ["rerender"]),
+    }
+    results = pipeline.run_graph(tasks)
+    assert results == dict(clone="repository", provision="conda", rerender="rerendered", push="pushed")
+    # Each task starts after its dependencies, and is given their results
+    for kind, name, given in events:
+        if kind == "start":
+            for dependency in tasks[name][1]:
+                assert ("end", dependency, None) in events[:events.index((kind, name, given))]
+                assert given[dependency] == results[dependency]
+
+def test_run_graph_concurrency():
+    running, max_running, lock = [0], [0], threading.Lock()
+    def function(results):
+        with lock:
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+    tasks = {name: (function, []) for name in "abcd"}
+    pipeline.run_graph(tasks)
+    assert max_running[0] == 4
+    max_running[0] = 0
+    pipeline.run_graph(tasks, max_workers=2)
+    assert max_running[0] == 2
+
+@pytest.mark.parametrize("exception", [pipeline.Abort("version mismatch"), RuntimeError("clone failed")])
+def test_run_graph_failure(exception):
+    events = []
+    slow_started = threading.Event()
+    def fail(results):
+        # Fail while the independent task is running
+        slow_started.wait(5)
+        raise exception
+    def slow(results):
+        slow_started.set()
+        return record(events, "slow", delay=0.2)(results)
+    tasks = {
+        "fail": (fail, []),
+        "slow": (slow, []),
+        "dependent": (record(events, "dependent"), ["fail"]),
+        "after_slow": (record(events, "after_slow"), ["slow"]),
+    }
+    with pytest.raises(type(exception)) as info:
+        pipeline.run_graph(tasks)
+    assert info.value is exception
+    # The running task was waited for, but no task was started after the failure
+    assert [(kind, name) for kind, name, _ in events] == [("start", "slow"), ("end", "slow")]
+
+def test_run_graph_unknown_dependency():
+    events = []
+    with pytest.raises(ValueError, match="unknown"):
+        pipeline.run_graph({"a": (record(events, "a"), []), "b": (record(events, "b"), ["c"])})
+    # The graph is checked before any task is started
+    assert events == []
+
+def test_run_graph_cycle():
+    events = []
+    with pytest.raises(ValueError, match="cycle"):
+        pipeline.run_graph({"a": (record(events, "a"), ["b"]), "b": (record(events, "b"), ["a"])})
+    assert events == []
+
+    # A cycle that is only reached once its dependencies are done
+    tasks = {
+        "root": (record(events, "root"), []),
+        "a": (record(events, "a"), ["root", "b"]),
+        "b": (record(events, "b"), ["a"]),
+    }
+    with pytest.raises(ValueError, match="cycle"):
+        pipeline.run_graph(tasks)
+    assert [name for kind, name, _ in events if kind == "start"] == ["root"]
+
+def test_run_graph_empty():
+    assert pipeline.run_graph({}) == {}
+
+def test_get_critical_path():
+    tasks = {
+        "metadata": (None, []),
+        "clone_project": (None, ["metadata"]),
+        "clone_feedstock": (None, ["metadata"]),
+        "provision": (None, []),
+        "bump": (None, ["clone_project"]),
+        "rerender": (None, ["clone_feedstock", "provision"]),
+        "push": (None, ["bump", "rerender"]),
+    }
+    timings = {
+        "metadata": (0.0, 1.0),
+        "clone_project": (1.0, 3.0),
+        "clone_feedstock": (1.0, 2.0),
+        "provision": (0.0, 4.0),
+        "bump": (3.0, 3.5),
+        "rerender": (4.0, 10.0),
+        "push": (10.0, 11.0),
+    }
+    assert pipeline.get_critical_path(tasks, timings) == ["provision", "rerender", "push"]
+    # The clone of the feedstock becomes critical when the provisioning is faster
+    timings["provision"] = (0.0, 1.5)
+    assert pipeline.get_critical_path(tasks, timings) == ["metadata", "clone_feedstock", "rerender", "push"]
+    # Only the tasks that ran are on the path, e.g. after a failure
+    del timings["push"], timings["rerender"]
+    assert pipeline.get_critical_path(tasks, timings) == ["metadata", "clone_project", "bump"]
+    assert pipeline.get_critical_path(tasks, {}) == []
+
+def test_run_graph_critical_path(monkeypatch):
+    annotations = {}
+    monkeypatch.setattr(pipeline.instrument, "annotate", lambda **attrs: annotations.update(attrs))
+    events = []
+    pipeline.run_graph({
+        "fast": (record(events, "fast"), []),
+        "slow": (record(events, "slow", delay=0.2), []),
+        "last": (record(events, "last"), ["fast", "slow"]),
+    })
+    assert annotations["critical_path"] == "slow -> last"
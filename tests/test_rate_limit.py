@@ -0,0 +1,189 @@
+"""
+Tests of the rate limiting of the GitHub API requests by rate_limit.py, with scripted responses and a fake clock: the
+Retry-After delays, the primary and secondary rate limits, the rate-limited GraphQL responses, and the API budget.
+
+Usage: python -m pytest tests
+"""
+import os
+import sys
+import json
+import email.utils
+import pytest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import rate_limit
+
+API_URL = "https://api.github.com/repos/tudat-team/tudatpy"
+GRAPHQL_URL = "https://api.github.com/graphql"
+# Local time at the start of each test
+START_TIME = 1700000000.0
+
+class FakeGitHub:
+    """
+    Stand-in for the transport of the adapter, which answers the requests with scripted responses, and for the
+    clock, which only advances when the adapter sleeps.
+    """
+    def __init__(self):
+        self.now = START_TIME
+        self.sleeps = []
+        self.responses = []
+        self.requests = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def send(self, request, **kwargs):
+        self.requests.append((self.now, request.url))
+        status_code, headers, body = self.responses.pop(0)
+        response = requests.Response()
+        response.status_code = status_code
+        response.headers = requests.structures.CaseInsensitiveDict(headers)
+        response._content = json.dumps(body).encode("utf-8")
+        response._content_consumed = True
+        response.url = request.url
+        response.request = request
+        return response
+
+@pytest.fixture
+def github(monkeypatch):
+    fake = FakeGitHub()
+    monkeypatch.setattr(rate_limit.time, "time", fake.time)
+    monkeypatch.setattr(rate_limit.time, "sleep", fake.sleep)
+    monkeypatch.setattr(requests.adapters.HTTPAdapter, "send", lambda adapter, request, **kwargs: fake.send(request))
+    # The quotas are shared by all sessions of the process
+    monkeypatch.setattr(rate_limit, "_QUOTAS", {})
+    monkeypatch.setattr(rate_limit, "_BLOCKED_UNTIL", 0)
+    return fake
+
+def make_session(**kwargs):
+    kwargs.setdefault("budget", 0)
+    kwargs.setdefault("max_wait", 900)
+    sess = requests.Session()
+    sess.mount("https://", rate_limit.RateLimitedHTTPAdapter(**kwargs))
+    return sess
+
+def quota_headers(remaining, reset, limit=5000, resource="core"):
+    return {"X-RateLimit-Limit": str(limit), "X-RateLimit-Remaining": str(remaining),
+            "X-RateLimit-Used": str(limit - remaining), "X-RateLimit-Reset": str(int(reset)),
+            "X-RateLimit-Resource": resource}
+
+def test_not_rate_limited(github):
+    github.responses = [(200, quota_headers(4999, START_TIME + 3600), {"name": "tudatpy"}),
+                        # Missing permissions, with quota left, are not retried
+                        (403, quota_headers(4998, START_TIME + 3600), {"message": "Resource not accessible"})]
+    sess = make_session()
+    assert sess.get(API_URL).json() == {"name": "tudatpy"}
+    assert sess.get(API_URL).status_code == 403
+    assert len(github.requests) == 2
+    assert github.sleeps == []
+    assert rate_limit.get_quotas()["core"]["remaining"] == 4998
+
+@pytest.mark.parametrize("status_code", [403, 429])
+def test_retry_after_seconds(github, status_code):
+    github.responses = [(status_code, {"Retry-After": "30"}, {"message": "You have exceeded a secondary rate limit"}),
+                        (200, {}, {"name": "tudatpy"})]
+    assert make_session().get(API_URL).status_code == 200
+    assert github.sleeps == [30]
+    assert github.requests[1][0] == START_TIME + 30
+
+def test_retry_after_date(github):
+    retry_after = email.utils.formatdate(START_TIME + 45, usegmt=True)
+    github.responses = [(429, {"Retry-After": retry_after}, {}), (200, {}, {})]
+    assert make_session().get(API_URL).status_code == 200
+    assert github.sleeps == [pytest.approx(45)]
+
+def test_retry_after_date_server_clock(github):
+    # The server clock is 10s ahead of the local clock, the date is converted to the local clock
+    headers = {"Retry-After": email.utils.formatdate(START_TIME + 10 + 45, usegmt=True),
+               "Date": email.utils.formatdate(START_TIME + 10, usegmt=True)}
+    github.responses = [(429, headers, {}), (200, {}, {})]
+    assert make_session().get(API_URL).status_code == 200
+    assert github.sleeps == [pytest.approx(45)]
+
+def test_primary_rate_limit(github):
+    github.responses = [(403, quota_headers(0, START_TIME + 120), {"message": "API rate limit exceeded"}),
+                        (200, quota_headers(4999, START_TIME + 3720), {})]
+    assert make_session().get(API_URL).status_code == 200
+    # The retry waits for the reset of the quota
+    assert github.sleeps == [pytest.approx(120)]
+    assert rate_limit.get_quotas()["core"]["remaining"] == 4999
+
+def test_primary_rate_limit_exhausted(github):
+    # The last request of the quota succeeds, the next one waits for the reset before being sent, in any session
+    github.responses = [(200, quota_headers(0, START_TIME + 60), {}), (200, quota_headers(4999, START_TIME + 3660), {})]
+    assert make_session().get(API_URL).status_code == 200
+    assert github.sleeps == []
+    assert make_session().get(API_URL).status_code == 200
+    assert github.sleeps == [pytest.approx(60)]
+    assert github.requests[1][0] == pytest.approx(START_TIME + 60)
+
+def test_primary_rate_limit_other_resource(github):
+    # The core quota is exhausted, but the GraphQL one is not
+    github.responses = [(200, quota_headers(0, START_TIME + 60), {}),
+                        (200, quota_headers(4999, START_TIME + 3600, resource="graphql"), {"data": {}})]
+    sess = make_session()
+    sess.get(API_URL)
+    assert sess.post(GRAPHQL_URL, json={"query": "{}"}).status_code == 200
+    assert github.sleeps == []
+
+def test_max_wait(github):
+    github.responses = [(200, quota_headers(0, START_TIME + 3600), {})]
+    sess = make_session(max_wait=900)
+    sess.get(API_URL)
+    with pytest.raises(rate_limit.RateLimitError):
+        sess.get(API_URL)
+    assert github.sleeps == []
+    assert len(github.requests) == 1
+
+def test_secondary_rate_limit(github):
+    body = {"message": "You have exceeded a secondary rate limit. Please wait a few minutes before you try again."}
+    github.responses = [(403, quota_headers(4000, START_TIME + 3600), body),
+                        (403, quota_headers(3999, START_TIME + 3600), body),
+                        (200, quota_headers(3998, START_TIME + 3600), {})]
+    assert make_session().get(API_URL).status_code == 200
+    # One minute, doubled at each attempt
+    assert github.sleeps == [60, 120]
+
+def test_secondary_rate_limit_max_attempts(github):
+    body = {"message": "You have exceeded a secondary rate limit"}
+    github.responses = [(403, {}, body)] * 3
+    response = make_session(max_attempts=3).get(API_URL)
+    # The last rate-limited response is returned
+    assert response.status_code == 403
+    assert len(github.requests) == 3
+    assert github.sleeps == [60, 120]
+
+def test_graphql_rate_limited(github):
+    # GraphQL requests that exceed the quota are answered with a 200 status
+    body = {"errors": [{"type": "RATE_LIMITED", "message": "API rate limit exceeded"}]}
+    github.responses = [(200, quota_headers(0, START_TIME + 90, resource="graphql"), body),
+                        (200, quota_headers(4999, START_TIME + 3690, resource="graphql"), {"data": {}})]
+    response = make_session().post(GRAPHQL_URL, json={"query": "{}"})
+    assert response.json() == {"data": {}}
+    assert github.sleeps == [pytest.approx(90)]
+
+def test_graphql_error(github):
+    # Other GraphQL errors are not retried
+    body = {"errors": [{"type": "NOT_FOUND", "message": "Could not resolve to a Repository"}]}
+    github.responses = [(200, quota_headers(4999, START_TIME + 3600, resource="graphql"), body)]
+    assert make_session().post(GRAPHQL_URL, json={"query": "{}"}).json() == body
+    assert len(github.requests) == 1
+    assert github.sleeps == []
+
+def test_budget(github):
+    github.responses = [(429, {"Retry-After": "1"}, {}), (200, {}, {}), (200, {}, {})]
+    sess = make_session(budget=3)
+    sess.get(API_URL)
+    sess.get(API_URL)
+    # The retries count against the budget
+    with pytest.raises(rate_limit.RateLimitError, match="budget"):
+        sess.get(API_URL)
+    assert len(github.requests) == 3
+    # The budget belongs to the session
+    github.responses = [(200, {}, {})]
+    assert make_session(budget=3).get(API_URL).status_code == 200
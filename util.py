@@ -1,61 +1,70 @@
 import os
-import requests
-import urllib3.util.retry
+import json
+import base64
 import logging
 import subprocess
+import shutil
 import re
+import time
+import signal
 import pprint
+import tempfile
+import selectors
+import collections
+import concurrent.futures
+import contextvars
 from datetime import datetime, timedelta
-import pygit2
-from github import Github
-from github.GithubException import UnknownObjectException
+import instrument
+# requests, pygit2 and PyGithub are imported by the functions that use them, so that the events that are ignored
+# exit without loading them
 
 
 # Create logger with logging level set to all
 LOGGER = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-def get_project_and_feedstock_repos(github_client, repo_name):
+# Version of the projects, e.g. 0.7.3 or 0.7.3.dev12
+VERSION_PEP440 = re.compile(r'(?P<major>\d+)\.(?P<minor>\d+)\.(?P<patch>\d+)(\.(?P<release>[a-z]+)(?P<dev>\d+))?')
+
+def run_concurrently(tasks, max_workers=None):
     """
-    Get the project and feedstock repos from the repo name.
+    Run independent tasks on a thread pool and wait for all of them.
+    If a task fails, the tasks that have not started yet are cancelled, the running ones are waited for,
+    and the exception of the failed task is raised.
     Parameters
     ----------
-    github_client : github.MainClass.Github
-        The Github client.
-    repo_name : str
-        The repo name.
+    tasks : dict[str, callable]
+        Functions without arguments to run, by task name.
+    max_workers : int, optional
+        Maximum number of threads (default: one per task).
     Returns
     -------
-    project_repo : github.Repository.Repository
-        The project repository.
-    feedstock_repo : github.Repository.Repository
-        The feedstock repository.
-    feedstock_repo_name : str
-        The feedstock repository name.
+    dict[str, object]
+        The value returned by each function, by task name.
     """
-    feedstock_repo_name = repo_name + "-feedstock"
-    project_repo = github_client.get_repo(repo_name)
-
-    # Get feedstock repository
-    try:
-        feedstock_repo = github_client.get_repo(feedstock_repo_name)
-    # If feedstock repo does not exist, log an error and exit
-    except UnknownObjectException:
-        LOGGER.error(
-            "repository_dispatch event: feedstock repository of '%s' not found" % repo_name)
-        return None, None, None
+    if not tasks:
+        return {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or len(tasks)) as executor:
+        # Run each task in a copy of the current context, so that its spans are nested in the current span
+        futures = {executor.submit(contextvars.copy_context().run, task): name for name, task in tasks.items()}
+        done, pending = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_EXCEPTION)
+        for future in done:
+            if future.exception() is not None:
+                for other_future in pending:
+                    other_future.cancel()
+                LOGGER.error("task '%s' failed, cancelling the remaining tasks", futures[future])
+                raise future.exception()
+        return {name: future.result() for future, name in futures.items()}
 
-    return project_repo, feedstock_repo, feedstock_repo_name
-
-def get_project_version(repo_dir, VERSION_PEP440=re.compile(r'(?P<major>\d+)\.(?P<minor>\d+)\.(?P<patch>\d+)(\.(?P<release>[a-z]+)(?P<dev>\d+))?')):
+def get_project_version(repo_dir, VERSION_PEP440=VERSION_PEP440):
     """
     Get the project version from the version file in a given repository.
     Parameters
     ----------
     repo_dir : str
         The path to the repo directory.
-    VERSION_PEP440 : re.compile
-        The regex to match the version.
+    VERSION_PEP440 : re.Pattern, optional
+        The regex to match the version (default: the `VERSION_PEP440` constant of the module).
     Returns
     -------
     str
@@ -63,7 +72,23 @@ def get_project_version(repo_dir, VERSION_PEP440=re.compile(r'(?P<major>\d+)\.(?
     """
     # Get version from version file in project repo
     with open(os.path.join(repo_dir, "version"), 'r') as fp:
-        version = fp.read().rstrip("\n")
+        return parse_project_version(fp.read(), VERSION_PEP440)
+
+def parse_project_version(text, VERSION_PEP440=VERSION_PEP440):
+    """
+    Parse the project version from the content of its version file.
+    Parameters
+    ----------
+    text : str
+        The content of the version file.
+    VERSION_PEP440 : re.Pattern, optional
+        The regex to match the version (default: the `VERSION_PEP440` constant of the module).
+    Returns
+    -------
+    str
+        The project version, None if it could not be parsed.
+    """
+    version = text.rstrip("\n")
 
     # Match version from file to pep440 and retrieve groups
     match = VERSION_PEP440.match(version)
@@ -89,15 +114,13 @@ def get_project_version(repo_dir, VERSION_PEP440=re.compile(r'(?P<major>\d+)\.(?
             "repository_dispatch event: could not parse version")
         return None
 
-def get_commit_tags(repo, commit_hash, supported_tags=["ci", "rerender"]):
+def find_commit_tags(messages, supported_tags=["ci", "rerender"], TAG_REGEX=re.compile(r'\[([^\[\]\n]*)\]')):
     """
-    Get the tags of a commit.
+    Get the tags of the commits of a push, looking at every bracketed token of every commit message.
     Parameters
     ----------
-    repo : github.Repository.Repository
-        The repository.
-    commit_hash : str
-        The commit hash.
+    messages : list[str]
+        The commit messages, from the oldest to the newest.
     supported_tags : list[str]
         List of tags that are to be searched for.
     Returns
@@ -105,60 +128,90 @@ def get_commit_tags(repo, commit_hash, supported_tags=["ci", "rerender"]):
     tags : dict[str, bool]
         Dictionary of tags found, with supported tags as keys and the value denoting wether they were found.
     commit_message : str
-        New commit message cleaned of the tag in brackets, but with the tag in front instead.
-    """
-    # Get commit from its sha
-    commit = repo.get_commit(sha=commit_hash)
-    message = commit.raw_data["commit"]["message"]
-
-    # Extract commit tag if there is one
-    tag = re.search(r'\[(.*?)\]', message)
-    if tag:
-        tag = tag.group(1)
-        LOGGER.info("tag: %s", tag)
-
-        if tag.lower() in supported_tags:
-            # Remove tag from message, and add it in front
-            commit_message = message.replace(f'[{tag}]', "")
-            # Clean excess spaces
-            commit_message = re.sub(r'\s+', " ", commit_message).strip()
-            # Add tag in front of commit message
-            commit_message = "%s: %s" % (tag.upper(), commit_message)
-
-            # Return True for the tag that was found
-            return {possible_tag: tag.lower() == possible_tag for possible_tag in supported_tags}, commit_message
-        else:
-            # Quit if the tag is not in the list of supported ones
-            LOGGER.info(
-                "no supported tag detected (was '%s', supported are %s" % (tag, supported_tags)
-            )
-            return {possible_tag: False for possible_tag in supported_tags}, None
-    else:
-        # Quit if there is not tag
-        LOGGER.info("no tag detected")
-        return {possible_tag: False for possible_tag in supported_tags}, None
+        The newest commit message with tags, cleaned of the tags in brackets, but with the tags in front instead.
+        None if no supported tag was found.
+    """
+    tags = {possible_tag: False for possible_tag in supported_tags}
+    tagged = None
+    for message in messages:
+        found = [tag for tag in TAG_REGEX.findall(message) if tag.strip().lower() in tags]
+        for tag in found:
+            tags[tag.strip().lower()] = True
+        if found:
+            tagged = message, found
+
+    if tagged is None:
+        # Quit if there is no supported tag
+        LOGGER.info("no supported tag detected in %d commit message(s) (supported are %s)", len(messages),
+                    supported_tags)
+        return tags, None
+
+    message, found = tagged
+    LOGGER.info("tags: %s", ", ".join(found))
+    # Remove tags from message, and add them in front
+    commit_message = TAG_REGEX.sub(lambda m: "" if m.group(1).strip().lower() in tags else m.group(0), message)
+    # Clean excess spaces
+    commit_message = re.sub(r'\s+', " ", commit_message).strip()
+    # Add tags in front of commit message
+    commit_message = "%s: %s" % (", ".join(dict.fromkeys(tag.strip().upper() for tag in found)), commit_message)
+    return tags, commit_message
 
-def was_branch_last_commit_recent(repo, branch_name, time_treshold=timedelta(hours=24)):
+def get_payload_commit_messages(payload):
     """
-    Check if the last commit of a branch is recent.
+    Get the commit messages of a push from the client payload of its dispatch, if the sender included them, as the
+    "commits" and "head_commit" fields of the GitHub push event.
     Parameters
     ----------
-    repo : github.Repository.Repository
-        The repository.
-    branch_name : str
-        The branch name.
+    payload : dict
+        The client payload.
+    Returns
+    -------
+    list[str]
+        The commit messages, from the oldest to the newest, None if the payload does not contain them.
+    """
+    commits = payload.get("commits")
+    if commits and all(isinstance(commit, dict) and isinstance(commit.get("message"), str) for commit in commits):
+        return [commit["message"] for commit in commits]
+    head_commit = payload.get("head_commit")
+    if isinstance(head_commit, dict) and isinstance(head_commit.get("message"), str):
+        return [head_commit["message"]]
+    return None
+
+def get_payload_compare_base(payload):
+    """
+    Get the commit before a push from the client payload of its dispatch, if the sender included it, as the "before"
+    field of the GitHub push event.
+    Parameters
+    ----------
+    payload : dict
+        The client payload.
+    Returns
+    -------
+    str
+        The sha of the commit before the push, None if the payload does not contain it or if the push created the
+        branch, in which case the sha is all zeros.
+    """
+    before = payload.get("before")
+    if not isinstance(before, str) or before.strip("0") == "":
+        return None
+    return before
+
+def is_date_recent(date_string, time_treshold=timedelta(hours=24)):
+    """
+    Check if a commit date is recent.
+    Parameters
+    ----------
+    date_string : str
+        The commit date, as returned by the GitHub API (e.g. "2023-01-31T12:00:00Z").
     time_treshold : datetime.timedelta
-        The time threshold under which the last commit will be considered recent.
+        The time threshold under which the commit will be considered recent.
     Returns
     -------
     bool
-        True if the last commit is recent, False otherwise.
+        True if the commit is recent, False otherwise.
     """
-    # Get info of latest commit for given branch
-    branch = repo.get_branch(branch_name)
-    date_string = branch.commit.raw_data["commit"]["author"]["date"]
     last_commit_time = datetime.strptime(date_string, "%Y-%m-%dT%H:%M:%SZ")
-    
+
     # Trigger release if last commit time was less than some time ago
     if last_commit_time > datetime.now() - time_treshold:
         LOGGER.info(
@@ -166,46 +219,401 @@ def was_branch_last_commit_recent(repo, branch_name, time_treshold=timedelta(hou
         return True
     return False
 
-def push_all_to_github(repo, branch_name, directory, commit_message):
+def get_dispatch_metadata(session, repo_name, commit_hash=None, branch_name=None):
+    """
+    Get all GitHub metadata needed to handle a dispatch event.
+    By default, the metadata is fetched with a single GraphQL query, and the REST API is used if it fails.
+    Setting the GITHUB_METADATA_API environment variable to "rest" uses the REST API directly, whose responses
+    can be revalidated from the cache of the session.
+    Parameters
+    ----------
+    session : requests.Session
+        The GitHub API session, as returned by `create_api_sessions`.
+    repo_name : str
+        The project repo name.
+    commit_hash : str, optional
+        The hash of the commit of which to get the message.
+    branch_name : str, optional
+        The name of the branch of which to get the last commit date.
+    Returns
+    -------
+    dict
+        The metadata, with the following keys (None if the project or feedstock repository does not exist):
+         * project_clone_url: the clone url of the project repository.
+         * feedstock_name: the full name of the feedstock repository.
+         * feedstock_clone_url: the clone url of the feedstock repository.
+         * commit_message: the message of the commit (None if no commit hash was given).
+         * branch_commit_date: the date of the last commit of the branch (None if no branch name was given).
+         * branch_commit_sha: the hash of the last commit of the branch (None if no branch name was given).
+    """
+    import requests
+
+    with instrument.span("github_metadata", repository=repo_name):
+        if os.environ.get("GITHUB_METADATA_API", "graphql") == "graphql":
+            try:
+                return fetch_dispatch_metadata_graphql(session, repo_name, commit_hash, branch_name)
+            except (requests.RequestException, KeyError, TypeError, ValueError) as e:
+                LOGGER.warning("GraphQL metadata query failed (%s), falling back to the REST API", e)
+        return fetch_dispatch_metadata_rest(session, repo_name, commit_hash, branch_name)
+
+def fetch_dispatch_metadata_graphql(session, repo_name, commit_hash=None, branch_name=None, graphql_url=None):
+    """
+    Get all GitHub metadata needed to handle a dispatch event, in a single GraphQL query.
+    Parameters
+    ----------
+    session : requests.Session
+        The GitHub API session.
+    repo_name : str
+        The project repo name.
+    commit_hash : str, optional
+        The hash of the commit of which to get the message.
+    branch_name : str, optional
+        The name of the branch of which to get the last commit date.
+    graphql_url : str, optional
+        The GraphQL endpoint (default: GITHUB_GRAPHQL_URL environment variable, or https://api.github.com/graphql).
+    Returns
+    -------
+    dict
+        The metadata, as described in `get_dispatch_metadata`.
+    """
+    graphql_url = graphql_url or os.environ.get("GITHUB_GRAPHQL_URL", "https://api.github.com/graphql")
+    owner, name = repo_name.split("/")
+    feedstock_repo_name = repo_name + "-feedstock"
+
+    # Only query the commit and branch information that is needed
+    fields = ["url"]
+    variables = dict(owner=owner, name=name, feedstock=name + "-feedstock")
+    definitions = ["$owner: String!", "$name: String!", "$feedstock: String!"]
+    if commit_hash is not None:
+        fields.append("commit: object(oid: $sha) { ... on Commit { message } }")
+        definitions.append("$sha: GitObjectID!")
+        variables["sha"] = commit_hash
+    if branch_name is not None:
+        fields.append("branch: ref(qualifiedName: $branch) { target { ... on Commit { oid authoredDate } } }")
+        definitions.append("$branch: String!")
+        variables["branch"] = "refs/heads/" + branch_name
+    query = """query(%s) {
+        project: repository(owner: $owner, name: $name) { %s }
+        feedstock: repository(owner: $owner, name: $feedstock) { url }
+    }""" % (", ".join(definitions), " ".join(fields))
+
+    response = session.post(graphql_url, json=dict(query=query, variables=variables))
+    result = response.json()
+    data = result.get("data") or {}
+
+    # Repositories that do not exist are returned as null with a NOT_FOUND error, other errors are unexpected
+    errors = [error for error in result.get("errors", []) if error.get("type") != "NOT_FOUND"]
+    if errors:
+        raise ValueError("; ".join(error.get("message", str(error)) for error in errors))
+    if data.get("project") is None:
+        LOGGER.error("repository_dispatch event: repository '%s' not found" % repo_name)
+        return None
+    if data.get("feedstock") is None:
+        LOGGER.error(
+            "repository_dispatch event: feedstock repository of '%s' not found" % repo_name)
+        return None
+
+    project = data["project"]
+    return dict(
+        project_clone_url=project["url"] + ".git",
+        feedstock_name=feedstock_repo_name,
+        feedstock_clone_url=data["feedstock"]["url"] + ".git",
+        commit_message=project["commit"]["message"] if commit_hash is not None else None,
+        branch_commit_date=project["branch"]["target"]["authoredDate"] if branch_name is not None else None,
+        branch_commit_sha=project["branch"]["target"]["oid"] if branch_name is not None else None,
+    )
+
+def get_branches_metadata(session, targets):
+    """
+    Get the GitHub metadata needed to handle nightly events for several repositories and branches.
+    The metadata of all targets is fetched with a single GraphQL query. If it fails, the REST API is used instead.
+    Parameters
+    ----------
+    session : requests.Session
+        The GitHub API session, as returned by `create_api_sessions`.
+    targets : list[tuple[str, str]]
+        The project repo names and branch names.
+    Returns
+    -------
+    list[dict]
+        The metadata of each target, as described in `get_dispatch_metadata`.
+    """
+    with instrument.span("github_metadata", targets=len(targets)):
+        return _get_branches_metadata(session, targets)
+
+def _get_branches_metadata(session, targets):
+    import requests
+
+    if os.environ.get("GITHUB_METADATA_API", "graphql") == "graphql":
+        try:
+            return fetch_branches_metadata_graphql(session, targets)
+        except (requests.RequestException, KeyError, TypeError, ValueError) as e:
+            LOGGER.warning("GraphQL metadata query failed (%s), falling back to the REST API", e)
+
+    def fetch_target_metadata(repo_name, branch_name):
+        # A missing repository or branch must not prevent the other targets from being handled
+        try:
+            return fetch_dispatch_metadata_rest(session, repo_name, branch_name=branch_name)
+        except requests.RequestException as e:
+            LOGGER.error("could not get metadata of %s@%s (%s)", repo_name, branch_name, e)
+            return None
+
+    results = run_concurrently({
+        i: (lambda repo_name=repo_name, branch_name=branch_name: fetch_target_metadata(repo_name, branch_name))
+        for i, (repo_name, branch_name) in enumerate(targets)
+    }, max_workers=8)
+    return [results[i] for i in range(len(targets))]
+
+def fetch_branches_metadata_graphql(session, targets, graphql_url=None):
+    """
+    Get the GitHub metadata needed to handle nightly events for several repositories and branches,
+    in a single GraphQL query.
+    Parameters
+    ----------
+    session : requests.Session
+        The GitHub API session.
+    targets : list[tuple[str, str]]
+        The project repo names and branch names.
+    graphql_url : str, optional
+        The GraphQL endpoint (default: GITHUB_GRAPHQL_URL environment variable, or https://api.github.com/graphql).
+    Returns
+    -------
+    list[dict]
+        The metadata of each target, as described in `get_dispatch_metadata`.
+    """
+    graphql_url = graphql_url or os.environ.get("GITHUB_GRAPHQL_URL", "https://api.github.com/graphql")
+    fields = []
+    for i, (repo_name, branch_name) in enumerate(targets):
+        owner, name = repo_name.split("/")
+        fields.append(
+            'project%d: repository(owner: %s, name: %s) { url branch: ref(qualifiedName: %s) '
+            '{ target { ... on Commit { oid authoredDate } } } }' % (
+                i, json.dumps(owner), json.dumps(name), json.dumps("refs/heads/" + branch_name)))
+        fields.append('feedstock%d: repository(owner: %s, name: %s) { url }' % (
+            i, json.dumps(owner), json.dumps(name + "-feedstock")))
+    query = "query { %s }" % " ".join(fields)
+
+    response = session.post(graphql_url, json=dict(query=query))
+    result = response.json()
+    data = result.get("data") or {}
+    errors = [error for error in result.get("errors", []) if error.get("type") != "NOT_FOUND"]
+    if errors:
+        raise ValueError("; ".join(error.get("message", str(error)) for error in errors))
+
+    metadata = []
+    for i, (repo_name, branch_name) in enumerate(targets):
+        project, feedstock = data.get("project%d" % i), data.get("feedstock%d" % i)
+        if project is None or feedstock is None:
+            LOGGER.error("repository_dispatch event: repository '%s' or its feedstock not found" % repo_name)
+            metadata.append(None)
+        elif project["branch"] is None:
+            LOGGER.error("repository_dispatch event: branch '%s' of '%s' not found" % (branch_name, repo_name))
+            metadata.append(None)
+        else:
+            metadata.append(dict(
+                project_clone_url=project["url"] + ".git",
+                feedstock_name=repo_name + "-feedstock",
+                feedstock_clone_url=feedstock["url"] + ".git",
+                commit_message=None,
+                branch_commit_date=project["branch"]["target"]["authoredDate"],
+                branch_commit_sha=project["branch"]["target"]["oid"],
+            ))
+    return metadata
+
+def fetch_dispatch_metadata_rest(session, repo_name, commit_hash=None, branch_name=None, api_url=None):
+    """
+    Get all GitHub metadata needed to handle a dispatch event, through the REST API.
+    Parameters
+    ----------
+    session : requests.Session
+        The GitHub API session.
+    repo_name : str
+        The project repo name.
+    commit_hash : str, optional
+        The hash of the commit of which to get the message.
+    branch_name : str, optional
+        The name of the branch of which to get the last commit date.
+    api_url : str, optional
+        The REST API endpoint (default: GITHUB_API_URL environment variable, or https://api.github.com).
+    Returns
+    -------
+    dict
+        The metadata, as described in `get_dispatch_metadata`.
+    """
+    import requests
+
+    api_url = api_url or os.environ.get("GITHUB_API_URL", "https://api.github.com")
+    feedstock_repo_name = repo_name + "-feedstock"
+
+    def get_feedstock_repo():
+        try:
+            return session.get("%s/repos/%s" % (api_url, feedstock_repo_name)).json()
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                return None
+            raise
+
+    # Get the repositories, and the commit and branch information, concurrently
+    tasks = {
+        "project": lambda: session.get("%s/repos/%s" % (api_url, repo_name)).json(),
+        "feedstock": get_feedstock_repo,
+    }
+    if commit_hash is not None:
+        tasks["commit"] = lambda: session.get("%s/repos/%s/commits/%s" % (api_url, repo_name, commit_hash)).json()
+    if branch_name is not None:
+        tasks["branch"] = lambda: session.get("%s/repos/%s/branches/%s" % (api_url, repo_name, branch_name)).json()
+    results = run_concurrently(tasks)
+
+    # If feedstock repo does not exist, log an error and exit
+    if results["feedstock"] is None:
+        LOGGER.error(
+            "repository_dispatch event: feedstock repository of '%s' not found" % repo_name)
+        return None
+
+    return dict(
+        project_clone_url=results["project"]["clone_url"],
+        feedstock_name=feedstock_repo_name,
+        feedstock_clone_url=results["feedstock"]["clone_url"],
+        commit_message=results["commit"]["commit"]["message"] if commit_hash is not None else None,
+        branch_commit_date=results["branch"]["commit"]["commit"]["author"]["date"] if branch_name is not None else None,
+        branch_commit_sha=results["branch"]["commit"]["sha"] if branch_name is not None else None,
+    )
+
+def fetch_file_text(session, repo_name, path, ref, api_url=None):
+    """
+    Get the content of a file of a repository through the contents API, without cloning it.
+    Parameters
+    ----------
+    session : requests.Session
+        The GitHub API session.
+    repo_name : str
+        The full name of the repository.
+    path : str
+        The path of the file in the repository.
+    ref : str
+        The branch, tag or commit to read the file from.
+    api_url : str, optional
+        The REST API endpoint (default: GITHUB_API_URL environment variable, or https://api.github.com).
+    Returns
+    -------
+    str
+        The content of the file.
+    """
+    api_url = api_url or os.environ.get("GITHUB_API_URL", "https://api.github.com")
+    data = session.get("%s/repos/%s/contents/%s" % (api_url, repo_name, path), params=dict(ref=ref)).json()
+    if data.get("type") != "file":
+        raise ValueError("%s is not a file in %s" % (path, repo_name))
+    return base64.b64decode(data["content"]).decode("utf-8")
+
+def fetch_commit_messages(session, repo_name, base, head, api_url=None):
+    """
+    Get the messages of the commits between two commits, with a single request to the compare API.
+    Parameters
+    ----------
+    session : requests.Session
+        The GitHub API session.
+    repo_name : str
+        The full name of the repository.
+    base : str
+        The commit before the first commit, e.g. the "before" field of a push event.
+    head : str
+        The last commit.
+    api_url : str, optional
+        The REST API endpoint (default: GITHUB_API_URL environment variable, or https://api.github.com).
+    Returns
+    -------
+    list[str]
+        The commit messages, from the oldest to the newest.
+    """
+    api_url = api_url or os.environ.get("GITHUB_API_URL", "https://api.github.com")
+    data = session.get("%s/repos/%s/compare/%s...%s" % (api_url, repo_name, base, head)).json()
+    return [commit["commit"]["message"] for commit in data["commits"]]
+
+def fetch_directory_ids(session, repo_name, path, ref, api_url=None):
+    """
+    Get the git object ids of the entries of a directory of a repository through the contents API, without cloning it.
+    The id of a sub-directory is the id of its tree, as in `rerender_cache.get_input_ids`.
+    Parameters
+    ----------
+    session : requests.Session
+        The GitHub API session.
+    repo_name : str
+        The full name of the repository.
+    path : str
+        The path of the directory in the repository, "" for the root.
+    ref : str
+        The branch, tag or commit to read the directory from.
+    api_url : str, optional
+        The REST API endpoint (default: GITHUB_API_URL environment variable, or https://api.github.com).
+    Returns
+    -------
+    dict[str, str]
+        The object id of each entry, by name.
+    """
+    api_url = api_url or os.environ.get("GITHUB_API_URL", "https://api.github.com")
+    data = session.get("%s/repos/%s/contents/%s" % (api_url, repo_name, path), params=dict(ref=ref)).json()
+    if not isinstance(data, list):
+        raise ValueError("%s is not a directory in %s" % (path or "/", repo_name))
+    return {entry["name"]: entry["sha"] for entry in data}
+
+@instrument.span("push")
+def push_all_to_github(repo, branch_name, directory, commit_message, backend=None):
     """
     Push all files in a directory to a github repository.
     Parameters
     ----------
-    repo : github.Repository.Repository
-        The repository.
+    repo : str
+        The full name of the repository.
     branch_name : str
         The branch name.
     directory : str
         The directory to push.
     commit_message : str
         The commit message.
+    backend : str, optional
+        The git backend, "pygit2" or "subprocess" (default: GIT_BACKEND environment variable, or "pygit2").
+    Returns
+    -------
+    str
+        The id of the pushed head commit, which the remote accepted.
+    Raises
+    ------
+    subprocess.CalledProcessError, pygit2.GitError
+        If the push failed, or the remote rejected the branch or a tag, see `git_backend.push`.
     """
-    # Add all files
-    subprocess.run(["git", "add", "."], cwd=directory)
+    import git_backend
+    instrument.annotate(repository=repo, branch=branch_name)
 
-    # Commit with proper commit message
-    subprocess.run(["git", "commit", "-m", commit_message], cwd=directory)
+    # Add all files, and commit with proper commit message
+    git_backend.commit(directory, commit_message, stage=True, backend=backend)
 
     # Get url to push to
-    repo_auth_url = "https://%s@github.com/%s.git" % (os.environ["GH_TOKEN"], repo)
+    repo_url = "%s/%s.git" % (os.environ.get("GITHUB_SERVER_URL", "https://github.com"), repo)
 
     # Push changes and tags
-    subprocess.run(["git", "push", "--all", "-f", repo_auth_url], cwd=directory)
-    subprocess.run(["git", "push", repo_auth_url, branch_name, "--tags"], cwd=directory)
+    git_backend.push(directory, repo_url, branch_name, os.environ["GH_TOKEN"], backend=backend)
+    return git_backend.get_head_id(directory)
 
-def create_api_sessions(github_token):
+def create_api_sessions(github_token, with_github=True, budget=None):
     """Create API sessions for GitHub.
     Parameters
     ----------
     github_token : str
         The GitHub access token.
+    with_github : bool
+        If False, do not build the PyGithub object, which saves importing PyGithub.
+    budget : int, optional
+        Maximum number of requests sent with the session, 0 for no limit (default: API_BUDGET environment variable).
     Returns
     -------
     session : requests.Session
-        A `requests` session w/ the beta `check_run` API configured.
+        A `requests` session w/ the beta `check_run` API configured, following the rate limits of the API within its
+        budget, and GET responses cached on disk.
     gh : github.MainClass.Github
-        A `Github` object from the PyGithub package.
+        A `Github` object from the PyGithub package, None if `with_github` is False.
     """
+    import requests
+
     # based on
     #  https://alexwlchan.net/2019/03/
     #    creating-a-github-action-to-auto-merge-pull-requests/
@@ -228,33 +636,360 @@ def create_api_sessions(github_token):
             print('ERROR:', resp.text)
             raise e
 
+    def count_request(resp, *args, **kwargs):
+        instrument.count("github_api_calls")
+        if getattr(resp, "from_cache", False):
+            instrument.count("github_api_cache_hits")
+        else:
+            instrument.count("http_bytes", len(resp.content))
+
+    sess.hooks["response"].append(count_request)
     sess.hooks["response"].append(raise_for_status)
 
-    # build a github object too
+    # Follow the rate limits of the API, and revalidate repeated GET requests with conditional requests, from a cache
+    # persisted between runs
+    if os.environ.get("HTTP_CACHE", "1") != "0":
+        from http_cache import CachingHTTPAdapter as adapter_class
+    else:
+        from rate_limit import RateLimitedHTTPAdapter as adapter_class
+    adapter = adapter_class(budget=budget)
+    sess.mount("https://", adapter)
+    sess.mount("http://", adapter)
+
+    if not with_github:
+        return sess, None
+
+    # build a github object too, which waits for the rate limits with the retry policy of PyGithub
+    from github import Github, GithubRetry
     gh = Github(
         github_token,
-        retry=urllib3.util.retry.Retry(total=10, backoff_factor=0.1))
+        base_url=os.environ.get("GITHUB_API_URL", "https://api.github.com"),
+        retry=GithubRetry())
 
     return sess, gh
 
-def clone_repo(clone_url, clone_path, branch, auth_token):
+@instrument.span("clone")
+def clone_repo(clone_url, clone_path, branch, auth_token, depth=None, single_branch=False, blob_filter=None, mirror_cache=False, sparse_paths=None):
+    """
+    Clone a repository and check out a given branch.
+    Parameters
+    ----------
+    clone_url : str
+        The url to clone the repository from.
+    clone_path : str
+        The path to clone the repository to.
+    branch : str
+        The branch to check out.
+    auth_token : str
+        The GitHub access token.
+    depth : int, optional
+        If set, only fetch this many commits of history (shallow clone).
+    single_branch : bool
+        If True, only fetch the given branch instead of all branches.
+    blob_filter : str, optional
+        If set, make a partial clone using this object filter (e.g. "blob:none"), so that file contents
+        are only downloaded when they are needed for the checkout.
+    mirror_cache : bool
+        If True, update the cached bare mirror of the repository and make the checkout from it, sharing its objects.
+        Only the new objects are then fetched from GitHub.
+    sparse_paths : list[str], optional
+        If set, only check out these files, with a sparse checkout (see `set_sparse_checkout`).
+    Returns
+    -------
+    pygit2_repo : pygit2.Repository
+        The cloned repository.
+    pygit2_ref : pygit2.Reference
+        The reference of the remote branch that was checked out.
+    """
+    instrument.annotate(url=clone_url, branch=branch)
+
+    import pygit2
+
+    # Replace any checkout left over by a previous run
+    if os.path.exists(clone_path):
+        LOGGER.info("removing existing directory %s", clone_path)
+        shutil.rmtree(clone_path)
+
+    if mirror_cache:
+        from mirror_cache import update_mirror
+        with update_mirror(clone_url, branch, auth_token) as mirror_path:
+            # A local clone sharing the objects of the mirror is made, so the depth and filter are not needed
+            LOGGER.info("cloning %s (branch=%s) from mirror %s", clone_url, branch, mirror_path)
+            subprocess.run(["git", "clone", "--quiet", "--shared", "--single-branch", "--branch", branch,
+                            *(["--no-checkout"] if sparse_paths else []), mirror_path, clone_path], check=True)
+        subprocess.run(["git", "remote", "set-url", "origin", clone_url], cwd=clone_path, check=True)
+        if sparse_paths:
+            set_sparse_checkout(clone_path, sparse_paths, branch=branch)
+        pygit2_repo = pygit2.Repository(clone_path)
+        pygit2_ref = pygit2_repo.lookup_reference("refs/remotes/origin/" + branch)
+        return pygit2_repo, pygit2_ref
+
+    if depth or single_branch or blob_filter or sparse_paths:
+        # libgit2 has no support for partial clones nor sparse checkouts, so limited clones are made with the git CLI
+        clone_command = ["git", *git_auth_args(auth_token), "clone", "--branch", branch]
+        if depth:
+            # A depth implies --single-branch, unless --no-single-branch is given
+            clone_command += ["--depth", str(depth)]
+            if not single_branch:
+                clone_command.append("--no-single-branch")
+        elif single_branch:
+            clone_command.append("--single-branch")
+        if blob_filter:
+            clone_command.append("--filter=%s" % blob_filter)
+        if sparse_paths:
+            clone_command.append("--no-checkout")
+        clone_command += [clone_url, clone_path]
+        LOGGER.info("cloning %s (branch=%s, depth=%s, single_branch=%s, filter=%s, sparse=%s)",
+                    clone_url, branch, depth, single_branch, blob_filter, bool(sparse_paths))
+        subprocess.run(clone_command, check=True)
+        if sparse_paths:
+            # With a partial clone, only the blobs of the checked out files are downloaded
+            set_sparse_checkout(clone_path, sparse_paths, branch=branch)
+        instrument.count("clone_bytes", get_pack_size(clone_path))
+        pygit2_repo = pygit2.Repository(clone_path)
+        pygit2_ref = pygit2_repo.lookup_reference("refs/remotes/origin/" + branch)
+        return pygit2_repo, pygit2_ref
+
     # Use pygit2 to clone the repo to disk
     # if using github app pem key token, use x-access-token like below
     # if you were using a personal access token, use auth_method = 'x-oauth-basic' AND reverse the auth_method and token parameters
     auth_method = 'x-access-token'
     callbacks = pygit2.RemoteCallbacks(pygit2.UserPass(auth_method, auth_token))
+    # Create the local branch and check it out directly
     pygit2_repo = pygit2.clone_repository(clone_url, clone_path,
-                                          callbacks=callbacks)
-    branches_list = list(pygit2_repo.branches)
-    print('All branches:')
-    print(branches_list)
-    pygit2_branch = pygit2_repo.branches['origin/' + branch]
-    pygit2_ref = pygit2_repo.lookup_reference(pygit2_branch.name)
-    pygit2_repo.checkout(pygit2_ref)
-    # Checkout correct branch
-    subprocess.run(["git", "checkout", branch], cwd=clone_path)
+                                          callbacks=callbacks, checkout_branch=branch)
+    instrument.count("clone_bytes", get_pack_size(clone_path))
+    pygit2_ref = pygit2_repo.lookup_reference("refs/remotes/origin/" + branch)
     return pygit2_repo, pygit2_ref
 
+def set_sparse_checkout(repo_path, paths, branch=None, add=False):
+    """
+    Limit the working tree of a repository to some files, with a sparse checkout in non-cone mode.
+    The other files are neither written to disk nor seen as deleted by the git CLI, but they are by libgit2, so the
+    changes of a sparse working tree must be staged and committed with the "subprocess" git backend.
+    Parameters
+    ----------
+    repo_path : str
+        The repository directory.
+    paths : list[str]
+        The paths of the files to check out, relative to the repository directory.
+    branch : str, optional
+        If set, check out this branch after setting the paths, e.g. after a clone made with --no-checkout.
+    add : bool
+        If True, add the paths to the ones already checked out, instead of replacing them.
+    """
+    patterns = ["/" + path.lstrip("/") for path in paths]
+    if add:
+        subprocess.run(["git", "sparse-checkout", "add", *patterns], cwd=repo_path, check=True)
+    else:
+        subprocess.run(["git", "sparse-checkout", "set", "--no-cone", *patterns], cwd=repo_path, check=True)
+    if branch is not None:
+        subprocess.run(["git", "checkout", "--quiet", branch], cwd=repo_path, check=True)
+    LOGGER.info("sparse checkout of %s in %s", ", ".join(paths), repo_path)
+
+def get_pack_size(repo_path):
+    """
+    Get the size of the pack files of a fresh clone, which is close to the number of bytes that were downloaded.
+    """
+    pack_dir = os.path.join(repo_path, ".git", "objects", "pack")
+    try:
+        return sum(entry.stat().st_size for entry in os.scandir(pack_dir) if entry.name.endswith(".pack"))
+    except FileNotFoundError:
+        return 0
+
+def git_auth_args(auth_token):
+    """
+    Get the git command line options that authenticate HTTPS requests with a GitHub token.
+    The token is passed as an extra header, so that it is never written to the config of the cloned repository.
+    Parameters
+    ----------
+    auth_token : str
+        The GitHub access token.
+    Returns
+    -------
+    list[str]
+        Options to insert between "git" and the git subcommand.
+    """
+    if not auth_token:
+        return []
+    credentials = base64.b64encode(("x-access-token:%s" % auth_token).encode("utf-8")).decode("ascii")
+    return ["-c", "http.extraHeader=Authorization: Basic %s" % credentials]
+
+def get_clone_options():
+    """
+    Get the clone options from the environment.
+    The options are read from the following environment variables:
+     * CLONE_DEPTH: number of commits to fetch, 0 for the full history (default: 1).
+     * CLONE_SINGLE_BRANCH: only fetch the target branch, "0" to fetch all branches (default: "1").
+     * CLONE_FILTER: object filter for partial clones, e.g. "blob:none" (default: no filter).
+     * MIRROR_CACHE: "1" to clone from a persistent local mirror of the repositories (default: "0").
+    Returns
+    -------
+    dict
+        Keyword arguments for `clone_repo`.
+    """
+    return dict(
+        depth=int(os.environ.get("CLONE_DEPTH", "1")) or None,
+        single_branch=os.environ.get("CLONE_SINGLE_BRANCH", "1") != "0",
+        blob_filter=os.environ.get("CLONE_FILTER") or None,
+        mirror_cache=os.environ.get("MIRROR_CACHE", "0") == "1",
+    )
+
+def get_cache_dir(*parts):
+    """
+    Get the path of a directory in the persistent cache of the action.
+    The cache is located in the CACHE_DIR environment variable, or in ~/.cache/webservices-dispatch by default.
+    Parameters
+    ----------
+    *parts : str
+        Path components of the directory inside of the cache.
+    Returns
+    -------
+    str
+        The path of the directory.
+    """
+    cache_dir = os.environ.get("CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "webservices-dispatch")
+    return os.path.join(cache_dir, *parts)
+
+def write_text_atomic(path, text):
+    """
+    Write a text file through a temporary file, so that concurrent readers never see a partial file.
+    The temporary file has a unique name, so that threads and processes writing the same file do not interfere, the
+    last writer wins. If the file exists, its permissions are kept.
+    Parameters
+    ----------
+    path : str
+        The path of the file.
+    text : str
+        The content of the file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".%s." % os.path.basename(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as fp:
+            fp.write(text)
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+        except FileNotFoundError:
+            pass
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def write_json_atomic(path, data, indent=None):
+    """
+    Write data to a JSON file atomically, see `write_text_atomic`.
+    Parameters
+    ----------
+    path : str
+        The path of the file.
+    data : object
+        The data, which must be serializable to JSON.
+    indent : int, optional
+        The indentation of the JSON document.
+    """
+    write_text_atomic(path, json.dumps(data, indent=indent))
+
+def run_streaming(command, cwd=None, on_line=None, timeout=None, tail_size=200, name=None):
+    """
+    Run a command, logging its output line by line while it runs.
+    The command runs in its own process group, which is killed if the command exceeds its timeout.
+    Parameters
+    ----------
+    command : list[str]
+        The command to run.
+    cwd : str, optional
+        The directory to run the command in.
+    on_line : callable, optional
+        Function called with each line of output (stdout and stderr), as soon as it is read.
+    timeout : float, optional
+        The maximum wall-clock time of the command, in seconds.
+    tail_size : int
+        The number of last lines of output that are kept.
+    name : str, optional
+        The name of the command in the logs (default: the first element of the command).
+    Returns
+    -------
+    returncode : int
+        The exit code of the command.
+    tail : list[str]
+        The last lines of output of the command.
+    Raises
+    ------
+    subprocess.TimeoutExpired
+        If the command exceeded its timeout, with the last lines of output as `output`.
+    """
+    name = name or command[0]
+    tail = collections.deque(maxlen=tail_size)
+    process = subprocess.Popen(command, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               stdin=subprocess.DEVNULL, start_new_session=True)
+    deadline = time.monotonic() + timeout if timeout else None
+
+    def handle_line(line):
+        line = line.decode("utf-8", errors="replace").rstrip("\r")
+        tail.append(line)
+        LOGGER.info("%s: %s", name, line)
+        if on_line is not None:
+            on_line(line)
+
+    # Read raw chunks, since progress bars may not end their lines
+    selector = selectors.DefaultSelector()
+    buffers = {}
+    for stream in (process.stdout, process.stderr):
+        selector.register(stream, selectors.EVENT_READ)
+        buffers[stream] = b""
+    try:
+        while selector.get_map():
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                kill_process_group(process)
+                raise subprocess.TimeoutExpired(command, timeout, output="\n".join(tail))
+            for key, _ in selector.select(timeout=remaining):
+                chunk = os.read(key.fileobj.fileno(), 65536)
+                if not chunk:
+                    selector.unregister(key.fileobj)
+                    if buffers[key.fileobj]:
+                        handle_line(buffers[key.fileobj])
+                    continue
+                *lines, buffers[key.fileobj] = (buffers[key.fileobj] + chunk).split(b"\n")
+                for line in lines:
+                    handle_line(line)
+    finally:
+        selector.close()
+        process.stdout.close()
+        process.stderr.close()
+
+    remaining = None if deadline is None else max(0, deadline - time.monotonic())
+    try:
+        returncode = process.wait(timeout=remaining)
+    except subprocess.TimeoutExpired:
+        kill_process_group(process)
+        raise subprocess.TimeoutExpired(command, timeout, output="\n".join(tail))
+    return returncode, list(tail)
+
+def kill_process_group(process, grace_period=10):
+    """
+    Terminate the process group of a process started with `start_new_session=True`, and kill it if it does not
+    terminate within a grace period.
+    Parameters
+    ----------
+    process : subprocess.Popen
+        The process.
+    grace_period : float
+        The time, in seconds, given to the processes to terminate.
+    """
+    LOGGER.warning("terminating process group of %s", process.args)
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=grace_period)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+    except ProcessLookupError:
+        pass
+
 def get_var_values(var_retrieve, root=''):
     ret = {}
     for var, file, regex in var_retrieve: